@@ -0,0 +1,162 @@
+"""
+Cache do catálogo de ferramentas dos agentes.
+Guarda, por agente, o array `tools` já no formato OpenAI (ferramentas do banco, tools
+dos clientes MCP conectados e a busca no RAG), para que o turno não precise consultar
+e converter tudo de novo a cada mensagem.
+"""
+from typing import Optional, List, Dict, Any, Tuple
+from datetime import datetime
+import threading
+import time
+from sqlalchemy.orm import Session
+
+
+# Ferramenta de busca na base de conhecimento (agentes com RAG vinculado)
+TOOL_BUSCA_RAG = {
+    "type": "function",
+    "function": {
+        "name": "buscar_base_conhecimento",
+        "description": "Busca informações relevantes na base de conhecimento do treinamento para responder perguntas do usuário",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "query": {
+                    "type": "string",
+                    "description": "A pergunta ou consulta para buscar na base de conhecimento"
+                },
+                "num_resultados": {
+                    "type": "integer",
+                    "description": "Número de resultados a retornar (padrão: 3)",
+                    "default": 3
+                }
+            },
+            "required": ["query"]
+        }
+    }
+}
+
+
+class CatalogoFerramentas:
+    """
+    Catálogo compilado por agente, com versão.
+
+    Uma versão global (mudou uma ferramenta, que pode estar em vários agentes) e uma por
+    agente (vínculos, clientes MCP, RAG). Um catálogo só é usado se foi construído na
+    versão atual; uma invalidação durante a construção descarta o resultado construído.
+    """
+
+    def __init__(self):
+        self._catalogos: Dict[int, Dict[str, Any]] = {}
+        self._versao_global = 0
+        self._versoes_agente: Dict[int, int] = {}
+        self._lock = threading.Lock()
+
+        # Métricas
+        self._acertos = 0
+        self._construcoes = 0
+        self._invalidacoes = 0
+        self._tempo_construcao_ms = 0.0
+        self._ultima_construcao_ms = 0.0
+
+    def _versao(self, agente_id: int) -> Tuple[int, int]:
+        return self._versao_global, self._versoes_agente.get(agente_id, 0)
+
+    def obter(self, db: Session, agente) -> Optional[List[Dict[str, Any]]]:
+        """
+        Retorna o array `tools` do agente (None se não houver ferramentas).
+        A lista é uma cópia: quem chama pode acrescentar itens sem afetar o cache.
+        """
+        with self._lock:
+            versao = self._versao(agente.id)
+            catalogo = self._catalogos.get(agente.id)
+            if catalogo and catalogo["versao"] == versao and catalogo["rag_id"] == agente.rag_id:
+                self._acertos += 1
+                return list(catalogo["tools"]) or None
+
+        inicio = time.time()
+        tools = CatalogoFerramentas.construir(db, agente)
+        duracao_ms = (time.time() - inicio) * 1000
+
+        with self._lock:
+            self._construcoes += 1
+            self._tempo_construcao_ms += duracao_ms
+            self._ultima_construcao_ms = duracao_ms
+            if self._versao(agente.id) == versao:
+                self._catalogos[agente.id] = {
+                    "versao": versao,
+                    "rag_id": agente.rag_id,
+                    "tools": tools,
+                    "construido_em": datetime.now()
+                }
+        print(f"🧰 [AGENTE] Catálogo de ferramentas do agente {agente.id} construído: {len(tools)} tool(s) em {duracao_ms:.1f}ms")
+        return list(tools) or None
+
+    @staticmethod
+    def construir(db: Session, agente) -> List[Dict[str, Any]]:
+        """Monta o array `tools` do agente a partir do banco."""
+        from agente.agente_service import AgenteService
+        from ferramenta.ferramenta_service import FerramentaService
+        from mcp_client.mcp_service import MCPService
+
+        tools = []
+
+        # Ferramentas ativas do agente (apenas as PRINCIPAL são convertidas)
+        for ferramenta in AgenteService.listar_ferramentas(db, agente.id):
+            tool_openai = FerramentaService.converter_para_openai_format(ferramenta)
+            if tool_openai:
+                tools.append(tool_openai)
+
+        # Tools dos clientes MCP ativos e conectados
+        for mcp_client in MCPService.listar_ativos_por_agente(db, agente.id):
+            if not mcp_client.conectado:
+                continue
+            for mcp_tool in MCPService.listar_tools_ativas(db, mcp_client.id):
+                tools.append(MCPService.converter_mcp_tool_para_openai(mcp_client, mcp_tool))
+
+        # Busca RAG se o agente tiver treinamento vinculado
+        if agente.rag_id:
+            tools.append(TOOL_BUSCA_RAG)
+
+        return tools
+
+    def invalidar_agente(self, agente_id: Optional[int]):
+        """Descarta o catálogo de um agente (vínculos, clientes MCP ou RAG alterados)."""
+        if agente_id is None:
+            return
+        with self._lock:
+            self._versoes_agente[agente_id] = self._versoes_agente.get(agente_id, 0) + 1
+            self._catalogos.pop(agente_id, None)
+            self._invalidacoes += 1
+
+    def invalidar_todos(self):
+        """Descarta todos os catálogos (uma ferramenta foi criada, alterada ou apagada)."""
+        with self._lock:
+            self._versao_global += 1
+            self._catalogos.clear()
+            self._invalidacoes += 1
+
+    def obter_metricas(self) -> Dict[str, Any]:
+        """Retorna acertos, construções e tempo de construção do catálogo."""
+        with self._lock:
+            consultas = self._acertos + self._construcoes
+            return {
+                "agentes_em_cache": len(self._catalogos),
+                "versao_global": self._versao_global,
+                "acertos": self._acertos,
+                "construcoes": self._construcoes,
+                "taxa_acerto": round(self._acertos / consultas, 3) if consultas else 0,
+                "invalidacoes": self._invalidacoes,
+                "tempo_medio_construcao_ms": round(self._tempo_construcao_ms / self._construcoes, 2) if self._construcoes else 0,
+                "ultima_construcao_ms": round(self._ultima_construcao_ms, 2),
+                "agentes": {
+                    agente_id: {
+                        "tools": len(catalogo["tools"]),
+                        "construido_em": catalogo["construido_em"].isoformat()
+                    }
+                    for agente_id, catalogo in self._catalogos.items()
+                }
+            }
+
+
+# Instância global do catálogo de ferramentas
+catalogo_ferramentas = CatalogoFerramentas()
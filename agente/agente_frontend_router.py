@@ -116,9 +116,11 @@ def criar_agente(
     agente_publico: str = Form(...),
     agente_restricoes: str = Form(...),
     modelo_llm: Optional[str] = Form(None),
+    modelo_visao: Optional[str] = Form(None),
     temperatura: Optional[str] = Form(None),
     max_tokens: Optional[str] = Form(None),
     top_p: Optional[str] = Form(None),
+    imagens_brutas_historico: int = Form(0),
     ativo: bool = Form(True),
     db: Session = Depends(get_db)
 ):
@@ -137,9 +139,11 @@ def criar_agente(
             agente_publico=agente_publico,
             agente_restricoes=agente_restricoes,
             modelo_llm=modelo_llm if modelo_llm else None,
+            modelo_visao=modelo_visao if modelo_visao else None,
             temperatura=temperatura if temperatura else None,
             max_tokens=max_tokens if max_tokens else None,
             top_p=top_p if top_p else None,
+            imagens_brutas_historico=imagens_brutas_historico,
             ativo=ativo
         )
         
@@ -168,9 +172,11 @@ def atualizar_agente(
     agente_publico: str = Form(...),
     agente_restricoes: str = Form(...),
     modelo_llm: Optional[str] = Form(None),
+    modelo_visao: Optional[str] = Form(None),
     temperatura: Optional[str] = Form(None),
     max_tokens: Optional[str] = Form(None),
     top_p: Optional[str] = Form(None),
+    imagens_brutas_historico: int = Form(0),
     ativo: bool = Form(True),
     db: Session = Depends(get_db)
 ):
@@ -196,9 +202,11 @@ def atualizar_agente(
             agente_publico=agente_publico,
             agente_restricoes=agente_restricoes,
             modelo_llm=modelo_llm if modelo_llm else None,
+            modelo_visao=modelo_visao if modelo_visao else None,
             temperatura=temperatura if temperatura else None,
             max_tokens=max_tokens if max_tokens else None,
             top_p=top_p if top_p else None,
+            imagens_brutas_historico=imagens_brutas_historico,
             ativo=ativo
         )
         
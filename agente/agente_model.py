@@ -44,10 +44,14 @@ class Agente(Base):
     
     # Configurações LLM específicas do agente
     modelo_llm = Column(String(100), nullable=True)
+    modelo_visao = Column(String(100), nullable=True)  # Usado nos turnos com imagem
     temperatura = Column(String(10), nullable=True)
     max_tokens = Column(String(10), nullable=True)
     top_p = Column(String(10), nullable=True)
     
+    # Imagens do histórico enviadas ao LLM como imagem (as demais vão pela descrição)
+    imagens_brutas_historico = Column(Integer, default=0)
+    
     # RAG (Base de Conhecimento)
     rag_id = Column(Integer, ForeignKey("rags.id", ondelete='SET NULL'), nullable=True, index=True)
     
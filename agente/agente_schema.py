@@ -19,9 +19,14 @@ class AgenteBase(BaseModel):
     agente_publico: str = Field(..., description="Público-alvo do agente")
     agente_restricoes: str = Field(..., description="Restrições do agente")
     modelo_llm: Optional[str] = Field(None, description="Modelo LLM específico")
+    modelo_visao: Optional[str] = Field(None, description="Modelo com visão para turnos com imagem")
     temperatura: Optional[str] = Field(None, description="Temperatura do modelo")
     max_tokens: Optional[str] = Field(None, description="Máximo de tokens")
     top_p: Optional[str] = Field(None, description="Top P")
+    imagens_brutas_historico: int = Field(
+        default=0, ge=0, le=10,
+        description="Imagens mais recentes do histórico reenviadas como imagem (as demais vão pela descrição)"
+    )
     ativo: bool = Field(default=True, description="Se o agente está ativo")
 
 
@@ -43,9 +48,11 @@ class AgenteAtualizar(BaseModel):
     agente_publico: Optional[str] = None
     agente_restricoes: Optional[str] = None
     modelo_llm: Optional[str] = None
+    modelo_visao: Optional[str] = None
     temperatura: Optional[str] = None
     max_tokens: Optional[str] = None
     top_p: Optional[str] = None
+    imagens_brutas_historico: Optional[int] = Field(None, ge=0, le=10)
     rag_id: Optional[int] = None
     ativo: Optional[bool] = None
 
@@ -2,12 +2,16 @@
 Serviço do agente LLM com integração OpenRouter.
 """
 from sqlalchemy.orm import Session
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple, Callable
 import httpx
+import asyncio
 import json
+import functools
 import base64
+import threading
 import time
 from datetime import datetime
+from pathlib import Path
 from config.config_service import ConfiguracaoService
 from agente.agente_model import Agente, agente_ferramenta
 from agente.agente_schema import AgenteCriar, AgenteAtualizar
@@ -16,6 +20,30 @@ from ferramenta.ferramenta_service import FerramentaService
 from llm_providers.llm_integration_service import LLMIntegrationService
 
 
+# Custo estimado de uma imagem no contexto (imagens reduzidas pelo processador de imagens)
+TOKENS_POR_IMAGEM = 800
+
+# Resumo acumulado das mensagens que saem da janela de contexto
+LOTE_RESUMO = 40  # Mensagens incorporadas ao resumo por chamada ao modelo
+PROMPT_RESUMO_CONVERSA = (
+    "Você mantém o resumo de um atendimento por WhatsApp. Atualize o resumo atual com as "
+    "novas mensagens, em português, em no máximo 10 linhas. Preserve nome, pedidos, dados "
+    "informados, decisões e pendências; descarte cumprimentos e repetições. "
+    "Responda só com o resumo atualizado."
+)
+_resumos_em_andamento = set()  # Conversas com resumo sendo atualizado
+_lock_resumos = threading.Lock()
+
+# Imagem recebida quando o modelo do turno não enxerga imagens
+TEXTO_IMAGEM_NAO_VISTA = "[O usuário enviou uma imagem, mas você não consegue visualizá-la]"
+
+# Descrição guardada no lugar da imagem para os turnos seguintes
+PROMPT_DESCRICAO_IMAGEM = (
+    "Descreva objetivamente a imagem em até 3 frases, em português. Inclua textos, "
+    "números, produtos e detalhes relevantes para atender o cliente. Responda só com a descrição."
+)
+
+
 class AgenteService:
     """Serviço para gerenciar agentes e processar mensagens com LLM."""
 
@@ -61,6 +89,9 @@ class AgenteService:
         db_agente = Agente(**agente.model_dump())
         db.add(db_agente)
         db.commit()
+        # O id pode ser o de um agente apagado (SQLite reaproveita o maior id)
+        from agente.agente_catalogo_service import catalogo_ferramentas
+        catalogo_ferramentas.invalidar_agente(db_agente.id)
         db.refresh(db_agente)
         return db_agente
 
@@ -83,6 +114,9 @@ class AgenteService:
             setattr(db_agente, campo, valor)
 
         db.commit()
+        if "rag_id" in update_data:
+            from agente.agente_catalogo_service import catalogo_ferramentas
+            catalogo_ferramentas.invalidar_agente(agente_id)
         db.refresh(db_agente)
         return db_agente
 
@@ -95,6 +129,9 @@ class AgenteService:
 
         db.delete(db_agente)
         db.commit()
+
+        from agente.agente_catalogo_service import catalogo_ferramentas
+        catalogo_ferramentas.invalidar_agente(agente_id)
         return True
 
     @staticmethod
@@ -133,6 +170,9 @@ class AgenteService:
         
         db.commit()
 
+        from agente.agente_catalogo_service import catalogo_ferramentas
+        catalogo_ferramentas.invalidar_agente(agente_id)
+
     @staticmethod
     def listar_ferramentas(db: Session, agente_id: int) -> List[Ferramenta]:
         """Lista as ferramentas ativas de um agente."""
@@ -219,16 +259,167 @@ class AgenteService:
         )
 
     @staticmethod
-    def construir_historico_mensagens(mensagens: List, mensagem_atual) -> List[Dict]:
+    def obter_modelo(db: Session, agente: Agente) -> str:
+        """Modelo principal do agente, ou o padrão do provedor configurado."""
+        modelo = agente.modelo_llm
+        if not modelo:
+            # Tentar obter modelo do provedor local configurado
+            provedor_padrao = ConfiguracaoService.obter_valor(db, "llm_provedor_padrao")
+            if provedor_padrao == "local":
+                provedor_local_id = ConfiguracaoService.obter_valor(db, "llm_provedor_local_id")
+                if provedor_local_id:
+                    from llm_providers.llm_providers_service import ProvedorLLMService
+                    modelos = ProvedorLLMService.obter_modelos(db, provedor_local_id)
+                    if modelos:
+                        modelo = modelos[0].modelo_id
+                        print(f"📋 [AGENTE] Usando modelo do provedor local: {modelo}")
+            
+            # Fallback para OpenRouter se não houver provedor local
+            if not modelo:
+                modelo = ConfiguracaoService.obter_valor(
+                    db, "openrouter_modelo_padrao", "google/gemini-2.0-flash-001"
+                )
+        return modelo
+
+    @staticmethod
+    async def obter_modelo_visao(
+        db: Session,
+        agente: Agente,
+        modelo: Optional[str] = None,
+        modelos_provedor: Optional[Dict[str, Any]] = None
+    ) -> Optional[str]:
+        """
+        Modelo para os turnos com imagem: o `modelo_visao` do agente ou, se o modelo
+        principal aceitar imagens (ou sua capacidade for desconhecida), o próprio modelo principal.
+        `modelos_provedor`: catálogo de modelos já carregado (ver ContextoTurno).
+        
+        Returns:
+            Nome do modelo, ou None se o agente não tiver modelo capaz de ver imagens
+        """
+        if agente.modelo_visao:
+            return agente.modelo_visao
+        
+        modelo = modelo or AgenteService.obter_modelo(db, agente)
+        if await LLMIntegrationService.suporta_imagens(db, modelo, modelos_provedor) is False:
+            return None
+        return modelo
+
+    @staticmethod
+    def estimar_tokens(conteudo: Any) -> int:
+        """
+        Estimativa de tokens de um conteúdo de mensagem (texto ou lista de partes).
+        Aproximação de 4 caracteres por token; cada imagem conta TOKENS_POR_IMAGEM.
+        """
+        if not conteudo:
+            return 0
+        if isinstance(conteudo, str):
+            return len(conteudo) // 4 + 1
+        total = 0
+        for parte in conteudo:
+            if parte.get("type") == "image_url":
+                total += TOKENS_POR_IMAGEM
+            else:
+                total += len(parte.get("text", "")) // 4 + 1
+        return total
+
+    @staticmethod
+    async def calcular_orcamento_historico(
+        db: Session,
+        modelo: str,
+        max_tokens: int,
+        tokens_fixos: int,
+        modelos_provedor: Optional[Dict[str, Any]] = None
+    ) -> int:
+        """
+        Tokens disponíveis para o histórico: janela de contexto do modelo menos a
+        resposta (`max_tokens`) e o que vai em todo turno (system prompt, resumo,
+        mensagem atual e ferramentas), limitado por `processamento_contexto_max_tokens_historico`.
+        """
+        contexto = await LLMIntegrationService.obter_contexto(db, modelo, modelos_provedor)
+        if not contexto:
+            contexto = int(ConfiguracaoService.obter_valor(db, "processamento_contexto_padrao_tokens", 8192))
+        limite = int(ConfiguracaoService.obter_valor(db, "processamento_contexto_max_tokens_historico", 4000))
+        
+        disponivel = contexto - max_tokens - tokens_fixos
+        return max(0, min(disponivel, limite) if limite > 0 else disponivel)
+
+    @staticmethod
+    def _ids_imagens_brutas(mensagens: List, imagens_brutas: int) -> set:
+        """Ids das `imagens_brutas` imagens recebidas mais recentes (mensagens da mais nova para a mais antiga)."""
+        ids_brutas = [msg.id for msg in mensagens if msg.tipo == "imagem" and msg.direcao == "recebida"]
+        return set(ids_brutas[:imagens_brutas])
+
+    @staticmethod
+    def hashes_imagens_enviaveis(
+        mensagens_turno: List,
+        mensagens: List,
+        mensagem_atual,
+        imagens_brutas: int = 0,
+        ate_mensagem_id: int = 0
+    ) -> List[str]:
+        """
+        Hashes das imagens que podem ir ao LLM como imagem: as do turno e as do histórico
+        que construir_historico_mensagens enviaria como imagem (ainda sem descrição ou
+        entre as `imagens_brutas` mais recentes).
+        """
+        mensagens = [
+            msg for msg in mensagens
+            if msg.id != mensagem_atual.id and msg.id > ate_mensagem_id
+        ]
+        ids_brutas = AgenteService._ids_imagens_brutas(mensagens, imagens_brutas)
+        return [msg.conteudo_midia_hash for msg in mensagens_turno if msg.tipo == "imagem" and msg.conteudo_midia_hash] + [
+            msg.conteudo_midia_hash for msg in mensagens
+            if msg.tipo == "imagem" and msg.direcao == "recebida" and msg.conteudo_midia_hash
+            and (msg.id in ids_brutas or not msg.conteudo_imagem_descricao)
+        ]
+
+    @staticmethod
+    def construir_historico_mensagens(
+        mensagens: List,
+        mensagem_atual,
+        imagens_brutas: int = 0,
+        com_imagens: bool = True,
+        orcamento_tokens: Optional[int] = None,
+        ate_mensagem_id: int = 0,
+        imagens_otimizadas: Optional[Dict[str, Path]] = None
+    ) -> Tuple[List[Dict], Optional[int]]:
         """
         Constrói o histórico de mensagens no formato do OpenRouter.
+        
+        Entram as mensagens mais recentes que couberem em `orcamento_tokens`, cada
+        uma com a resposta do agente; as que já estão no resumo da conversa
+        (id <= `ate_mensagem_id`) ficam de fora.
+        
+        Uma imagem vai como imagem no turno em que chega; nos turnos seguintes entra
+        pela descrição gerada pelo modelo, exceto as `imagens_brutas` mais recentes.
+        Imagens ainda sem descrição continuam indo como imagem. Com `com_imagens=False`
+        (turno em modelo sem visão) nenhuma imagem é enviada.
+        
+        Args:
+            mensagens: Mensagens anteriores, da mais nova para a mais antiga
+            imagens_otimizadas: Versões otimizadas já resolvidas (hash -> caminho), ver
+                hashes_imagens_enviaveis; sem elas, só as que já estiverem em cache
+        
+        Returns:
+            (histórico em ordem cronológica, id da mensagem mais antiga que entrou
+            ou None se nenhuma entrou); as anteriores a ela devem ir para o resumo
         """
-        historico = []
+        from mensagem.mensagem_service import MensagemService
         
-        # Adicionar mensagens anteriores (invertido para ordem cronológica)
-        for msg in reversed(mensagens[:10]):  # Últimas 10 mensagens
-            if msg.id == mensagem_atual.id:
-                continue
+        mensagens = [
+            msg for msg in mensagens
+            if msg.id != mensagem_atual.id and msg.id > ate_mensagem_id
+        ]
+        
+        # Imagens mais recentes que continuam indo como imagem
+        ids_brutas = AgenteService._ids_imagens_brutas(mensagens, imagens_brutas)
+        
+        blocos = []  # Um bloco (lista de mensagens do chat) por mensagem, da mais nova para a mais antiga
+        tokens_usados = 0
+        id_mais_antigo = None
+        
+        for msg in mensagens:
+            bloco = []
             
             # Mensagem do usuário
             if msg.direcao == "recebida":
@@ -241,31 +432,470 @@ class AgenteService:
                         "text": msg.conteudo_texto
                     })
                 
-                # Adicionar imagem se houver
-                if msg.tipo == "imagem" and msg.conteudo_imagem_base64:
-                    mime_type = msg.conteudo_mime_type or "image/jpeg"
-                    data_url = f"data:{mime_type};base64,{msg.conteudo_imagem_base64}"
+                # Imagem já descrita: vai como texto
+                if msg.tipo == "imagem" and msg.conteudo_imagem_descricao and (
+                    msg.id not in ids_brutas or not com_imagens
+                ):
                     conteudo.append({
-                        "type": "image_url",
-                        "image_url": {
-                            "url": data_url
-                        }
+                        "type": "text",
+                        "text": f"[Imagem enviada pelo usuário: {msg.conteudo_imagem_descricao}]"
                     })
+                elif msg.tipo == "imagem" and not com_imagens:
+                    conteudo.append({"type": "text", "text": TEXTO_IMAGEM_NAO_VISTA})
+                elif msg.tipo == "imagem" and (msg.conteudo_midia_hash or msg.conteudo_imagem_base64):
+                    # Reserva o espaço da imagem; os bytes só são lidos se ela couber
+                    conteudo.append({"type": "image_url", "mensagem": msg})
                 
                 if conteudo:
-                    historico.append({
+                    if all(c["type"] == "text" for c in conteudo):
+                        conteudo = [{"type": "text", "text": "\n".join(c["text"] for c in conteudo)}]
+                    bloco.append({
                         "role": "user",
-                        "content": conteudo if len(conteudo) > 1 else conteudo[0]["text"]
+                        "content": conteudo if len(conteudo) > 1 else conteudo[0].get("text", conteudo)
+                    })
+                
+                # Resposta do agente a esta mensagem
+                if msg.resposta_texto:
+                    bloco.append({
+                        "role": "assistant",
+                        "content": msg.resposta_texto
                     })
             
             # Resposta do assistente
             elif msg.direcao == "enviada" and msg.resposta_texto:
-                historico.append({
+                bloco.append({
                     "role": "assistant",
                     "content": msg.resposta_texto
                 })
+            
+            tokens_bloco = sum(AgenteService.estimar_tokens(m["content"]) for m in bloco)
+            if orcamento_tokens is not None and tokens_usados + tokens_bloco > orcamento_tokens:
+                break
+            tokens_usados += tokens_bloco
+            id_mais_antigo = msg.id
+            blocos.append(bloco)
+        
+        # Ordem cronológica; as imagens que couberam são lidas do armazém só agora
+        historico = []
+        for bloco in reversed(blocos):
+            for mensagem_chat in bloco:
+                if isinstance(mensagem_chat["content"], list):
+                    partes = []
+                    for parte in mensagem_chat["content"]:
+                        if parte["type"] != "image_url":
+                            partes.append(parte)
+                            continue
+                        data_url = MensagemService.obter_imagem_data_url(parte["mensagem"], imagens_otimizadas)
+                        if data_url:
+                            partes.append({"type": "image_url", "image_url": {"url": data_url}})
+                    mensagem_chat["content"] = partes if len(partes) > 1 else (
+                        partes[0].get("text", partes) if partes else "[Imagem enviada pelo usuário]"
+                    )
+                historico.append(mensagem_chat)
+        
+        return historico, id_mais_antigo
+
+    @staticmethod
+    async def descrever_imagens(ids_mensagens: List[int], modelo: str, agente_id: Optional[int] = None):
+        """
+        Pede ao modelo uma descrição curta de cada imagem recebida e a guarda na
+        mensagem, para os turnos seguintes não reenviarem a imagem.
+        Executado depois do turno (usa sua própria sessão do banco).
+        """
+        from database import SessionLocal
+        from mensagem.mensagem_model import Mensagem
+        from mensagem.mensagem_service import MensagemService
+        from mensagem.mensagem_contexto_service import cache_contexto
+        from mensagem.mensagem_imagem_service import processador_imagens
+        
+        db = SessionLocal()
+        try:
+            mensagens = db.query(Mensagem).filter(
+                Mensagem.id.in_(ids_mensagens),
+                Mensagem.tipo == "imagem",
+                Mensagem.conteudo_imagem_descricao.is_(None)
+            ).all()
+            
+            otimizadas = await processador_imagens.otimizar_varias(
+                msg.conteudo_midia_hash for msg in mensagens if msg.conteudo_midia_hash
+            )
+            for msg in mensagens:
+                data_url = MensagemService.obter_imagem_data_url(msg, otimizadas)
+                if not data_url:
+                    continue
+                try:
+                    resultado = await LLMIntegrationService.processar_mensagem_com_llm(
+                        db=db,
+                        messages=[
+                            {"role": "system", "content": PROMPT_DESCRICAO_IMAGEM},
+                            {"role": "user", "content": [
+                                {"type": "text", "text": msg.conteudo_texto or "Descreva a imagem."},
+                                {"type": "image_url", "image_url": {"url": data_url}}
+                            ]}
+                        ],
+                        modelo=modelo,
+                        agente_id=agente_id,
+                        temperatura=0.2,
+                        max_tokens=300
+                    )
+                except Exception as e:
+                    print(f"⚠️  [AGENTE] Falha ao descrever imagem da mensagem {msg.id}: {e}")
+                    continue
+                
+                descricao = (resultado.get("conteudo") or "").strip()
+                if descricao:
+                    msg.conteudo_imagem_descricao = descricao
+                    db.commit()
+                    cache_contexto.registrar(msg)
+                    print(f"🖼️  [AGENTE] Imagem da mensagem {msg.id} descrita ({len(descricao)} caracteres)")
+        finally:
+            db.close()
+
+    @staticmethod
+    async def atualizar_resumo(
+        sessao_id: int,
+        telefone_cliente: str,
+        antes_de: Optional[int],
+        agente_id: Optional[int] = None
+    ):
+        """
+        Incorpora ao resumo da conversa as mensagens anteriores a `antes_de` que ainda
+        não estão nele (as que saíram da janela de contexto), em lotes de LOTE_RESUMO.
+        Usa o modelo de texto do agente e sua própria sessão do banco.
+        Sem `antes_de` (nenhuma mensagem saiu da janela), não faz nada.
+        """
+        from database import SessionLocal
+        from mensagem.mensagem_model import Mensagem, ResumoConversa
+        from mensagem.mensagem_service import MensagemService
+        
+        if antes_de is None:
+            return
         
-        return historico
+        chave = (sessao_id, telefone_cliente)
+        with _lock_resumos:
+            if chave in _resumos_em_andamento:
+                return  # O próximo turno continua de onde este parar
+            _resumos_em_andamento.add(chave)
+        
+        db = SessionLocal()
+        try:
+            agente = AgenteService.obter_por_id(db, agente_id) if agente_id else None
+            modelo = AgenteService.obter_modelo(db, agente) if agente else ConfiguracaoService.obter_valor(
+                db, "openrouter_modelo_padrao", "google/gemini-2.0-flash-001"
+            )
+            max_tokens = int(ConfiguracaoService.obter_valor(db, "processamento_resumo_max_tokens", 400))
+            
+            resumo = db.query(ResumoConversa).filter(
+                ResumoConversa.sessao_id == sessao_id,
+                ResumoConversa.telefone_cliente == telefone_cliente
+            ).first()
+            if resumo is None:
+                resumo = ResumoConversa(
+                    sessao_id=sessao_id, telefone_cliente=telefone_cliente,
+                    resumo="", ate_mensagem_id=0, mensagens_resumidas=0
+                )
+                db.add(resumo)
+            
+            # Mensagens anteriores ao último #limpar não entram no resumo
+            inicio = MensagemService.obter_inicio_historico(db, sessao_id, telefone_cliente)
+            if resumo.ate_mensagem_id < inicio:
+                resumo.resumo = ""
+                resumo.ate_mensagem_id = inicio
+                resumo.mensagens_resumidas = 0
+            
+            while True:
+                mensagens = db.query(Mensagem).filter(
+                    Mensagem.sessao_id == sessao_id,
+                    Mensagem.telefone_cliente == telefone_cliente,
+                    Mensagem.id > resumo.ate_mensagem_id,
+                    Mensagem.id < antes_de
+                ).order_by(Mensagem.id).limit(LOTE_RESUMO).all()
+                if not mensagens:
+                    # Nenhuma mensagem da conversa antes de `antes_de`: o resumo já cobre até
+                    # ali, e os próximos turnos não precisam agendá-lo de novo
+                    if resumo.ate_mensagem_id < antes_de - 1:
+                        resumo.ate_mensagem_id = antes_de - 1
+                        db.commit()
+                    break
+                
+                linhas = []
+                for msg in mensagens:
+                    texto = msg.conteudo_texto or ""
+                    if msg.tipo == "imagem":
+                        texto = f"{texto} [imagem: {msg.conteudo_imagem_descricao or 'sem descrição'}]".strip()
+                    if texto and msg.direcao == "recebida":
+                        linhas.append(f"Cliente: {texto}")
+                    if msg.resposta_texto:
+                        linhas.append(f"Atendente: {msg.resposta_texto}")
+                
+                if linhas:
+                    resultado = await LLMIntegrationService.processar_mensagem_com_llm(
+                        db=db,
+                        messages=[
+                            {"role": "system", "content": PROMPT_RESUMO_CONVERSA},
+                            {"role": "user", "content": (
+                                f"Resumo atual:\n{resumo.resumo or '(vazio)'}\n\n"
+                                f"Novas mensagens:\n" + "\n".join(linhas)
+                            )}
+                        ],
+                        modelo=modelo,
+                        agente_id=agente_id,
+                        temperatura=0.2,
+                        max_tokens=max_tokens
+                    )
+                    novo_resumo = (resultado.get("conteudo") or "").strip()
+                    if not novo_resumo:
+                        break
+                    resumo.resumo = novo_resumo
+                
+                resumo.ate_mensagem_id = mensagens[-1].id
+                resumo.mensagens_resumidas = (resumo.mensagens_resumidas or 0) + len(mensagens)
+                db.commit()
+                print(f"📚 [AGENTE] Resumo de {telefone_cliente} atualizado: +{len(mensagens)} mensagem(ns)")
+        except Exception as e:
+            db.rollback()
+            print(f"⚠️  [AGENTE] Falha ao atualizar o resumo de {telefone_cliente}: {e}")
+        finally:
+            db.close()
+            with _lock_resumos:
+                _resumos_em_andamento.discard(chave)
+
+    @staticmethod
+    def chave_ferramenta(nome: str, argumentos: Any) -> str:
+        """Identifica uma chamada de ferramenta pelo nome e argumentos normalizados."""
+        if isinstance(argumentos, str):
+            try:
+                argumentos = json.loads(argumentos) if argumentos else {}
+            except ValueError:
+                pass
+        return f"{nome}:{json.dumps(argumentos, sort_keys=True, ensure_ascii=False)}"
+
+    @staticmethod
+    def extrair_resultados_reaproveitaveis(ferramentas_usadas: List[Dict]) -> Dict[str, Dict]:
+        """
+        Seleciona, entre ferramentas já executadas (ex.: em um turno cancelado),
+        os resultados que podem ser reaproveitados sem executar a ferramenta de novo.
+
+        Só são reaproveitados resultados destinados apenas ao LLM e sem erro:
+        o que já foi enviado ao usuário não é repetido nem reutilizado.
+        """
+        reaproveitaveis = {}
+        for uso in ferramentas_usadas or []:
+            resultado = uso.get("resultado")
+            if uso.get("output", "llm") != "llm" or uso.get("enviado_usuario"):
+                continue
+            if isinstance(resultado, dict) and resultado.get("erro"):
+                continue
+            chave = AgenteService.chave_ferramenta(uso.get("nome"), uso.get("argumentos"))
+            reaproveitaveis[chave] = {"resultado": resultado, "output": "llm"}
+        return reaproveitaveis
+
+    @staticmethod
+    async def executar_tool_call(
+        tool_call: Dict[str, Any],
+        agente_id: int,
+        rag_id: Optional[int],
+        sessao_id: int,
+        telefone_cliente: str,
+        resultados_reaproveitaveis: Dict[str, Dict],
+        timeout: float = 30.0
+    ) -> Dict[str, Any]:
+        """
+        Executa uma chamada de ferramenta pedida pelo LLM.
+
+        As chamadas de um mesmo turno rodam em paralelo, e a sessão do banco do turno
+        não pode ser usada por várias delas ao mesmo tempo: cada execução abre a sua.
+        Erros e estouro de `timeout` (segundos) viram um resultado de erro para o LLM.
+
+        Returns:
+            Dict com: uso (registro em ferramentas usadas) e conteudo (mensagem `tool` para o LLM)
+        """
+        from database import SessionLocal
+
+        function_name = tool_call.get("function", {}).get("name")
+        function_args = tool_call.get("function", {}).get("arguments")
+        reaproveitada = False
+        try:
+            args_dict = json.loads(function_args) if isinstance(function_args, str) else function_args
+            args_dict = args_dict or {}
+        except ValueError as e:
+            args_dict = None
+            resultado_completo = {
+                "resultado": {"erro": f"Argumentos inválidos para {function_name}: {str(e)}"},
+                "output": "llm"
+            }
+
+        if args_dict is not None:
+            chave_reaproveitamento = AgenteService.chave_ferramenta(function_name, args_dict)
+            reaproveitada = chave_reaproveitamento in resultados_reaproveitaveis
+
+            # Resultado já obtido por um turno cancelado desta conversa
+            if reaproveitada:
+                print(f"♻️  [AGENTE] Reaproveitando resultado de {function_name} do turno cancelado")
+                resultado_completo = resultados_reaproveitaveis[chave_reaproveitamento]
+            else:
+                db = SessionLocal()
+                try:
+                    resultado_completo = await asyncio.wait_for(
+                        AgenteService._executar_ferramenta(
+                            db, function_name, args_dict, agente_id, rag_id, sessao_id, telefone_cliente
+                        ),
+                        timeout=timeout
+                    )
+                except asyncio.TimeoutError:
+                    print(f"⏱️  [AGENTE] Tool {function_name} excedeu {timeout}s")
+                    resultado_completo = {
+                        "resultado": {"erro": f"Tempo limite de {timeout}s excedido ao executar {function_name}"},
+                        "output": "llm",
+                        "enviado_usuario": False
+                    }
+                except Exception as e:
+                    print(f"❌ [AGENTE] Erro ao executar tool {function_name}: {str(e)}")
+                    resultado_completo = {
+                        "resultado": {"erro": f"Erro ao executar {function_name}: {str(e)}"},
+                        "output": "llm",
+                        "enviado_usuario": False
+                    }
+                finally:
+                    db.close()
+
+        # Extrair resultado para o LLM
+        resultado_llm = resultado_completo.get("resultado", resultado_completo)
+        output_type = resultado_completo.get("output", "llm")
+        enviado_usuario = resultado_completo.get("enviado_usuario", False)
+        post_instruction = resultado_completo.get("post_instruction")
+
+        # Registrar uso da ferramenta
+        uso_ferramenta = {
+            "nome": function_name,
+            "argumentos": function_args,
+            "resultado": resultado_llm,
+            "output": output_type,
+            "enviado_usuario": enviado_usuario
+        }
+        if reaproveitada:
+            uso_ferramenta["reaproveitada"] = True
+
+        # Conteúdo para o LLM: o resultado, se o output inclui LLM
+        if output_type in ["llm", "both"]:
+            conteudo_tool = json.dumps(resultado_llm, ensure_ascii=False)
+            # Se tem post_instruction, adicionar ao contexto
+            if post_instruction:
+                conteudo_tool = f"{conteudo_tool}\n\nInstrução: {post_instruction}"
+            print(f"📤 [AGENTE] Conteúdo enviado ao LLM (primeiros 500 chars): {conteudo_tool[:500]}")
+        else:
+            # Se output é apenas USER, informar ao LLM que foi enviado
+            conteudo_tool = json.dumps({
+                "status": "enviado_ao_usuario",
+                "mensagem": "Resultado enviado diretamente ao usuário via WhatsApp"
+            }, ensure_ascii=False)
+
+        return {"uso": uso_ferramenta, "conteudo": conteudo_tool}
+
+    @staticmethod
+    async def _executar_ferramenta(
+        db: Session,
+        function_name: str,
+        args_dict: Dict[str, Any],
+        agente_id: int,
+        rag_id: Optional[int],
+        sessao_id: int,
+        telefone_cliente: str
+    ) -> Dict[str, Any]:
+        """Despacha a ferramenta: MCP (prefixo mcp_), busca no RAG do agente ou ferramenta do banco."""
+        from mcp_client.mcp_service import MCPService
+
+        # Detectar se é ferramenta MCP (prefixo mcp_)
+        if function_name.startswith("mcp_"):
+            # Extrair: mcp_5_list_repos -> client_id=5, tool_name=list_repos
+            parts = function_name.split("_", 2)  # ["mcp", "5", "list_repos"]
+            mcp_client_id = int(parts[1])
+            original_tool_name = parts[2]
+
+            print(f"🌐 [AGENTE] Executando tool MCP: {original_tool_name} (client {mcp_client_id})")
+            resultado_completo = await MCPService.executar_tool_mcp(
+                db, mcp_client_id, original_tool_name, args_dict
+            )
+            print(f"✅ [AGENTE] Tool MCP executada com sucesso: {resultado_completo.get('tempo_ms', 0)}ms")
+            return resultado_completo
+
+        # Verificar se é a ferramenta de busca RAG
+        if function_name == "buscar_base_conhecimento" and rag_id:
+            # A busca é síncrona (embeddings + índice): roda fora do event loop
+            return await asyncio.to_thread(
+                AgenteService._buscar_base_conhecimento,
+                args_dict, agente_id, rag_id, sessao_id, telefone_cliente
+            )
+
+        # Executar ferramenta normal do banco
+        return await FerramentaService.executar_ferramenta(
+            db,
+            function_name,
+            args_dict,
+            sessao_id=sessao_id,
+            telefone_cliente=telefone_cliente
+        )
+
+    @staticmethod
+    def _buscar_base_conhecimento(
+        args_dict: Dict[str, Any],
+        agente_id: int,
+        rag_id: int,
+        sessao_id: int,
+        telefone_cliente: str
+    ) -> Dict[str, Any]:
+        """Busca no RAG do agente e registra a métrica (em thread, com sessão própria)."""
+        from database import SessionLocal
+        from rag.rag_service import RAGService
+        from rag.rag_metrica_service import RAGMetricaService
+
+        db = SessionLocal()
+        try:
+            query = args_dict.get("query", "")
+            num_resultados = args_dict.get("num_resultados", 3)
+
+            # Medir tempo de busca
+            tempo_inicio = time.time()
+            resultados_busca = RAGService.buscar(db, rag_id, query, num_resultados)
+            tempo_ms = int((time.time() - tempo_inicio) * 1000)
+
+            # Registrar métrica
+            RAGMetricaService.registrar_busca(
+                db=db,
+                rag_id=rag_id,
+                query=query,
+                resultados=resultados_busca,
+                num_solicitados=num_resultados,
+                tempo_ms=tempo_ms,
+                agente_id=agente_id,
+                sessao_id=sessao_id,
+                telefone_cliente=telefone_cliente
+            )
+
+            # Formatar resultados para o LLM
+            contextos = []
+            for r in resultados_busca:
+                contextos.append({
+                    "conteudo": r.get("context", ""),
+                    "fonte": r.get("metadata", {}).get("source", ""),
+                })
+
+            return {
+                "resultado": {
+                    "sucesso": True,
+                    "query": query,
+                    "total_resultados": len(contextos),
+                    "contextos": contextos
+                },
+                "output": "llm"
+            }
+        except Exception as e:
+            return {
+                "resultado": {"erro": f"Erro ao buscar: {str(e)}"},
+                "output": "llm"
+            }
+        finally:
+            db.close()
 
     @staticmethod
     async def processar_mensagem(
@@ -273,11 +903,16 @@ class AgenteService:
         sessao,
         mensagem,
         historico_mensagens: List,
-        agente: Optional[Agente] = None
+        agente: Optional[Agente] = None,
+        mensagens_agrupadas: Optional[List] = None,
+        ferramentas_executadas: Optional[List[Dict]] = None,
+        resultados_reaproveitaveis: Optional[Dict[str, Dict]] = None,
+        contexto=None,
+        ao_receber_texto: Optional[Callable[[int, str], None]] = None
     ) -> Dict[str, Any]:
         """
         Processa uma mensagem com o agente LLM usando loop principal.
-        Suporta múltiplas chamadas de ferramentas em paralelo.
+        Suporta múltiplas chamadas de ferramentas em paralelo (ver executar_tool_call).
         
         Args:
             db: Sessão do banco de dados
@@ -285,39 +920,55 @@ class AgenteService:
             mensagem: Mensagem a ser processada
             historico_mensagens: Histórico de mensagens
             agente: Agente a ser usado (se None, usa o agente ativo da sessão)
+            mensagens_agrupadas: Mensagens do mesmo contato enviadas logo antes de
+                `mensagem`, respondidas no mesmo turno
+            ferramentas_executadas: Lista preenchida à medida que as ferramentas
+                terminam (permite aproveitar o trabalho se o turno for cancelado)
+            resultados_reaproveitaveis: Resultados de ferramentas de um turno anterior
+                (ver extrair_resultados_reaproveitaveis), usados no lugar de nova execução
+            contexto: ContextoTurno já carregado (agente, resumo, modelo, provedor e
+                ferramentas); se None, é montado aqui
+            ao_receber_texto: Se informado, o LLM é chamado em streaming e esta função
+                recebe (iteração, trecho) a cada trecho de texto gerado; o texto de uma
+                iteração que termina pedindo ferramentas não é a resposta final
         
         Returns:
-            Dict com: texto, tokens_input, tokens_output, tempo_ms, modelo, ferramentas
+            Dict com: texto, tokens_input, tokens_output, tempo_ms, modelo, agente_id,
+            visao, resumir_antes_de (None se nenhuma mensagem nova saiu da janela), ferramentas
         """
+        from mensagem.mensagem_service import MensagemService
+        from mensagem.mensagem_imagem_service import processador_imagens
+        from agente.agente_turno_service import ContextoTurno
+        
         inicio = time.time()
         
-        # Se não foi passado agente, usar o agente ativo da sessão
-        if agente is None:
-            if sessao.agente_ativo_id:
+        if contexto is None:
+            contexto = ContextoTurno(
+                sessao,
+                mensagem.telefone_cliente,
+                inicio_historico=MensagemService.obter_inicio_historico(db, sessao.id, mensagem.telefone_cliente),
+                resumo=MensagemService.obter_resumo(db, sessao.id, mensagem.telefone_cliente)
+            )
+            # Se não foi passado agente, usar o agente ativo da sessão
+            if agente is None and sessao.agente_ativo_id:
                 agente = AgenteService.obter_por_id(db, sessao.agente_ativo_id)
-            
-            if agente is None:
-                raise ValueError("Nenhum agente ativo configurado para esta sessão")
         
-        # Obter modelo (do agente, ou padrão do provedor configurado)
-        modelo = agente.modelo_llm
-        if not modelo:
-            # Tentar obter modelo do provedor local configurado
-            provedor_padrao = ConfiguracaoService.obter_valor(db, "llm_provedor_padrao")
-            if provedor_padrao == "local":
-                provedor_local_id = ConfiguracaoService.obter_valor(db, "llm_provedor_local_id")
-                if provedor_local_id:
-                    from llm_providers.llm_providers_service import ProvedorLLMService
-                    modelos = ProvedorLLMService.obter_modelos(db, provedor_local_id)
-                    if modelos:
-                        modelo = modelos[0].modelo_id
-                        print(f"📋 [AGENTE] Usando modelo do provedor local: {modelo}")
-            
-            # Fallback para OpenRouter se não houver provedor local
-            if not modelo:
-                modelo = ConfiguracaoService.obter_valor(
-                    db, "openrouter_modelo_padrao", "google/gemini-2.0-flash-001"
-                )
+        # Agente, modelo, provedor e ferramentas do turno
+        await contexto.preparar(db, agente)
+        agente = contexto.agente
+        
+        # Obter modelo: o principal (texto) ou, em turnos com imagem, o modelo com visão
+        modelo = contexto.modelo
+        modelo_visao = None
+        if any(m.tipo == "imagem" for m in (mensagens_agrupadas or []) + [mensagem]):
+            modelo_visao = await AgenteService.obter_modelo_visao(
+                db, agente, modelo, modelos_provedor=contexto.modelos_provedor
+            )
+            if modelo_visao:
+                modelo = modelo_visao
+                print(f"👁️  [AGENTE] Turno com imagem: usando {modelo}")
+            else:
+                print("⚠️  [AGENTE] Nenhum modelo com visão configurado: imagens do turno não serão vistas")
         
         # Obter parâmetros (do agente, ou padrão)
         temperatura = float(agente.temperatura or ConfiguracaoService.obter_valor(
@@ -333,107 +984,110 @@ class AgenteService:
         # Construir system prompt
         system_prompt = AgenteService.construir_system_prompt(agente)
         
-        # Construir histórico
-        historico = AgenteService.construir_historico_mensagens(
-            historico_mensagens,
-            mensagem
-        )
+        # Versões otimizadas das imagens que podem ir como imagem, resolvidas aqui (no pool,
+        # sem bloquear o loop do worker) antes de montar a mensagem atual e o histórico
+        resumo = contexto.resumo
+        imagens_otimizadas = {}
+        if modelo_visao:
+            imagens_otimizadas = await processador_imagens.otimizar_varias(AgenteService.hashes_imagens_enviaveis(
+                (mensagens_agrupadas or []) + [mensagem],
+                historico_mensagens,
+                mensagem,
+                imagens_brutas=agente.imagens_brutas_historico or 0,
+                ate_mensagem_id=resumo.ate_mensagem_id if resumo else 0
+            ))
         
-        # Construir mensagem atual
+        # Construir mensagem atual (incluindo mensagens agrupadas, em ordem de chegada)
         conteudo_atual = []
         
-        if mensagem.conteudo_texto:
-            conteudo_atual.append({
+        for msg_turno in (mensagens_agrupadas or []) + [mensagem]:
+            if msg_turno.conteudo_texto:
+                conteudo_atual.append({
+                    "type": "text",
+                    "text": msg_turno.conteudo_texto
+                })
+            
+            # Adicionar imagem se houver (e se o modelo do turno a enxerga)
+            if msg_turno.tipo == "imagem":
+                data_url = MensagemService.obter_imagem_data_url(msg_turno, imagens_otimizadas) if modelo_visao else None
+                if data_url:
+                    conteudo_atual.append({
+                        "type": "image_url",
+                        "image_url": {
+                            "url": data_url
+                        }
+                    })
+                else:
+                    conteudo_atual.append({
+                        "type": "text",
+                        "text": TEXTO_IMAGEM_NAO_VISTA
+                    })
+        
+        # Vários textos sem imagem: enviar como um único texto, uma mensagem por linha
+        if len(conteudo_atual) > 1 and all(c["type"] == "text" for c in conteudo_atual):
+            conteudo_atual = [{
                 "type": "text",
-                "text": mensagem.conteudo_texto
-            })
-        
-        # Adicionar imagem se houver
-        if mensagem.tipo == "imagem" and mensagem.conteudo_imagem_base64:
-            mime_type = mensagem.conteudo_mime_type or "image/jpeg"
-            data_url = f"data:{mime_type};base64,{mensagem.conteudo_imagem_base64}"
-            conteudo_atual.append({
-                "type": "image_url",
-                "image_url": {
-                    "url": data_url
-                }
-            })
+                "text": "\n".join(c["text"] for c in conteudo_atual)
+            }]
         
-        # Montar mensagens iniciais
-        messages = [
-            {"role": "system", "content": system_prompt}
-        ]
-        messages.extend(historico)
-        messages.append({
+        mensagem_usuario = {
             "role": "user",
             "content": conteudo_atual if len(conteudo_atual) > 1 else (
                 conteudo_atual[0]["text"] if conteudo_atual else "..."
             )
-        })
+        }
         
-        # Buscar ferramentas ativas do agente
-        ferramentas_disponiveis = AgenteService.listar_ferramentas(db, agente.id)
+        # Tools no formato OpenAI (ferramentas, MCP e busca RAG), do catálogo compilado do agente
+        tools = contexto.tools
         
-        # Preparar tools no formato OpenAI
-        tools = None
-        if ferramentas_disponiveis:
-            tools = []
-            for ferramenta in ferramentas_disponiveis:
-                tool_openai = FerramentaService.converter_para_openai_format(ferramenta)
-                if tool_openai:  # Apenas ferramentas PRINCIPAL
-                    tools.append(tool_openai)
+        # Resumo das mensagens que já saíram da janela de contexto
+        mensagem_resumo = None
+        if resumo and resumo.resumo:
+            mensagem_resumo = {
+                "role": "system",
+                "content": f"Resumo da conversa até aqui:\n{resumo.resumo}"
+            }
         
-        # Buscar clientes MCP ativos do agente
-        from mcp_client.mcp_service import MCPService
-        mcp_clients = MCPService.listar_ativos_por_agente(db, agente.id)
+        # Construir histórico: as mensagens mais recentes que couberem no orçamento de tokens
+        tokens_fixos = (
+            AgenteService.estimar_tokens(system_prompt)
+            + AgenteService.estimar_tokens(mensagem_resumo["content"] if mensagem_resumo else None)
+            + AgenteService.estimar_tokens(mensagem_usuario["content"])
+            + (len(json.dumps(tools, ensure_ascii=False)) // 4 if tools else 0)
+        )
+        orcamento_historico = await AgenteService.calcular_orcamento_historico(
+            db, modelo, max_tokens, tokens_fixos, modelos_provedor=contexto.modelos_provedor
+        )
+        historico, id_mais_antigo = AgenteService.construir_historico_mensagens(
+            historico_mensagens,
+            mensagem,
+            imagens_brutas=agente.imagens_brutas_historico or 0,
+            com_imagens=modelo_visao is not None,
+            orcamento_tokens=orcamento_historico,
+            ate_mensagem_id=resumo.ate_mensagem_id if resumo else 0,
+            imagens_otimizadas=imagens_otimizadas
+        )
+        print(f"🧮 [AGENTE] Histórico: {len(historico)} mensagem(ns) em até {orcamento_historico} tokens")
         
-        # Adicionar ferramentas MCP
-        for mcp_client in mcp_clients:
-            if not mcp_client.conectado:
-                continue  # Pular clientes desconectados
-            
-            mcp_tools = MCPService.listar_tools_ativas(db, mcp_client.id)
-            for mcp_tool in mcp_tools:
-                if tools is None:
-                    tools = []
-                tool_openai = MCPService.converter_mcp_tool_para_openai(mcp_client, mcp_tool)
-                tools.append(tool_openai)
-        
-        # Adicionar ferramenta de busca RAG se o agente tiver treinamento vinculado
-        if agente.rag_id:
-            if tools is None:
-                tools = []
-            
-            # Definir ferramenta de busca na base de conhecimento
-            tools.append({
-                "type": "function",
-                "function": {
-                    "name": "buscar_base_conhecimento",
-                    "description": "Busca informações relevantes na base de conhecimento do treinamento para responder perguntas do usuário",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "query": {
-                                "type": "string",
-                                "description": "A pergunta ou consulta para buscar na base de conhecimento"
-                            },
-                            "num_resultados": {
-                                "type": "integer",
-                                "description": "Número de resultados a retornar (padrão: 3)",
-                                "default": 3
-                            }
-                        },
-                        "required": ["query"]
-                    }
-                }
-            })
+        # Montar mensagens iniciais
+        messages = [
+            {"role": "system", "content": system_prompt}
+        ]
+        if mensagem_resumo:
+            messages.append(mensagem_resumo)
+        messages.extend(historico)
+        messages.append(mensagem_usuario)
         
         # Variáveis de controle
         tokens_input_total = 0
         tokens_output_total = 0
-        ferramentas_usadas = []
+        ferramentas_usadas = ferramentas_executadas if ferramentas_executadas is not None else []
+        resultados_reaproveitaveis = resultados_reaproveitaveis or {}
         texto_resposta_final = ""
         max_iteracoes = 10
+        timeout_ferramenta = float(ConfiguracaoService.obter_valor(
+            db, "processamento_timeout_ferramenta", 30
+        ) or 30)
         iteracao = 0
         
         # Loop principal de processamento
@@ -453,7 +1107,9 @@ class AgenteService:
                     max_tokens=max_tokens,
                     top_p=top_p,
                     tools=tools,
-                    stream=False
+                    stream=ao_receber_texto is not None,
+                    provedor_info=contexto.provedor_para(modelo),
+                    ao_receber_texto=functools.partial(ao_receber_texto, iteracao) if ao_receber_texto else None
                 )
                 
                 # Extrair dados da resposta
@@ -475,147 +1131,41 @@ class AgenteService:
                 # Verificar finish_reason
                 finish_reason = resultado.get("finish_reason", "stop")
                 print(f"✅ [AGENTE] LLM respondeu. finish_reason={finish_reason}")
+                if resultado.get("tempo_primeiro_trecho_ms") is not None:
+                    print(f"⚡ [AGENTE] Primeiro trecho em {resultado['tempo_primeiro_trecho_ms']:.0f}ms (streaming)")
                 
                 # Verificar se há tool calls
                 tool_calls = message_response.get("tool_calls")
                 
                 if tool_calls and finish_reason == "tool_calls":
                     print(f"🔧 [AGENTE] LLM chamou {len(tool_calls)} tool(s)")
-                    # Processar todas as ferramentas em paralelo
-                    for tool_call in tool_calls:
-                        function_name = tool_call.get("function", {}).get("name")
-                        function_args = tool_call.get("function", {}).get("arguments")
-                        args_dict = json.loads(function_args) if isinstance(function_args, str) else function_args
-                        
-                        # Detectar se é ferramenta MCP (prefixo mcp_)
-                        if function_name.startswith("mcp_"):
-                            # Extrair: mcp_5_list_repos -> client_id=5, tool_name=list_repos
-                            try:
-                                parts = function_name.split("_", 2)  # ["mcp", "5", "list_repos"]
-                                mcp_client_id = int(parts[1])
-                                original_tool_name = parts[2]
-                                
-                                print(f"🌐 [AGENTE] Executando tool MCP: {original_tool_name} (client {mcp_client_id})")
-                                # Executar via MCP
-                                resultado_completo = await MCPService.executar_tool_mcp(
-                                    db, mcp_client_id, original_tool_name, args_dict
-                                )
-                                print(f"✅ [AGENTE] Tool MCP executada com sucesso: {resultado_completo.get('tempo_ms', 0)}ms")
-                            except Exception as e:
-                                print(f"❌ [AGENTE] Erro ao executar tool MCP: {str(e)}")
-                                resultado_completo = {
-                                    "resultado": {"erro": f"Erro ao executar tool MCP: {str(e)}"},
-                                    "output": "llm",
-                                    "enviado_usuario": False
-                                }
-                        
-                        # Verificar se é a ferramenta de busca RAG
-                        elif function_name == "buscar_base_conhecimento" and agente.rag_id:
-                            # Executar busca no RAG
-                            from rag.rag_service import RAGService
-                            from rag.rag_metrica_service import RAGMetricaService
-                            try:
-                                query = args_dict.get("query", "")
-                                num_resultados = args_dict.get("num_resultados", 3)
-                                
-                                # Medir tempo de busca
-                                tempo_inicio = time.time()
-                                
-                                # Buscar no RAG
-                                resultados_busca = RAGService.buscar(
-                                    db, agente.rag_id, query, num_resultados
-                                )
-                                
-                                # Calcular tempo
-                                tempo_ms = int((time.time() - tempo_inicio) * 1000)
-                                
-                                # Registrar métrica
-                                RAGMetricaService.registrar_busca(
-                                    db=db,
-                                    rag_id=agente.rag_id,
-                                    query=query,
-                                    resultados=resultados_busca,
-                                    num_solicitados=num_resultados,
-                                    tempo_ms=tempo_ms,
-                                    agente_id=agente.id,
-                                    sessao_id=sessao.id,
-                                    telefone_cliente=mensagem.telefone_cliente
-                                )
-                                
-                                # Formatar resultados para o LLM
-                                contextos = []
-                                for r in resultados_busca:
-                                    contextos.append({
-                                        "conteudo": r.get("context", ""),
-                                        "fonte": r.get("metadata", {}).get("source", ""),
-                                    })
-                                
-                                resultado_completo = {
-                                    "resultado": {
-                                        "sucesso": True,
-                                        "query": query,
-                                        "total_resultados": len(contextos),
-                                        "contextos": contextos
-                                    },
-                                    "output": "llm"
-                                }
-                            except Exception as e:
-                                resultado_completo = {
-                                    "resultado": {"erro": f"Erro ao buscar: {str(e)}"},
-                                    "output": "llm"
-                                }
-                        else:
-                            # Executar ferramenta normal do banco
-                            resultado_completo = await FerramentaService.executar_ferramenta(
-                                db,
-                                function_name,
-                                args_dict,
-                                sessao_id=sessao.id,
-                                telefone_cliente=mensagem.telefone_cliente
-                            )
-                        
-                        # Extrair resultado para o LLM
-                        resultado_llm = resultado_completo.get("resultado", resultado_completo)
-                        output_type = resultado_completo.get("output", "llm")
-                        enviado_usuario = resultado_completo.get("enviado_usuario", False)
-                        post_instruction = resultado_completo.get("post_instruction")
-                        
-                        # Registrar uso da ferramenta
-                        ferramentas_usadas.append({
-                            "nome": function_name,
-                            "argumentos": function_args,
-                            "resultado": resultado_llm,
-                            "output": output_type,
-                            "enviado_usuario": enviado_usuario
+                    # Executar as ferramentas em paralelo (cada uma com sua sessão do banco);
+                    # os resultados voltam ao LLM na ordem das chamadas
+                    async def executar_e_registrar(tool_call):
+                        execucao = await AgenteService.executar_tool_call(
+                            tool_call,
+                            agente_id=agente.id,
+                            rag_id=agente.rag_id,
+                            sessao_id=sessao.id,
+                            telefone_cliente=mensagem.telefone_cliente,
+                            resultados_reaproveitaveis=resultados_reaproveitaveis,
+                            timeout=timeout_ferramenta
+                        )
+                        # Registrada assim que termina: sobrevive ao cancelamento do turno
+                        ferramentas_usadas.append(execucao["uso"])
+                        return execucao
+
+                    execucoes = await asyncio.gather(*[
+                        executar_e_registrar(tool_call) for tool_call in tool_calls
+                    ])
+
+                    for tool_call, execucao in zip(tool_calls, execucoes):
+                        messages.append({
+                            "role": "tool",
+                            "tool_call_id": tool_call.get("id"),
+                            "content": execucao["conteudo"]
                         })
-                        
-                        # Preparar conteúdo para o LLM
-                        conteudo_tool = json.dumps(resultado_llm, ensure_ascii=False)
-                        
-                        # Se tem post_instruction, adicionar ao contexto
-                        if post_instruction and output_type in ["llm", "both"]:
-                            conteudo_tool = f"{conteudo_tool}\n\nInstrução: {post_instruction}"
-                        
-                        # Adicionar resultado ao histórico apenas se output inclui LLM
-                        if output_type in ["llm", "both"]:
-                            print(f"📤 [AGENTE] Conteúdo enviado ao LLM (primeiros 500 chars): {conteudo_tool[:500]}")
-                            messages.append({
-                                "role": "tool",
-                                "tool_call_id": tool_call.get("id"),
-                                "content": conteudo_tool
-                            })
-                            print(f"📝 [AGENTE] Resultado da tool adicionado ao histórico (output={output_type})")
-                        else:
-                            # Se output é apenas USER, informar ao LLM que foi enviado
-                            messages.append({
-                                "role": "tool",
-                                "tool_call_id": tool_call.get("id"),
-                                "content": json.dumps({
-                                    "status": "enviado_ao_usuario",
-                                    "mensagem": "Resultado enviado diretamente ao usuário via WhatsApp"
-                                }, ensure_ascii=False)
-                            })
-                            print(f"📝 [AGENTE] Resultado enviado ao usuário (output={output_type})")
+                        print(f"📝 [AGENTE] Resultado de {execucao['uso']['nome']} adicionado ao histórico (output={execucao['uso']['output']})")
                     
                     # Continuar o loop para processar os resultados das ferramentas
                     print(f"🔁 [AGENTE] Todas as {len(tool_calls)} tool(s) processadas. Voltando ao LLM...")
@@ -630,12 +1180,23 @@ class AgenteService:
             tempo_ms = int((time.time() - inicio) * 1000)
             
             print(f"🎯 [AGENTE] Processamento concluído em {tempo_ms}ms")
+            
+            # Mensagens anteriores a esta ficaram fora do histórico: vão para o resumo,
+            # se houver alguma ainda não resumida (senão None: nada a resumir)
+            resumir_antes_de = id_mais_antigo or min(m.id for m in (mensagens_agrupadas or []) + [mensagem])
+            resumido_ate = max(resumo.ate_mensagem_id if resumo else 0, contexto.inicio_historico or 0)
+            if resumir_antes_de <= resumido_ate + 1:
+                resumir_antes_de = None
+            
             return {
                 "texto": texto_resposta_final,
                 "tokens_input": tokens_input_total,
                 "tokens_output": tokens_output_total,
                 "tempo_ms": tempo_ms,
                 "modelo": modelo,
+                "agente_id": agente.id,
+                "visao": modelo_visao is not None,
+                "resumir_antes_de": resumir_antes_de,
                 "ferramentas": ferramentas_usadas if ferramentas_usadas else None
             }
                 
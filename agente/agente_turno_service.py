@@ -0,0 +1,115 @@
+"""
+Contexto do turno do agente.
+Reúne, no início do turno, tudo o que ele lê do banco (sessão, agente ativo, início do
+histórico, resumo, modelo, provedor e ferramentas) e é passado adiante até a chamada ao
+LLM, em vez de cada etapa consultar o banco de novo.
+"""
+from typing import Optional, List, Dict, Any
+from sqlalchemy import select, and_
+from sqlalchemy.orm import Session, joinedload
+
+
+class ContextoTurno:
+    """
+    Fotografia do início do turno.
+
+    `carregar` busca sessão, agente ativo, início do histórico e resumo em uma consulta;
+    `preparar` resolve modelo, provedor e catálogo de ferramentas do agente (uma consulta
+    ao catálogo de modelos; ferramentas e configurações vêm dos caches em memória).
+    """
+
+    def __init__(
+        self,
+        sessao,
+        telefone_cliente: str,
+        agente=None,
+        inicio_historico: int = 0,
+        resumo=None
+    ):
+        self.sessao = sessao
+        self.telefone_cliente = telefone_cliente
+        self.agente = agente
+        self.inicio_historico = inicio_historico
+        self.resumo = resumo
+
+        # Preenchidos por preparar()
+        self.modelo: Optional[str] = None
+        self.tools: Optional[List[Dict[str, Any]]] = None
+        self.modelos_provedor: Dict[str, Any] = {}
+        self.provedor_local = None
+        self._agente_preparado: Optional[int] = None
+
+    @staticmethod
+    def carregar(db: Session, sessao_id: int, telefone_cliente: str) -> Optional["ContextoTurno"]:
+        """
+        Carrega o contexto da conversa em uma consulta (None se a sessão não existir).
+
+        Sessão, agente e resumo são desanexados da sessão do banco: os commits do turno
+        não os expiram (o que faria cada um ser relido) e eles refletem o início do turno.
+        """
+        from sessao.sessao_model import Sessao
+        from mensagem.mensagem_model import EpocaConversa, ResumoConversa
+
+        inicio = select(EpocaConversa.inicio_mensagem_id)\
+            .where(
+                EpocaConversa.sessao_id == sessao_id,
+                EpocaConversa.telefone_cliente == telefone_cliente
+            )\
+            .scalar_subquery()
+
+        linha = db.query(Sessao, ResumoConversa, inicio)\
+            .outerjoin(
+                ResumoConversa,
+                and_(
+                    ResumoConversa.sessao_id == Sessao.id,
+                    ResumoConversa.telefone_cliente == telefone_cliente
+                )
+            )\
+            .options(joinedload(Sessao.agente_ativo))\
+            .filter(Sessao.id == sessao_id)\
+            .first()
+        if linha is None:
+            return None
+
+        sessao, resumo, inicio_historico = linha
+        agente = sessao.agente_ativo
+        for objeto in (sessao, agente, resumo):
+            if objeto is not None:
+                db.expunge(objeto)
+
+        return ContextoTurno(sessao, telefone_cliente, agente, inicio_historico or 0, resumo)
+
+    async def preparar(self, db: Session, agente=None):
+        """
+        Resolve modelo, provedor e ferramentas do agente do turno (o ativo da sessão,
+        ou `agente`, se informado). Idempotente para o mesmo agente.
+        """
+        from agente.agente_service import AgenteService
+        from agente.agente_catalogo_service import catalogo_ferramentas
+        from llm_providers.llm_integration_service import LLMIntegrationService
+
+        if agente is not None:
+            self.agente = agente
+        if self.agente is None:
+            raise ValueError("Nenhum agente ativo configurado para esta sessão")
+        if self._agente_preparado == self.agente.id:
+            return
+
+        self.modelo = AgenteService.obter_modelo(db, self.agente)
+        self.modelos_provedor = LLMIntegrationService.carregar_modelos_provedor(
+            db, [m for m in (self.modelo, self.agente.modelo_visao) if m]
+        )
+        self.provedor_local = LLMIntegrationService.obter_provedor_local(db)
+        self.tools = catalogo_ferramentas.obter(db, self.agente)
+        self._agente_preparado = self.agente.id
+
+    def provedor_para(self, modelo: str) -> Dict[str, Any]:
+        """Provedor que atende o modelo (ver LLMIntegrationService.escolher_provedor)."""
+        from llm_providers.llm_integration_service import LLMIntegrationService
+        return LLMIntegrationService.escolher_provedor(modelo, self.provedor_local)
+
+    def __repr__(self):
+        return (
+            f"<ContextoTurno(sessao_id={self.sessao.id}, telefone='{self.telefone_cliente}', "
+            f"agente_id={self.agente.id if self.agente else None}, modelo='{self.modelo}')>"
+        )
@@ -0,0 +1,140 @@
+"""
+Snapshot em memória das configurações.
+`ConfiguracaoService.obter_valor` lê daqui, sem consultar o banco: as configurações são
+carregadas de uma vez, já convertidas para o tipo de cada uma, e o snapshot inteiro é
+trocado quando alguma muda. Entre processos, a troca é guiada pelo contador da tabela
+`configuracoes_versao`, incrementado a cada alteração.
+"""
+from typing import Optional, Dict, Any
+from datetime import datetime
+import copy
+import json
+import threading
+import time
+from sqlalchemy.orm import Session
+from config.config_model import Configuracao, VersaoConfiguracoes
+
+
+# Marca de configuração inexistente, sem valor ou com valor inválido para o tipo
+_AUSENTE = object()
+
+
+class CacheConfiguracoes:
+    """
+    Dicionário chave -> valor tipado, substituído por inteiro (nunca alterado no lugar),
+    então a leitura não precisa de lock.
+
+    No processo que altera uma configuração o snapshot é recarregado logo após o commit;
+    os demais processos percebem a nova versão na próxima verificação, feita no máximo
+    a cada `intervalo_verificacao` segundos.
+    """
+
+    def __init__(self, intervalo_verificacao: float = 2.0):
+        self.intervalo_verificacao = intervalo_verificacao
+        self._valores: Optional[Dict[str, Any]] = None
+        self._versao: Optional[int] = None
+        self._verificado_em = 0.0
+        self._lock = threading.Lock()
+
+        # Métricas
+        self._recargas = 0
+        self._verificacoes = 0
+        self._ultima_recarga: Optional[datetime] = None
+
+    def configurar(self, intervalo_verificacao: Optional[float] = None):
+        """Ajusta o intervalo entre verificações da versão no banco."""
+        if intervalo_verificacao is not None:
+            self.intervalo_verificacao = max(0.0, float(intervalo_verificacao))
+
+    @staticmethod
+    def converter(tipo: str, valor: Optional[str]) -> Any:
+        """Converte o valor gravado para o tipo da configuração (_AUSENTE se não for possível)."""
+        if valor is None:
+            return _AUSENTE
+        try:
+            if tipo == "int":
+                return int(valor)
+            elif tipo == "float":
+                return float(valor)
+            elif tipo == "bool":
+                return valor.lower() in ("true", "1", "sim", "yes")
+            elif tipo == "json":
+                return json.loads(valor)
+            else:
+                return valor
+        except (ValueError, json.JSONDecodeError):
+            return _AUSENTE
+
+    def obter(self, db: Session, chave: str, padrao: Any = None) -> Any:
+        """Valor tipado da configuração, ou `padrao` se não existir ou for inválido."""
+        valores = self._valores
+        if valores is None or time.monotonic() - self._verificado_em >= self.intervalo_verificacao:
+            valores = self._verificar(db)
+
+        valor = valores.get(chave, _AUSENTE)
+        if valor is _AUSENTE:
+            return padrao
+        # Valores json são mutáveis: cada chamador recebe sua cópia
+        if isinstance(valor, (dict, list)):
+            return copy.deepcopy(valor)
+        return valor
+
+    def _verificar(self, db: Session) -> Dict[str, Any]:
+        """Compara a versão do banco com a do snapshot e recarrega se mudou."""
+        with self._lock:
+            if self._valores is not None and time.monotonic() - self._verificado_em < self.intervalo_verificacao:
+                return self._valores  # Outra thread acabou de verificar
+            self._verificacoes += 1
+            versao = CacheConfiguracoes._ler_versao(db)
+            if self._valores is None or versao != self._versao:
+                self._carregar(db, versao)
+            self._verificado_em = time.monotonic()
+            return self._valores
+
+    def recarregar(self, db: Session):
+        """Recarrega o snapshot (chamado após o commit de uma alteração)."""
+        with self._lock:
+            self._carregar(db, CacheConfiguracoes._ler_versao(db))
+            self._verificado_em = time.monotonic()
+
+    def _carregar(self, db: Session, versao: int):
+        # A versão é lida antes das linhas: uma alteração concorrente só provoca outra recarga
+        linhas = db.query(Configuracao.chave, Configuracao.valor, Configuracao.tipo).all()
+        self._valores = {
+            chave: CacheConfiguracoes.converter(tipo, valor) for chave, valor, tipo in linhas
+        }
+        self._versao = versao
+        self._recargas += 1
+        self._ultima_recarga = datetime.now()
+
+    @staticmethod
+    def _ler_versao(db: Session) -> int:
+        versao = db.query(VersaoConfiguracoes.versao)\
+            .filter(VersaoConfiguracoes.id == 1)\
+            .scalar()
+        return versao or 0
+
+    @staticmethod
+    def incrementar_versao(db: Session):
+        """Incrementa o contador de versão; deve ser chamado antes do commit da alteração."""
+        atualizadas = db.query(VersaoConfiguracoes)\
+            .filter(VersaoConfiguracoes.id == 1)\
+            .update({VersaoConfiguracoes.versao: VersaoConfiguracoes.versao + 1}, synchronize_session=False)
+        if not atualizadas:
+            db.add(VersaoConfiguracoes(id=1, versao=1))
+
+    def obter_metricas(self) -> Dict[str, Any]:
+        """Retorna a versão em memória, recargas e verificações do snapshot."""
+        with self._lock:
+            return {
+                "versao": self._versao,
+                "configuracoes": len(self._valores) if self._valores is not None else 0,
+                "intervalo_verificacao": self.intervalo_verificacao,
+                "verificacoes": self._verificacoes,
+                "recargas": self._recargas,
+                "ultima_recarga": self._ultima_recarga.isoformat() if self._ultima_recarga else None
+            }
+
+
+# Instância global do cache de configurações
+cache_configuracoes = CacheConfiguracoes()
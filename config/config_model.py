@@ -25,3 +25,19 @@ class Configuracao(Base):
 
     def __repr__(self):
         return f"<Configuracao(chave='{self.chave}', valor='{self.valor}')>"
+
+
+class VersaoConfiguracoes(Base):
+    """
+    Contador de alterações das configurações (uma linha, id=1).
+    Incrementado na mesma transação de cada alteração; cada processo compara com a
+    versão do seu snapshot em memória para saber quando recarregar.
+    """
+    __tablename__ = "configuracoes_versao"
+
+    id = Column(Integer, primary_key=True)
+    versao = Column(Integer, nullable=False, default=0)
+    atualizado_em = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    def __repr__(self):
+        return f"<VersaoConfiguracoes(versao={self.versao})>"
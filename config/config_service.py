@@ -6,6 +6,7 @@ from typing import Optional, List, Dict, Any
 import httpx
 import json
 from config.config_model import Configuracao
+from config.config_cache_service import cache_configuracoes
 from config.config_schema import (
     ConfiguracaoCriar,
     ConfiguracaoAtualizar,
@@ -27,25 +28,9 @@ class ConfiguracaoService:
         """
         Obtém o valor de uma configuração, convertendo para o tipo correto.
         Retorna o valor padrão se não encontrar.
+        Lido do snapshot em memória (ver config_cache_service), não do banco.
         """
-        config = ConfiguracaoService.obter_por_chave(db, chave)
-        if not config or config.valor is None:
-            return padrao
-
-        # Converter para o tipo correto
-        try:
-            if config.tipo == "int":
-                return int(config.valor)
-            elif config.tipo == "float":
-                return float(config.valor)
-            elif config.tipo == "bool":
-                return config.valor.lower() in ("true", "1", "sim", "yes")
-            elif config.tipo == "json":
-                return json.loads(config.valor)
-            else:
-                return config.valor
-        except (ValueError, json.JSONDecodeError):
-            return padrao
+        return cache_configuracoes.obter(db, chave, padrao)
 
     @staticmethod
     def listar_por_categoria(db: Session, categoria: str) -> List[Configuracao]:
@@ -62,7 +47,9 @@ class ConfiguracaoService:
         """Cria uma nova configuração."""
         db_config = Configuracao(**config.model_dump())
         db.add(db_config)
+        cache_configuracoes.incrementar_versao(db)
         db.commit()
+        cache_configuracoes.recarregar(db)
         db.refresh(db_config)
         return db_config
 
@@ -80,7 +67,9 @@ class ConfiguracaoService:
         for campo, valor in update_data.items():
             setattr(db_config, campo, valor)
 
+        cache_configuracoes.incrementar_versao(db)
         db.commit()
+        cache_configuracoes.recarregar(db)
         db.refresh(db_config)
         return db_config
 
@@ -100,7 +89,9 @@ class ConfiguracaoService:
                 valor_str = str(valor)
 
             db_config.valor = valor_str
+            cache_configuracoes.incrementar_versao(db)
             db.commit()
+            cache_configuracoes.recarregar(db)
             db.refresh(db_config)
             return db_config
         elif criar_se_nao_existir:
@@ -136,7 +127,9 @@ class ConfiguracaoService:
             raise ValueError("Esta configuração não pode ser deletada")
 
         db.delete(db_config)
+        cache_configuracoes.incrementar_versao(db)
         db.commit()
+        cache_configuracoes.recarregar(db)
         return True
 
     @staticmethod
@@ -345,6 +338,271 @@ class ConfiguracaoService:
                 "categoria": "agente",
                 "editavel": True
             },
+            # Processamento de mensagens
+            {
+                "chave": "processamento_workers",
+                "valor": "4",
+                "tipo": "int",
+                "descricao": "Número de workers (máximo de conversas processadas em paralelo)",
+                "categoria": "processamento",
+                "editavel": True
+            },
+            {
+                "chave": "processamento_tamanho_fila",
+                "valor": "500",
+                "tipo": "int",
+                "descricao": "Máximo de mensagens aguardando processamento",
+                "categoria": "processamento",
+                "editavel": True
+            },
+            {
+                "chave": "processamento_timeout_enfileirar",
+                "valor": "2.0",
+                "tipo": "float",
+                "descricao": "Segundos aguardando vaga na fila antes de rejeitar a mensagem",
+                "categoria": "processamento",
+                "editavel": True
+            },
+            {
+                "chave": "processamento_cancelar_turnos_obsoletos",
+                "valor": "true",
+                "tipo": "bool",
+                "descricao": "Cancelar a resposta em andamento quando o contato envia uma nova mensagem",
+                "categoria": "processamento",
+                "editavel": True
+            },
+            {
+                "chave": "processamento_max_turnos",
+                "valor": "0",
+                "tipo": "int",
+                "descricao": "Máximo de respostas do agente em andamento em todas as sessões (0 = sem limite)",
+                "categoria": "processamento",
+                "editavel": True
+            },
+            {
+                "chave": "processamento_timeout_turno",
+                "valor": "10.0",
+                "tipo": "float",
+                "descricao": "Segundos aguardando vaga para responder antes de aplicar a política de sobrecarga",
+                "categoria": "processamento",
+                "editavel": True
+            },
+            {
+                "chave": "processamento_politica_sobrecarga",
+                "valor": "avisar",
+                "tipo": "string",
+                "descricao": "Ao exceder o tempo de espera: 'avisar' (envia aviso de ocupado e continua aguardando) ou 'adiar' (apenas aguarda)",
+                "categoria": "processamento",
+                "editavel": True
+            },
+            {
+                "chave": "processamento_mensagem_ocupado",
+                "valor": "⏳ Estamos com muitas conversas no momento. Recebemos sua mensagem e você terá uma resposta em breve!",
+                "tipo": "string",
+                "descricao": "Mensagem enviada ao contato quando a resposta vai demorar por sobrecarga",
+                "categoria": "processamento",
+                "editavel": True
+            },
+            {
+                "chave": "processamento_backend_whatsapp",
+                "valor": "thread",
+                "tipo": "string",
+                "descricao": "Conexões WhatsApp: 'thread' (uma thread por sessão) ou 'async' (todas as sessões em um único event loop). Vale para as próximas conexões",
+                "categoria": "processamento",
+                "editavel": True
+            },
+            {
+                "chave": "processamento_threads_backend_async",
+                "valor": "64",
+                "tipo": "int",
+                "descricao": "Threads do executor das chamadas ao Neonize no backend 'async' (requer reinício)",
+                "categoria": "processamento",
+                "editavel": True
+            },
+            {
+                "chave": "processamento_envio_taxa_sessao",
+                "valor": "1.0",
+                "tipo": "float",
+                "descricao": "Mensagens enviadas por segundo por sessão, em média (0 = sem limite)",
+                "categoria": "processamento",
+                "editavel": True
+            },
+            {
+                "chave": "processamento_envio_rajada_sessao",
+                "valor": "5",
+                "tipo": "int",
+                "descricao": "Mensagens que uma sessão pode enviar de uma vez antes do ritmo médio valer",
+                "categoria": "processamento",
+                "editavel": True
+            },
+            {
+                "chave": "processamento_envio_taxa_contato",
+                "valor": "0.5",
+                "tipo": "float",
+                "descricao": "Mensagens enviadas por segundo a um mesmo contato, em média (0 = sem limite)",
+                "categoria": "processamento",
+                "editavel": True
+            },
+            {
+                "chave": "processamento_envio_rajada_contato",
+                "valor": "3",
+                "tipo": "int",
+                "descricao": "Mensagens que um contato pode receber de uma vez antes do ritmo médio valer",
+                "categoria": "processamento",
+                "editavel": True
+            },
+            {
+                "chave": "processamento_envio_max_tentativas",
+                "valor": "3",
+                "tipo": "int",
+                "descricao": "Tentativas de envio de cada mensagem antes de desistir (backoff exponencial entre elas; só falhas anteriores ao envio são repetidas)",
+                "categoria": "processamento",
+                "editavel": True
+            },
+            {
+                "chave": "processamento_envio_intervalo_partes",
+                "valor": "0.8",
+                "tipo": "float",
+                "descricao": "Segundos entre as partes de uma resposta dividida",
+                "categoria": "processamento",
+                "editavel": True
+            },
+            {
+                "chave": "processamento_envio_max_caracteres",
+                "valor": "4000",
+                "tipo": "int",
+                "descricao": "Respostas maiores são divididas em partes nos parágrafos (0 = não dividir)",
+                "categoria": "processamento",
+                "editavel": True
+            },
+            {
+                "chave": "processamento_imagem_lado_maximo",
+                "valor": "1024",
+                "tipo": "int",
+                "descricao": "Lado maior (px) das imagens enviadas ao LLM; as maiores são reduzidas",
+                "categoria": "processamento",
+                "editavel": True
+            },
+            {
+                "chave": "processamento_imagem_qualidade",
+                "valor": "80",
+                "tipo": "int",
+                "descricao": "Qualidade JPEG (10-95) das imagens recomprimidas para o LLM",
+                "categoria": "processamento",
+                "editavel": True
+            },
+            {
+                "chave": "processamento_imagem_processos",
+                "valor": "2",
+                "tipo": "int",
+                "descricao": "Processos do pool de otimização de imagens (requer reinício)",
+                "categoria": "processamento",
+                "editavel": True
+            },
+            {
+                "chave": "processamento_cache_contexto_conversas",
+                "valor": "1000",
+                "tipo": "int",
+                "descricao": "Conversas mantidas no cache de contexto em memória (0 = desativado)",
+                "categoria": "processamento",
+                "editavel": True
+            },
+            {
+                "chave": "processamento_cache_contexto_mensagens",
+                "valor": "30",
+                "tipo": "int",
+                "descricao": "Mensagens recentes consideradas no histórico do agente (e guardadas no cache) por conversa",
+                "categoria": "processamento",
+                "editavel": True
+            },
+            {
+                "chave": "processamento_contexto_max_tokens_historico",
+                "valor": "4000",
+                "tipo": "int",
+                "descricao": "Máximo de tokens de histórico por turno; o restante vai para o resumo (0 = só a janela do modelo)",
+                "categoria": "processamento",
+                "editavel": True
+            },
+            {
+                "chave": "processamento_contexto_padrao_tokens",
+                "valor": "8192",
+                "tipo": "int",
+                "descricao": "Janela de contexto assumida para modelos sem contexto conhecido",
+                "categoria": "processamento",
+                "editavel": True
+            },
+            {
+                "chave": "processamento_resumo_max_tokens",
+                "valor": "400",
+                "tipo": "int",
+                "descricao": "Tamanho máximo (tokens) do resumo acumulado de cada conversa",
+                "categoria": "processamento",
+                "editavel": True
+            },
+            {
+                "chave": "processamento_expurgo_retencao_horas",
+                "valor": "0",
+                "tipo": "float",
+                "descricao": "Horas que as mensagens descartadas pelo #limpar ficam no banco (para métricas) antes do expurgo",
+                "categoria": "processamento",
+                "editavel": True
+            },
+            {
+                "chave": "processamento_expurgo_lote",
+                "valor": "500",
+                "tipo": "int",
+                "descricao": "Mensagens apagadas por transação no expurgo do histórico",
+                "categoria": "processamento",
+                "editavel": True
+            },
+            {
+                "chave": "processamento_arquivo_retencao_dias",
+                "valor": "0",
+                "tipo": "int",
+                "descricao": "Dias que as mensagens ficam no banco antes de irem para o arquivo compactado (0 = nunca; a sessão pode definir o seu)",
+                "categoria": "processamento",
+                "editavel": True
+            },
+            {
+                "chave": "processamento_arquivo_lote",
+                "valor": "1000",
+                "tipo": "int",
+                "descricao": "Registros arquivados ou apagados por transação nas tarefas de retenção",
+                "categoria": "processamento",
+                "editavel": True
+            },
+            {
+                "chave": "processamento_retencao_intervalo_horas",
+                "valor": "6",
+                "tipo": "float",
+                "descricao": "Intervalo entre execuções das tarefas de retenção (arquivo de mensagens e métricas do RAG)",
+                "categoria": "processamento",
+                "editavel": True
+            },
+            {
+                "chave": "processamento_rag_metricas_retencao_dias",
+                "valor": "90",
+                "tipo": "int",
+                "descricao": "Dias que as métricas de busca do RAG são mantidas (0 = para sempre)",
+                "categoria": "processamento",
+                "editavel": True
+            },
+            {
+                "chave": "processamento_timeout_ferramenta",
+                "valor": "30",
+                "tipo": "float",
+                "descricao": "Tempo limite (segundos) de cada ferramenta chamada pelo agente; as chamadas de um turno rodam em paralelo",
+                "categoria": "processamento",
+                "editavel": True
+            },
+            {
+                "chave": "processamento_resposta_streaming",
+                "valor": "true",
+                "tipo": "bool",
+                "descricao": "Gerar a resposta do agente em streaming e enviá-la ao WhatsApp parágrafo a parágrafo, à medida que é gerada",
+                "categoria": "processamento",
+                "editavel": True
+            },
             # Sistema
             {
                 "chave": "sistema_diretorio_uploads",
@@ -36,6 +36,20 @@ def get_db():
 
 def criar_tabelas():
     """
-    Cria todas as tabelas no banco de dados.
+    Cria todas as tabelas no banco de dados e aplica as migrações pendentes.
     """
     Base.metadata.create_all(bind=engine)
+    aplicar_migracoes()
+
+
+def aplicar_migracoes():
+    """
+    Aplica as migrações do Alembic (migrations/versions) até a última revisão.
+    As migrações são idempotentes: em bancos recém-criados pelo create_all
+    elas apenas registram a versão.
+    """
+    from alembic import command
+    from alembic.config import Config
+
+    config = Config(os.path.join(os.path.dirname(os.path.abspath(__file__)), "alembic.ini"))
+    command.upgrade(config, "head")
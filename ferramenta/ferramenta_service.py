@@ -3,6 +3,7 @@ Serviço de lógica de negócio para ferramentas.
 """
 from sqlalchemy.orm import Session
 from typing import Optional, List, Dict, Any
+import asyncio
 import json
 import re
 import httpx
@@ -40,6 +41,8 @@ class FerramentaService:
         db_ferramenta = Ferramenta(**ferramenta.model_dump())
         db.add(db_ferramenta)
         db.commit()
+        from agente.agente_catalogo_service import catalogo_ferramentas
+        catalogo_ferramentas.invalidar_todos()
         db.refresh(db_ferramenta)
         return db_ferramenta
 
@@ -56,6 +59,8 @@ class FerramentaService:
             setattr(db_ferramenta, campo, valor)
 
         db.commit()
+        from agente.agente_catalogo_service import catalogo_ferramentas
+        catalogo_ferramentas.invalidar_todos()
         db.refresh(db_ferramenta)
         return db_ferramenta
 
@@ -68,6 +73,8 @@ class FerramentaService:
 
         db.delete(db_ferramenta)
         db.commit()
+        from agente.agente_catalogo_service import catalogo_ferramentas
+        catalogo_ferramentas.invalidar_todos()
         return True
 
     @staticmethod
@@ -240,8 +247,8 @@ class FerramentaService:
                 "httpx": httpx
             }
             
-            # Executar código
-            exec(codigo, namespace)
+            # Executar código (fora do event loop: outras ferramentas do turno seguem em paralelo)
+            await asyncio.to_thread(exec, codigo, namespace)
             
             # Capturar resultado
             if ferramenta.print_output_var and ferramenta.print_output_var in namespace:
@@ -351,50 +358,51 @@ class FerramentaService:
         """
         Envia o resultado da ferramenta para o usuário via WhatsApp.
         Suporta diferentes tipos de canal (text, image, audio, video, document).
+        O envio vai para a fila de envio (ritmo e retentativas); retorna True quando
+        o conteúdo foi enfileirado.
         """
         from sessao.sessao_service import gerenciador_sessoes
-        from neonize.utils import build_jid
+        from mensagem.mensagem_envio_service import fila_envio
         from ferramenta.ferramenta_model import ChannelType
         
-        # Obter cliente WhatsApp
+        # Verificar cliente WhatsApp
         cliente = gerenciador_sessoes.obter_cliente(sessao_id)
         if not cliente:
             print(f"⚠️  Cliente WhatsApp não encontrado para sessão {sessao_id}")
             return False
         
-        jid = build_jid(telefone_cliente)
         channel = ferramenta.channel or ChannelType.TEXT
         
         try:
             if channel == ChannelType.TEXT:
                 # Enviar como texto
                 texto = FerramentaService.formatar_resultado_texto(resultado, ferramenta)
-                cliente.send_message(jid, message=texto)
-                print(f"📤 Texto enviado para {telefone_cliente}")
+                fila_envio.enviar(sessao_id, telefone_cliente, texto, descricao=f"ferramenta {ferramenta.nome} / {telefone_cliente}")
+                print(f"📤 Texto enfileirado para {telefone_cliente}")
                 return True
                 
             elif channel == ChannelType.IMAGE:
                 # Enviar como imagem
                 return await FerramentaService.enviar_imagem(
-                    cliente, jid, resultado, ferramenta
+                    sessao_id, telefone_cliente, resultado, ferramenta
                 )
                 
             elif channel == ChannelType.AUDIO:
                 # Enviar como áudio
                 return await FerramentaService.enviar_audio(
-                    cliente, jid, resultado, ferramenta
+                    sessao_id, telefone_cliente, resultado, ferramenta
                 )
                 
             elif channel == ChannelType.VIDEO:
                 # Enviar como vídeo
                 return await FerramentaService.enviar_video(
-                    cliente, jid, resultado, ferramenta
+                    sessao_id, telefone_cliente, resultado, ferramenta
                 )
                 
             elif channel == ChannelType.DOCUMENT:
                 # Enviar como documento
                 return await FerramentaService.enviar_documento(
-                    cliente, jid, resultado, ferramenta
+                    sessao_id, telefone_cliente, resultado, ferramenta
                 )
             
             return False
@@ -438,8 +446,8 @@ class FerramentaService:
     
     @staticmethod
     async def enviar_imagem(
-        cliente,
-        jid,
+        sessao_id: int,
+        telefone_cliente: str,
         resultado: Dict[str, Any],
         ferramenta: Ferramenta
     ) -> bool:
@@ -447,6 +455,8 @@ class FerramentaService:
         Envia uma imagem para o usuário.
         Resultado pode conter: url, base64, path
         """
+        from mensagem.mensagem_envio_service import fila_envio
+        
         try:
             import base64
             
@@ -471,14 +481,17 @@ class FerramentaService:
                     imagem_data = f.read()
             
             if imagem_data:
-                # Construir mensagem de imagem
-                image_msg = cliente.build_image_message(
-                    imagem_data,
-                    caption=caption,
-                    mime_type=resultado.get("mime_type", "image/jpeg")
-                )
-                cliente.send_message(jid, message=image_msg)
-                print(f"🖼️  Imagem enviada")
+                def enviar(cliente, jid):
+                    # Construir mensagem de imagem (upload da mídia) e enviar
+                    image_msg = cliente.build_image_message(
+                        imagem_data,
+                        caption=caption,
+                        mime_type=resultado.get("mime_type", "image/jpeg")
+                    )
+                    return cliente.send_message(jid, message=image_msg)
+                
+                fila_envio.enviar(sessao_id, telefone_cliente, enviar, descricao=f"imagem / {telefone_cliente}")
+                print(f"🖼️  Imagem enfileirada")
                 return True
             
             return False
@@ -489,14 +502,16 @@ class FerramentaService:
     
     @staticmethod
     async def enviar_audio(
-        cliente,
-        jid,
+        sessao_id: int,
+        telefone_cliente: str,
         resultado: Dict[str, Any],
         ferramenta: Ferramenta
     ) -> bool:
         """
         Envia um áudio para o usuário.
         """
+        from mensagem.mensagem_envio_service import fila_envio
+        
         try:
             import base64
             
@@ -516,13 +531,15 @@ class FerramentaService:
                     audio_data = f.read()
             
             if audio_data:
-                # Enviar áudio
-                cliente.send_audio(
-                    jid,
-                    audio_data,
-                    ptt=resultado.get("ptt", False)  # Voice message
-                )
-                print(f"🎵 Áudio enviado")
+                def enviar(cliente, jid):
+                    return cliente.send_audio(
+                        jid,
+                        audio_data,
+                        ptt=resultado.get("ptt", False)  # Voice message
+                    )
+                
+                fila_envio.enviar(sessao_id, telefone_cliente, enviar, descricao=f"áudio / {telefone_cliente}")
+                print(f"🎵 Áudio enfileirado")
                 return True
             
             return False
@@ -533,14 +550,16 @@ class FerramentaService:
     
     @staticmethod
     async def enviar_video(
-        cliente,
-        jid,
+        sessao_id: int,
+        telefone_cliente: str,
         resultado: Dict[str, Any],
         ferramenta: Ferramenta
     ) -> bool:
         """
         Envia um vídeo para o usuário.
         """
+        from mensagem.mensagem_envio_service import fila_envio
+        
         try:
             import base64
             
@@ -561,12 +580,15 @@ class FerramentaService:
                     video_data = f.read()
             
             if video_data:
-                cliente.send_video(
-                    jid,
-                    video_data,
-                    caption=caption
-                )
-                print(f"🎬 Vídeo enviado")
+                def enviar(cliente, jid):
+                    return cliente.send_video(
+                        jid,
+                        video_data,
+                        caption=caption
+                    )
+                
+                fila_envio.enviar(sessao_id, telefone_cliente, enviar, descricao=f"vídeo / {telefone_cliente}")
+                print(f"🎬 Vídeo enfileirado")
                 return True
             
             return False
@@ -577,14 +599,16 @@ class FerramentaService:
     
     @staticmethod
     async def enviar_documento(
-        cliente,
-        jid,
+        sessao_id: int,
+        telefone_cliente: str,
         resultado: Dict[str, Any],
         ferramenta: Ferramenta
     ) -> bool:
         """
         Envia um documento para o usuário.
         """
+        from mensagem.mensagem_envio_service import fila_envio
+        
         try:
             import base64
             
@@ -606,14 +630,17 @@ class FerramentaService:
                     doc_data = f.read()
             
             if doc_data:
-                cliente.send_document(
-                    jid,
-                    doc_data,
-                    filename=filename,
-                    caption=caption,
-                    mime_type=resultado.get("mime_type", "application/pdf")
-                )
-                print(f"📄 Documento enviado")
+                def enviar(cliente, jid):
+                    return cliente.send_document(
+                        jid,
+                        doc_data,
+                        filename=filename,
+                        caption=caption,
+                        mime_type=resultado.get("mime_type", "application/pdf")
+                    )
+                
+                fila_envio.enviar(sessao_id, telefone_cliente, enviar, descricao=f"documento / {telefone_cliente}")
+                print(f"📄 Documento enfileirado")
                 return True
             
             return False
@@ -2,7 +2,7 @@
 Serviço de integração LLM que gerencia a escolha do provedor correto.
 """
 from sqlalchemy.orm import Session
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Callable
 import httpx
 import json
 import time
@@ -11,6 +11,11 @@ from llm_providers.llm_providers_service import ProvedorLLMService
 from llm_providers.llm_providers_schema import RequisicaoLLM, ConfiguracaoProvedor
 
 
+# Mapa de capacidades dos modelos do OpenRouter (GET /models), em memória
+TTL_CAPACIDADES_OPENROUTER = 6 * 3600  # Segundos até buscar o mapa de novo
+_capacidades_openrouter: Dict[str, Any] = {"imagens": {}, "contexto": {}, "atualizado_em": 0.0}
+
+
 class LLMIntegrationService:
     """Serviço para integrar diferentes provedores LLM de forma transparente."""
 
@@ -24,7 +29,9 @@ class LLMIntegrationService:
         max_tokens: int = 2000,
         top_p: float = 1.0,
         tools: Optional[List[Dict]] = None,
-        stream: bool = False
+        stream: bool = False,
+        provedor_info: Optional[Dict[str, Any]] = None,
+        ao_receber_texto: Optional[Callable[[str], None]] = None
     ) -> Dict[str, Any]:
         """
         Processa mensagem usando o provedor LLM apropriado.
@@ -38,17 +45,31 @@ class LLMIntegrationService:
             max_tokens: Máximo de tokens
             top_p: Top P para amostragem
             tools: Lista de ferramentas disponíveis
-            stream: Se deve usar streaming
+            stream: Se deve usar streaming (a resposta é montada a partir dos eventos)
+            provedor_info: Provedor já escolhido (ex.: pelo ContextoTurno); se None,
+                é determinado aqui
+            ao_receber_texto: Com stream, chamado com cada trecho de texto assim que
+                ele chega (não é chamado depois que o LLM começa a pedir ferramentas)
             
         Returns:
             Dict com resposta do LLM
         """
         inicio = time.time()
         
+        # Com texto já repassado, um fallback repetiria o início da resposta
+        trechos_repassados = []
+        if stream and ao_receber_texto:
+            repassar = ao_receber_texto
+            
+            def ao_receber_texto(trecho: str):
+                trechos_repassados.append(len(trecho))
+                repassar(trecho)
+        
         # 1. Determinar qual provedor usar
-        provedor_info = await LLMIntegrationService._determinar_provedor(
-            db, modelo, agente_id
-        )
+        if provedor_info is None:
+            provedor_info = await LLMIntegrationService._determinar_provedor(
+                db, modelo, agente_id
+            )
         
         # 2. Fazer a requisição usando o provedor apropriado
         try:
@@ -56,12 +77,12 @@ class LLMIntegrationService:
                 # Usar provedor local via llm_providers
                 resultado = await LLMIntegrationService._usar_provedor_local(
                     db, provedor_info, messages, modelo, temperatura, 
-                    max_tokens, top_p, tools, stream
+                    max_tokens, top_p, tools, stream, ao_receber_texto
                 )
             elif provedor_info["tipo"] == "openrouter":
                 # Usar OpenRouter diretamente
                 resultado = await LLMIntegrationService._usar_openrouter(
-                    db, messages, modelo, temperatura, max_tokens, top_p, tools, stream
+                    db, messages, modelo, temperatura, max_tokens, top_p, tools, stream, ao_receber_texto
                 )
             else:
                 raise ValueError(f"Tipo de provedor não suportado: {provedor_info['tipo']}")
@@ -75,13 +96,13 @@ class LLMIntegrationService:
             
         except Exception as e:
             # 4. Fallback para OpenRouter se configurado
-            if provedor_info["tipo"] != "openrouter" and ConfiguracaoService.obter_valor(
+            if provedor_info["tipo"] != "openrouter" and not trechos_repassados and ConfiguracaoService.obter_valor(
                 db, "llm_fallback_openrouter", True
             ):
                 print(f"⚠️ Erro com provedor {provedor_info['tipo']}, tentando OpenRouter: {e}")
                 try:
                     resultado = await LLMIntegrationService._usar_openrouter(
-                        db, messages, modelo, temperatura, max_tokens, top_p, tools, stream
+                        db, messages, modelo, temperatura, max_tokens, top_p, tools, stream, ao_receber_texto
                     )
                     resultado["provedor_usado"] = "openrouter_fallback"
                     resultado["erro_original"] = str(e)
@@ -100,6 +121,31 @@ class LLMIntegrationService:
     ) -> Dict[str, Any]:
         """Determina qual provedor usar baseado no modelo e configurações."""
         
+        # Verificar configuração do agente (se houver)
+        if agente_id:
+            # TODO: Implementar configuração por agente
+            pass
+        
+        return LLMIntegrationService.escolher_provedor(
+            modelo, LLMIntegrationService.obter_provedor_local(db)
+        )
+
+    @staticmethod
+    def obter_provedor_local(db: Session):
+        """Provedor local configurado como padrão (None se o padrão não for local)."""
+        provedor_padrao = ConfiguracaoService.obter_valor(db, "llm_provedor_padrao", "openrouter")
+        if provedor_padrao != "local":
+            return None
+        
+        provedor_local_id = ConfiguracaoService.obter_valor(db, "llm_provedor_local_id")
+        if not provedor_local_id:
+            return None
+        return ProvedorLLMService.obter_por_id(db, provedor_local_id)
+
+    @staticmethod
+    def escolher_provedor(modelo: str, provedor_local=None) -> Dict[str, Any]:
+        """Escolhe o provedor do modelo, dado o provedor local padrão (se houver)."""
+        
         # 1. Verificar se o modelo é específico do OpenRouter (Gemini, Claude, etc.)
         modelos_openrouter = [
             "google/gemini", "anthropic/claude", "openai/gpt", 
@@ -109,28 +155,16 @@ class LLMIntegrationService:
         if any(modelo.startswith(prefix) for prefix in modelos_openrouter):
             return {"tipo": "openrouter", "motivo": "modelo_especifico_openrouter"}
         
-        # 2. Verificar configuração do agente (se houver)
-        if agente_id:
-            # TODO: Implementar configuração por agente
-            pass
-        
-        # 3. Verificar configuração global
-        provedor_padrao = ConfiguracaoService.obter_valor(db, "llm_provedor_padrao", "openrouter")
+        # 2. Provedor local configurado e ativo
+        if provedor_local and provedor_local.ativo:
+            return {
+                "tipo": "local",
+                "id": provedor_local.id,
+                "provedor": provedor_local,
+                "motivo": "configuracao_local"
+            }
         
-        if provedor_padrao == "local":
-            # Verificar se há provedor local configurado
-            provedor_local_id = ConfiguracaoService.obter_valor(db, "llm_provedor_local_id")
-            if provedor_local_id:
-                provedor = ProvedorLLMService.obter_por_id(db, provedor_local_id)
-                if provedor and provedor.ativo:
-                    return {
-                        "tipo": "local",
-                        "id": provedor.id,
-                        "provedor": provedor,
-                        "motivo": "configuracao_local"
-                    }
-        
-        # 4. Fallback para OpenRouter
+        # 3. Fallback para OpenRouter
         return {"tipo": "openrouter", "motivo": "fallback_padrao"}
 
     @staticmethod
@@ -143,7 +177,8 @@ class LLMIntegrationService:
         max_tokens: int,
         top_p: float,
         tools: Optional[List[Dict]],
-        stream: bool
+        stream: bool,
+        ao_receber_texto: Optional[Callable[[str], None]] = None
     ) -> Dict[str, Any]:
         """Usa um provedor local via llm_providers."""
         
@@ -160,9 +195,14 @@ class LLMIntegrationService:
         )
         
         # Enviar requisição
-        resposta = await ProvedorLLMService.enviar_requisicao(
-            db, provedor_info["id"], requisicao
-        )
+        if stream:
+            resposta = await ProvedorLLMService.enviar_requisicao_stream(
+                db, provedor_info["id"], requisicao, ao_receber_texto
+            )
+        else:
+            resposta = await ProvedorLLMService.enviar_requisicao(
+                db, provedor_info["id"], requisicao
+            )
         
         # Converter para formato padrão
         return {
@@ -171,6 +211,9 @@ class LLMIntegrationService:
             "tokens_input": None,  # Provedores locais podem não retornar
             "tokens_output": resposta.tokens_usados,
             "tempo_geracao_ms": resposta.tempo_geracao_ms,
+            "tempo_primeiro_trecho_ms": resposta.tempo_primeiro_trecho_ms,
+            "tool_calls": resposta.tool_calls,
+            "finish_reason": resposta.finish_reason,
             "finalizado": resposta.finalizado
         }
 
@@ -183,9 +226,10 @@ class LLMIntegrationService:
         max_tokens: int,
         top_p: float,
         tools: Optional[List[Dict]],
-        stream: bool
+        stream: bool,
+        ao_receber_texto: Optional[Callable[[str], None]] = None
     ) -> Dict[str, Any]:
-        """Usa OpenRouter diretamente."""
+        """Usa OpenRouter diretamente (com stream, lê os eventos SSE à medida que chegam)."""
         
         # Obter configurações
         api_key = ConfiguracaoService.obter_valor(db, "openrouter_api_key")
@@ -205,14 +249,48 @@ class LLMIntegrationService:
         if tools:
             payload["tools"] = tools
         
+        headers = {
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json"
+        }
+        
+        if stream:
+            from llm_providers.llm_stream_service import LLMStreamService
+            
+            # Contagem de tokens no último evento do stream
+            payload["stream_options"] = {"include_usage": True}
+            inicio = time.time()
+            # O timeout de leitura vale entre dois eventos, não para a geração inteira
+            async with httpx.AsyncClient(timeout=httpx.Timeout(60.0)) as client:
+                async with client.stream(
+                    "POST",
+                    "https://openrouter.ai/api/v1/chat/completions",
+                    headers=headers,
+                    json=payload
+                ) as response:
+                    if response.status_code != 200:
+                        corpo = (await response.aread()).decode("utf-8", "replace")
+                        raise ValueError(f"Erro na API OpenRouter: {response.status_code} - {corpo}")
+                    
+                    resultado = await LLMStreamService.ler_sse_openai(response, ao_receber_texto)
+            
+            return {
+                "conteudo": resultado["conteudo"],
+                "modelo": modelo,
+                "tokens_input": resultado["tokens_input"] or 0,
+                "tokens_output": resultado["tokens_output"] or 0,
+                "tool_calls": resultado["tool_calls"],
+                "finish_reason": resultado["finish_reason"],
+                "tempo_geracao_ms": (time.time() - inicio) * 1000,
+                "tempo_primeiro_trecho_ms": resultado["tempo_primeiro_trecho_ms"],
+                "finalizado": True
+            }
+        
         # Fazer requisição
         async with httpx.AsyncClient() as client:
             response = await client.post(
                 "https://openrouter.ai/api/v1/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {api_key}",
-                    "Content-Type": "application/json"
-                },
+                headers=headers,
                 json=payload,
                 timeout=60.0
             )
@@ -268,6 +346,113 @@ class LLMIntegrationService:
         
         return modelos
 
+    @staticmethod
+    async def suporta_imagens(
+        db: Session,
+        modelo: str,
+        modelos_provedor: Optional[Dict[str, Any]] = None
+    ) -> Optional[bool]:
+        """
+        Indica se o modelo aceita imagens na entrada.
+        Consulta o catálogo dos provedores (`ModeloProvedor.suporta_imagens`) e, para
+        os demais modelos, o mapa de capacidades do OpenRouter.
+        `modelos_provedor`: registros de ModeloProvedor já carregados, por modelo_id
+        (ex.: pelo ContextoTurno); se informado, o catálogo não é consultado.
+        
+        Returns:
+            True/False, ou None se o modelo não constar em nenhum dos dois
+        """
+        registro = LLMIntegrationService._obter_modelo_provedor(db, modelo, modelos_provedor)
+        if registro is not None:
+            return bool(registro.suporta_imagens)
+        
+        capacidades = await LLMIntegrationService._obter_capacidades_openrouter(db)
+        return capacidades["imagens"].get(modelo)
+
+    @staticmethod
+    async def obter_contexto(
+        db: Session,
+        modelo: str,
+        modelos_provedor: Optional[Dict[str, Any]] = None
+    ) -> Optional[int]:
+        """
+        Janela de contexto do modelo, em tokens: `ModeloProvedor.contexto` ou o
+        `context_length` do OpenRouter. None se desconhecida.
+        `modelos_provedor`: como em suporta_imagens.
+        """
+        registro = LLMIntegrationService._obter_modelo_provedor(db, modelo, modelos_provedor)
+        if registro is not None and isinstance(registro.contexto, int) and registro.contexto > 0:
+            return registro.contexto
+        
+        capacidades = await LLMIntegrationService._obter_capacidades_openrouter(db)
+        return capacidades["contexto"].get(modelo)
+
+    @staticmethod
+    def carregar_modelos_provedor(db: Session, modelos: List[str]) -> Dict[str, Any]:
+        """Registros de ModeloProvedor dos modelos, por modelo_id, em uma consulta."""
+        from llm_providers.llm_providers_model import ModeloProvedor
+        
+        registros = {}
+        if modelos:
+            for registro in db.query(ModeloProvedor)\
+                    .filter(ModeloProvedor.modelo_id.in_(modelos))\
+                    .order_by(ModeloProvedor.id)\
+                    .all():
+                registros.setdefault(registro.modelo_id, registro)
+        return registros
+
+    @staticmethod
+    def _obter_modelo_provedor(db: Session, modelo: str, modelos_provedor: Optional[Dict[str, Any]]):
+        if modelos_provedor is not None:
+            return modelos_provedor.get(modelo)
+        
+        from llm_providers.llm_providers_model import ModeloProvedor
+        return db.query(ModeloProvedor).filter(ModeloProvedor.modelo_id == modelo).first()
+
+    @staticmethod
+    async def _obter_capacidades_openrouter(db: Session) -> Dict[str, Any]:
+        """
+        Capacidades dos modelos do OpenRouter: `imagens` (modelo → aceita imagens, a
+        partir de `architecture.input_modalities`) e `contexto` (modelo → `context_length`).
+        Mantidas em memória por TTL_CAPACIDADES_OPENROUTER; se a busca falhar, usa as
+        últimas obtidas e tenta de novo em 5 minutos.
+        """
+        if time.time() - _capacidades_openrouter["atualizado_em"] < TTL_CAPACIDADES_OPENROUTER:
+            return _capacidades_openrouter
+        
+        headers = {"Content-Type": "application/json"}
+        api_key = ConfiguracaoService.obter_valor(db, "openrouter_api_key")
+        if api_key:
+            headers["Authorization"] = f"Bearer {api_key}"
+        
+        try:
+            async with httpx.AsyncClient() as client:
+                response = await client.get(
+                    "https://openrouter.ai/api/v1/models", headers=headers, timeout=10.0
+                )
+                response.raise_for_status()
+            
+            imagens = {}
+            contexto = {}
+            for modelo_data in response.json().get("data", []):
+                modelo_id = modelo_data.get("id", "")
+                arquitetura = modelo_data.get("architecture") or {}
+                entradas = arquitetura.get("input_modalities") or []
+                modalidade = (arquitetura.get("modality") or "").split("->")[0]
+                imagens[modelo_id] = "image" in entradas or "image" in modalidade
+                if modelo_data.get("context_length"):
+                    contexto[modelo_id] = int(modelo_data["context_length"])
+            
+            _capacidades_openrouter["imagens"] = imagens
+            _capacidades_openrouter["contexto"] = contexto
+            _capacidades_openrouter["atualizado_em"] = time.time()
+            print(f"👁️  [LLM] Capacidades de {len(imagens)} modelos do OpenRouter atualizadas")
+        except Exception as e:
+            print(f"⚠️  [LLM] Não foi possível obter as capacidades dos modelos do OpenRouter: {e}")
+            _capacidades_openrouter["atualizado_em"] = time.time() - TTL_CAPACIDADES_OPENROUTER + 300
+        
+        return _capacidades_openrouter
+
     @staticmethod
     def configurar_provedor_padrao(db: Session, tipo: str, provedor_id: Optional[int] = None):
         """Configura o provedor padrão do sistema."""
@@ -104,6 +104,9 @@ class RespostaLLM(BaseModel):
     tokens_usados: Optional[int] = Field(None, description="Número de tokens usados")
     tempo_geracao_ms: Optional[float] = Field(None, description="Tempo de geração em ms")
     finalizado: bool = Field(default=True, description="Se a resposta foi finalizada")
+    tool_calls: Optional[List[Dict[str, Any]]] = Field(None, description="Tool calls (formato OpenAI), em streaming")
+    finish_reason: Optional[str] = Field(None, description="Motivo do fim da geração, em streaming")
+    tempo_primeiro_trecho_ms: Optional[float] = Field(None, description="Tempo até o primeiro trecho de texto, em streaming")
 
 
 class EstatisticasProvedor(BaseModel):
@@ -325,14 +325,7 @@ class ProvedorLLMService:
         
         try:
             async with httpx.AsyncClient(timeout=30.0) as client:
-                # Normalizar base_url removendo endpoints específicos
-                base_url = str(provedor.base_url).rstrip('/')
-                # Remover endpoints comuns que podem estar no base_url
-                endpoints_to_remove = ['/v1/models', '/v1/chat/completions', '/api/tags', '/api/chat', '/v1']
-                for endpoint in endpoints_to_remove:
-                    if base_url.endswith(endpoint):
-                        base_url = base_url[:-len(endpoint)]
-                        break
+                base_url = ProvedorLLMService._normalizar_base_url(provedor)
                 
                 headers = {"Content-Type": "application/json"}
                 if provedor.api_key:
@@ -424,6 +417,114 @@ class ProvedorLLMService:
             ProvedorLLMService._atualizar_estatisticas(db, provedor_id, False, 0)
             raise e
 
+    @staticmethod
+    def _normalizar_base_url(provedor: ProvedorLLM) -> str:
+        """URL base do provedor sem endpoints específicos (ex.: /v1/chat/completions)."""
+        base_url = str(provedor.base_url).rstrip('/')
+        # Remover endpoints comuns que podem estar no base_url
+        endpoints_to_remove = ['/v1/models', '/v1/chat/completions', '/api/tags', '/api/chat', '/v1']
+        for endpoint in endpoints_to_remove:
+            if base_url.endswith(endpoint):
+                base_url = base_url[:-len(endpoint)]
+                break
+        return base_url
+
+    @staticmethod
+    async def enviar_requisicao_stream(
+        db: Session,
+        provedor_id: int,
+        requisicao: RequisicaoLLM,
+        ao_receber_texto=None
+    ) -> RespostaLLM:
+        """
+        Envia uma requisição em streaming para um provedor LLM.
+        Como em enviar_requisicao, tenta o endpoint OpenAI-compatível (SSE) e depois o
+        do Ollama (NDJSON); cada trecho de texto é repassado a `ao_receber_texto`
+        assim que chega.
+        """
+        from llm_providers.llm_stream_service import LLMStreamService
+
+        provedor = ProvedorLLMService.obter_por_id(db, provedor_id)
+        if not provedor:
+            raise ValueError("Provedor não encontrado")
+
+        if not provedor.ativo:
+            raise ValueError("Provedor não está ativo")
+
+        inicio_requisicao = time.time()
+        base_url = ProvedorLLMService._normalizar_base_url(provedor)
+        headers = {"Content-Type": "application/json"}
+        if provedor.api_key:
+            headers["Authorization"] = f"Bearer {provedor.api_key}"
+
+        payload_openai = {
+            "model": requisicao.modelo,
+            "messages": requisicao.mensagens,
+            "stream": True
+        }
+        payload_ollama = dict(payload_openai)
+        if requisicao.configuracao:
+            payload_openai.update({
+                "temperature": requisicao.configuracao.temperatura,
+                "max_tokens": requisicao.configuracao.max_tokens,
+                "top_p": requisicao.configuracao.top_p,
+                "stop": requisicao.configuracao.stop
+            })
+            payload_ollama["options"] = {
+                "temperature": requisicao.configuracao.temperatura,
+                "num_predict": requisicao.configuracao.max_tokens,
+                "top_p": requisicao.configuracao.top_p,
+                "top_k": requisicao.configuracao.top_k,
+                "repeat_penalty": requisicao.configuracao.repeat_penalty,
+                "stop": requisicao.configuracao.stop
+            }
+
+        tentativas = [
+            (f"{base_url}/v1/chat/completions", payload_openai, LLMStreamService.ler_sse_openai),
+            (f"{base_url}/api/chat", payload_ollama, LLMStreamService.ler_ndjson_ollama)
+        ]
+
+        erro_msg, status_code = "Nenhuma resposta do servidor", "N/A"
+        try:
+            # O timeout de leitura vale entre dois eventos, não para a geração inteira
+            async with httpx.AsyncClient(timeout=httpx.Timeout(30.0, read=60.0)) as client:
+                for url, payload, ler_stream in tentativas:
+                    iniciado = False
+                    try:
+                        async with client.stream("POST", url, json=payload, headers=headers) as response:
+                            if response.status_code != 200:
+                                status_code = response.status_code
+                                erro_msg = (await response.aread()).decode("utf-8", "replace")
+                                continue
+                            iniciado = True
+                            resultado = await ler_stream(response, ao_receber_texto)
+                    except httpx.TransportError as e:
+                        if iniciado:
+                            raise  # Parte do texto pode já ter sido repassada: não recomeçar
+                        erro_msg = str(e)
+                        continue
+
+                    tempo_geracao = (time.time() - inicio_requisicao) * 1000
+                    ProvedorLLMService._atualizar_estatisticas(db, provedor_id, True, tempo_geracao)
+
+                    tokens = [t for t in (resultado["tokens_input"], resultado["tokens_output"]) if t]
+                    return RespostaLLM(
+                        conteudo=resultado["conteudo"],
+                        modelo=requisicao.modelo,
+                        tokens_usados=sum(tokens) if tokens else None,
+                        tempo_geracao_ms=tempo_geracao,
+                        tool_calls=resultado["tool_calls"],
+                        finish_reason=resultado["finish_reason"],
+                        tempo_primeiro_trecho_ms=resultado["tempo_primeiro_trecho_ms"]
+                    )
+        except Exception as e:
+            ProvedorLLMService._atualizar_estatisticas(db, provedor_id, False, 0)
+            raise e
+
+        tempo_geracao = (time.time() - inicio_requisicao) * 1000
+        ProvedorLLMService._atualizar_estatisticas(db, provedor_id, False, tempo_geracao)
+        raise Exception(f"Erro HTTP {status_code}: {erro_msg}")
+
     @staticmethod
     def _atualizar_estatisticas(db: Session, provedor_id: int, sucesso: bool, tempo_ms: float):
         """Atualiza estatísticas do provedor."""
@@ -0,0 +1,165 @@
+"""
+Leitura das respostas em streaming dos provedores LLM.
+Monta a resposta completa (texto, tool calls, tokens) a partir dos eventos à medida
+que chegam, repassando cada trecho de texto a quem chamou, para que ele possa ser
+entregue antes de a geração terminar.
+"""
+from typing import Optional, Dict, Any, List, Callable
+from uuid import uuid4
+import json
+import time
+import httpx
+
+
+# Chamado com cada trecho de texto gerado, na ordem
+AoReceberTexto = Callable[[str], None]
+
+
+class LLMStreamService:
+    """Parsers dos formatos de streaming: SSE (OpenAI/OpenRouter) e NDJSON (Ollama)."""
+
+    @staticmethod
+    async def ler_sse_openai(
+        response: httpx.Response,
+        ao_receber_texto: Optional[AoReceberTexto] = None
+    ) -> Dict[str, Any]:
+        """
+        Lê um stream SSE de chat completions (`chat.completion.chunk`).
+
+        As tool calls chegam em fragmentos por `index` (id e nome no primeiro, os
+        argumentos em pedaços) e são montadas aqui. Depois da primeira tool call, o
+        texto deixa de ser repassado: a iteração vai voltar ao LLM com os resultados.
+
+        Returns:
+            Dict com: conteudo, tool_calls, finish_reason, tokens_input, tokens_output,
+            tempo_primeiro_trecho_ms
+        """
+        inicio = time.time()
+        conteudo: List[str] = []
+        tool_calls: Dict[int, Dict[str, Any]] = {}
+        finish_reason = None
+        usage: Dict[str, Any] = {}
+        tempo_primeiro_trecho_ms = None
+
+        async for linha in response.aiter_lines():
+            linha = linha.strip()
+            # Linhas vazias separam eventos; ":" são comentários (ex.: ": OPENROUTER PROCESSING")
+            if not linha.startswith("data:"):
+                continue
+            dados = linha[5:].strip()
+            if dados == "[DONE]":
+                break
+
+            evento = json.loads(dados)
+            if evento.get("error"):
+                raise ValueError(f"Erro no stream do LLM: {evento['error']}")
+            if evento.get("usage"):
+                usage = evento["usage"]
+
+            for choice in evento.get("choices") or []:
+                if choice.get("index", 0) != 0:
+                    continue
+                delta = choice.get("delta") or {}
+
+                trecho = delta.get("content")
+                if trecho:
+                    if tempo_primeiro_trecho_ms is None:
+                        tempo_primeiro_trecho_ms = (time.time() - inicio) * 1000
+                    conteudo.append(trecho)
+                    if ao_receber_texto and not tool_calls:
+                        ao_receber_texto(trecho)
+
+                for fragmento in delta.get("tool_calls") or []:
+                    indice = fragmento.get("index", len(tool_calls))
+                    tool_call = tool_calls.setdefault(indice, {
+                        "id": None,
+                        "type": "function",
+                        "function": {"name": "", "arguments": ""}
+                    })
+                    if fragmento.get("id"):
+                        tool_call["id"] = fragmento["id"]
+                    if fragmento.get("type"):
+                        tool_call["type"] = fragmento["type"]
+                    funcao = fragmento.get("function") or {}
+                    if funcao.get("name"):
+                        tool_call["function"]["name"] += funcao["name"]
+                    if funcao.get("arguments"):
+                        tool_call["function"]["arguments"] += funcao["arguments"]
+
+                if choice.get("finish_reason"):
+                    finish_reason = choice["finish_reason"]
+
+        return {
+            "conteudo": "".join(conteudo),
+            "tool_calls": [tool_calls[indice] for indice in sorted(tool_calls)] or None,
+            "finish_reason": finish_reason,
+            "tokens_input": usage.get("prompt_tokens"),
+            "tokens_output": usage.get("completion_tokens"),
+            "tempo_primeiro_trecho_ms": tempo_primeiro_trecho_ms
+        }
+
+    @staticmethod
+    async def ler_ndjson_ollama(
+        response: httpx.Response,
+        ao_receber_texto: Optional[AoReceberTexto] = None
+    ) -> Dict[str, Any]:
+        """
+        Lê um stream NDJSON do `/api/chat` do Ollama (um objeto JSON por linha, o último
+        com `done: true` e as contagens de tokens).
+
+        As tool calls do Ollama vêm inteiras, com argumentos em objeto; são convertidas
+        para o formato OpenAI (argumentos em string JSON, id gerado).
+
+        Returns:
+            O mesmo formato de ler_sse_openai
+        """
+        inicio = time.time()
+        conteudo: List[str] = []
+        tool_calls: List[Dict[str, Any]] = []
+        finish_reason = None
+        tokens_input = tokens_output = None
+        tempo_primeiro_trecho_ms = None
+
+        async for linha in response.aiter_lines():
+            if not linha.strip():
+                continue
+
+            evento = json.loads(linha)
+            if evento.get("error"):
+                raise ValueError(f"Erro no stream do LLM: {evento['error']}")
+            mensagem = evento.get("message") or {}
+
+            trecho = mensagem.get("content")
+            if trecho:
+                if tempo_primeiro_trecho_ms is None:
+                    tempo_primeiro_trecho_ms = (time.time() - inicio) * 1000
+                conteudo.append(trecho)
+                if ao_receber_texto and not tool_calls:
+                    ao_receber_texto(trecho)
+
+            for chamada in mensagem.get("tool_calls") or []:
+                funcao = chamada.get("function") or {}
+                argumentos = funcao.get("arguments", {})
+                tool_calls.append({
+                    "id": chamada.get("id") or f"call_{uuid4().hex[:12]}",
+                    "type": "function",
+                    "function": {
+                        "name": funcao.get("name", ""),
+                        "arguments": argumentos if isinstance(argumentos, str) else json.dumps(argumentos)
+                    }
+                })
+
+            if evento.get("done"):
+                finish_reason = "tool_calls" if tool_calls else evento.get("done_reason", "stop")
+                tokens_input = evento.get("prompt_eval_count")
+                tokens_output = evento.get("eval_count")
+                break
+
+        return {
+            "conteudo": "".join(conteudo),
+            "tool_calls": tool_calls or None,
+            "finish_reason": finish_reason,
+            "tokens_input": tokens_input,
+            "tokens_output": tokens_output,
+            "tempo_primeiro_trecho_ms": tempo_primeiro_trecho_ms
+        }
@@ -43,7 +43,18 @@ from llm_providers.llm_providers_frontend_router import router as llm_providers_
 from config.config_service import ConfiguracaoService
 from ferramenta.ferramenta_service import FerramentaService
 from metrica.metrica_service import MetricaService
-from sessao.sessao_service import SessaoService
+from sessao.sessao_service import SessaoService, gerenciador_sessoes
+from mensagem.mensagem_service import MensagemService
+from mensagem.mensagem_fila_service import fila_processamento
+from mensagem.mensagem_admissao_service import controle_admissao
+from mensagem.mensagem_envio_service import fila_envio
+from mensagem.mensagem_midia_service import armazem_midia
+from mensagem.mensagem_imagem_service import processador_imagens
+from mensagem.mensagem_contexto_service import cache_contexto
+from mensagem.mensagem_historico_service import expurgo_historico
+from mensagem.mensagem_arquivo_service import arquivo_mensagens
+from mensagem.mensagem_retencao_service import retencao_dados
+from mensagem.mensagem_segundo_plano_service import tarefas_segundo_plano
 
 # Criar aplicação FastAPI
 app = FastAPI(
@@ -89,10 +100,68 @@ def startup_event():
         ConfiguracaoService.inicializar_configuracoes_padrao(db)
         print("✅ Configurações padrão inicializadas")
         
+        # Armazém de mídias (e migração das imagens ainda em base64 no banco)
+        diretorio_uploads = ConfiguracaoService.obter_valor(db, "sistema_diretorio_uploads", "./uploads")
+        armazem_midia.configurar(diretorio=os.path.join(diretorio_uploads, "midia"))
+        arquivo_mensagens.configurar(diretorio=os.path.join(diretorio_uploads, "arquivo"))
+        imagens_migradas = armazem_midia.migrar_legado()
+        if imagens_migradas > 0:
+            print(f"🗃️  {imagens_migradas} imagem(ns) movida(s) do banco para o armazém de mídias")
+        processador_imagens.configurar(
+            lado_maximo=ConfiguracaoService.obter_valor(db, "processamento_imagem_lado_maximo", 1024),
+            qualidade=ConfiguracaoService.obter_valor(db, "processamento_imagem_qualidade", 80),
+            num_processos=ConfiguracaoService.obter_valor(db, "processamento_imagem_processos", 2)
+        )
+        
         # Inicializar ferramentas padrão
         FerramentaService.criar_ferramentas_padrao(db)
         print("✅ Ferramentas padrão criadas")
         
+        # Iniciar pool de processamento de mensagens (antes de reconectar sessões)
+        fila_processamento.configurar(
+            num_workers=ConfiguracaoService.obter_valor(db, "processamento_workers", 4),
+            tamanho_fila=ConfiguracaoService.obter_valor(db, "processamento_tamanho_fila", 500),
+            timeout_enfileirar=ConfiguracaoService.obter_valor(db, "processamento_timeout_enfileirar", 2.0),
+            cancelamento_ativo=ConfiguracaoService.obter_valor(db, "processamento_cancelar_turnos_obsoletos", True)
+        )
+        fila_processamento.iniciar()
+        controle_admissao.configurar(
+            max_global=ConfiguracaoService.obter_valor(db, "processamento_max_turnos", 0),
+            timeout_espera=ConfiguracaoService.obter_valor(db, "processamento_timeout_turno", 10.0),
+            politica=ConfiguracaoService.obter_valor(db, "processamento_politica_sobrecarga", "avisar")
+        )
+        
+        fila_envio.configurar(
+            taxa_sessao=ConfiguracaoService.obter_valor(db, "processamento_envio_taxa_sessao", 1.0),
+            rajada_sessao=ConfiguracaoService.obter_valor(db, "processamento_envio_rajada_sessao", 5),
+            taxa_contato=ConfiguracaoService.obter_valor(db, "processamento_envio_taxa_contato", 0.5),
+            rajada_contato=ConfiguracaoService.obter_valor(db, "processamento_envio_rajada_contato", 3),
+            max_tentativas=ConfiguracaoService.obter_valor(db, "processamento_envio_max_tentativas", 3),
+            intervalo_partes=ConfiguracaoService.obter_valor(db, "processamento_envio_intervalo_partes", 0.8),
+            max_caracteres_parte=ConfiguracaoService.obter_valor(db, "processamento_envio_max_caracteres", 4000)
+        )
+        fila_envio.iniciar()
+        tarefas_segundo_plano.iniciar()
+        cache_contexto.configurar(
+            capacidade=ConfiguracaoService.obter_valor(db, "processamento_cache_contexto_conversas", 1000),
+            mensagens_por_conversa=ConfiguracaoService.obter_valor(db, "processamento_cache_contexto_mensagens", 30)
+        )
+        expurgo_historico.configurar(
+            lote=ConfiguracaoService.obter_valor(db, "processamento_expurgo_lote", 500),
+            retencao_horas=ConfiguracaoService.obter_valor(db, "processamento_expurgo_retencao_horas", 0)
+        )
+        expurgo_historico.iniciar()
+        expurgo_historico.agendar()  # Conclui expurgos interrompidos
+        retencao_dados.configurar(
+            intervalo_horas=ConfiguracaoService.obter_valor(db, "processamento_retencao_intervalo_horas", 6)
+        )
+        retencao_dados.iniciar()
+        retencao_dados.agendar()
+        gerenciador_sessoes.configurar(
+            backend=ConfiguracaoService.obter_valor(db, "processamento_backend_whatsapp", "thread"),
+            max_threads_async=ConfiguracaoService.obter_valor(db, "processamento_threads_backend_async", 64)
+        )
+        
         # Reconectar sessões que estavam conectadas
         print("🔄 Reconectando sessões ativas...")
         sessoes_ativas = SessaoService.listar_todas(db, apenas_ativas=True)
@@ -112,12 +181,32 @@ def startup_event():
         if sessoes_reconectadas > 0:
             print(f"✅ {sessoes_reconectadas} sessão(ões) reconectada(s)")
         
+        # Retomar turnos interrompidos por reinício ou queda durante o processamento
+        conversas_retomadas = MensagemService.recuperar_pendentes(db)
+        if conversas_retomadas > 0:
+            print(f"♻️  {conversas_retomadas} conversa(s) com mensagens pendentes reagendada(s)")
+        
         print("✅ Fluxi iniciado com sucesso!")
         print("📱 Acesse: http://localhost:8000")
     finally:
         db.close()
 
 
+# Evento de encerramento
+@app.on_event("shutdown")
+def shutdown_event():
+    """Encerra os workers de processamento (e grava as marcas d'água pendentes), a fila de envio, as tarefas de segundo plano e de manutenção, o pool de imagens e as sessões assíncronas."""
+    fila_processamento.parar()
+    SessaoService.gravar_marcas_dagua()
+    fila_envio.parar()
+    tarefas_segundo_plano.parar()
+    expurgo_historico.parar()
+    retencao_dados.parar()
+    processador_imagens.parar()
+    gerenciador_sessoes.encerrar()
+    print("👋 Fluxi encerrado")
+
+
 # Registrar routers API
 app.include_router(config_api_router)
 app.include_router(sessao_api_router)
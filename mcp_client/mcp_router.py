@@ -251,6 +251,8 @@ async def desconectar_mcp_client(mcp_client_id: int, db: Session = Depends(get_d
     # Atualizar banco
     db_mcp.conectado = False
     db.commit()
+    from agente.agente_catalogo_service import catalogo_ferramentas
+    catalogo_ferramentas.invalidar_agente(db_mcp.agente_id)
     
     return {"mensagem": "Cliente MCP desconectado"}
 
@@ -68,6 +68,8 @@ class MCPService:
         db_mcp = MCPClient(**data)
         db.add(db_mcp)
         db.commit()
+        from agente.agente_catalogo_service import catalogo_ferramentas
+        catalogo_ferramentas.invalidar_agente(db_mcp.agente_id)
         db.refresh(db_mcp)
         return db_mcp
     
@@ -83,6 +85,8 @@ class MCPService:
             setattr(db_mcp, campo, valor)
 
         db.commit()
+        from agente.agente_catalogo_service import catalogo_ferramentas
+        catalogo_ferramentas.invalidar_agente(db_mcp.agente_id)
         db.refresh(db_mcp)
         return db_mcp
 
@@ -108,8 +112,11 @@ class MCPService:
                 pass
         
         # Deletar do banco (cascade vai deletar as tools)
+        agente_id = db_mcp.agente_id
         db.delete(db_mcp)
         db.commit()
+        from agente.agente_catalogo_service import catalogo_ferramentas
+        catalogo_ferramentas.invalidar_agente(agente_id)
         return True
 
     # Presets -----------------------------------------------------------------
@@ -357,6 +364,8 @@ class MCPService:
             db_mcp.conectado = False
             db_mcp.ultimo_erro = str(e)
             db.commit()
+            from agente.agente_catalogo_service import catalogo_ferramentas
+            catalogo_ferramentas.invalidar_agente(db_mcp.agente_id)
             
             return {
                 "sucesso": False,
@@ -497,6 +506,11 @@ class MCPService:
             
             db.commit()
             
+            # Tools novas/removidas (e a conexão que precede a sincronização) mudam o catálogo do agente
+            if db_mcp:
+                from agente.agente_catalogo_service import catalogo_ferramentas
+                catalogo_ferramentas.invalidar_agente(db_mcp.agente_id)
+            
             return len(tools_names_novas)
         
         except Exception as e:
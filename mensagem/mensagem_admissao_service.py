@@ -0,0 +1,145 @@
+"""
+Controle de admissão dos turnos do agente.
+Limita quantas respostas do agente executam ao mesmo tempo, por sessão e no total,
+para que uma sessão com muito movimento não esgote a cota do provedor LLM das demais.
+"""
+from typing import Optional, Dict, Any, Hashable
+import threading
+import time
+from mensagem.mensagem_fila_service import Histograma
+
+
+POLITICAS_SOBRECARGA = ("avisar", "adiar")
+
+
+class ControleAdmissao:
+    """
+    Contadores de turnos em andamento por sessão e globais.
+
+    Um turno que excede algum limite não ocupa o worker esperando: é recusado e
+    reagendado (adiado). Se a espera passar de `timeout_espera` segundos e a política
+    for "avisar", o contato recebe uma única mensagem de "estamos ocupados".
+    """
+
+    def __init__(
+        self,
+        max_global: int = 0,
+        timeout_espera: float = 10.0,
+        intervalo_retentativa: float = 2.0,
+        politica: str = "avisar"
+    ):
+        self.max_global = max_global
+        self.timeout_espera = timeout_espera
+        self.intervalo_retentativa = intervalo_retentativa
+        self.politica = politica
+
+        self._lock = threading.Lock()
+        self._em_andamento_global = 0
+        self._em_andamento_sessao: Dict[int, int] = {}
+        # Conversas aguardando vaga: chave -> {"inicio": timestamp, "avisado": bool}
+        self._aguardando: Dict[Hashable, Dict[str, Any]] = {}
+
+        # Métricas
+        self._admitidos = 0
+        self._recusas = {"sessao": 0, "global": 0}
+        self._avisos_ocupado = 0
+        self._histograma_espera = Histograma()
+
+    def configurar(
+        self,
+        max_global: Optional[int] = None,
+        timeout_espera: Optional[float] = None,
+        intervalo_retentativa: Optional[float] = None,
+        politica: Optional[str] = None
+    ):
+        """Ajusta os limites. Pode ser chamado a qualquer momento."""
+        with self._lock:
+            if max_global is not None:
+                self.max_global = max(0, int(max_global))
+            if timeout_espera is not None:
+                self.timeout_espera = max(0.0, float(timeout_espera))
+            if intervalo_retentativa is not None:
+                self.intervalo_retentativa = max(0.1, float(intervalo_retentativa))
+            if politica is not None:
+                if politica not in POLITICAS_SOBRECARGA:
+                    print(f"⚠️  [ADMISSAO] Política desconhecida '{politica}', usando 'avisar'")
+                    politica = "avisar"
+                self.politica = politica
+
+    def admitir(self, chave: Hashable, sessao_id: int, max_sessao: int = 0) -> Dict[str, Any]:
+        """
+        Tenta reservar uma vaga para o turno da conversa `chave`.
+
+        Returns:
+            Dict com: admitido, motivo ("sessao"/"global" quando recusado),
+            espera_ms (desde a primeira tentativa) e avisar (enviar aviso de ocupado agora)
+        """
+        agora = time.time()
+        with self._lock:
+            espera = self._aguardando.get(chave)
+            espera_ms = (agora - espera["inicio"]) * 1000 if espera else 0.0
+
+            motivo = None
+            if max_sessao and self._em_andamento_sessao.get(sessao_id, 0) >= max_sessao:
+                motivo = "sessao"
+            elif self.max_global and self._em_andamento_global >= self.max_global:
+                motivo = "global"
+
+            if motivo is None:
+                self._em_andamento_global += 1
+                self._em_andamento_sessao[sessao_id] = self._em_andamento_sessao.get(sessao_id, 0) + 1
+                self._aguardando.pop(chave, None)
+                self._admitidos += 1
+                self._histograma_espera.registrar(espera_ms)
+                return {"admitido": True, "motivo": None, "espera_ms": espera_ms, "avisar": False}
+
+            if espera is None:
+                espera = self._aguardando[chave] = {"inicio": agora, "avisado": False}
+            self._recusas[motivo] += 1
+
+            avisar = (
+                self.politica == "avisar"
+                and not espera["avisado"]
+                and espera_ms >= self.timeout_espera * 1000
+            )
+            if avisar:
+                espera["avisado"] = True
+                self._avisos_ocupado += 1
+
+        return {"admitido": False, "motivo": motivo, "espera_ms": espera_ms, "avisar": avisar}
+
+    def liberar(self, sessao_id: int):
+        """Devolve a vaga de um turno admitido."""
+        with self._lock:
+            self._em_andamento_global = max(0, self._em_andamento_global - 1)
+            restantes = self._em_andamento_sessao.get(sessao_id, 0) - 1
+            if restantes > 0:
+                self._em_andamento_sessao[sessao_id] = restantes
+            else:
+                self._em_andamento_sessao.pop(sessao_id, None)
+
+    def desistir(self, chave: Hashable):
+        """Remove a conversa da espera (ex.: não há mais mensagens a responder)."""
+        with self._lock:
+            self._aguardando.pop(chave, None)
+
+    def obter_metricas(self) -> Dict[str, Any]:
+        """Retorna um retrato dos limites, da ocupação e das recusas."""
+        with self._lock:
+            return {
+                "max_global": self.max_global,
+                "politica": self.politica,
+                "timeout_espera_s": self.timeout_espera,
+                "turnos_em_andamento": self._em_andamento_global,
+                "turnos_por_sessao": dict(self._em_andamento_sessao),
+                "conversas_aguardando": len(self._aguardando),
+                "admitidos": self._admitidos,
+                "recusas_sessao": self._recusas["sessao"],
+                "recusas_global": self._recusas["global"],
+                "avisos_ocupado": self._avisos_ocupado,
+                "histograma_espera_ms": self._histograma_espera.to_dict()
+            }
+
+
+# Instância global do controle de admissão
+controle_admissao = ControleAdmissao()
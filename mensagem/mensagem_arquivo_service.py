@@ -0,0 +1,224 @@
+"""
+Arquivo das mensagens antigas em disco.
+Mensagens além da retenção da sessão saem da tabela `mensagens` para arquivos JSONL
+compactados (gzip), particionados por sessão e por dia; a leitura é em streaming,
+para exportações e métricas históricas sem carregar tudo na memória.
+"""
+from typing import Optional, Iterator, Dict, Any, List, Tuple
+from datetime import datetime, date
+from pathlib import Path
+import gzip
+import json
+import os
+import shutil
+import threading
+import time
+from uuid import uuid4
+from sqlalchemy.orm import Session
+from mensagem.mensagem_model import Mensagem
+
+
+class ArquivoMensagens:
+    """
+    Partições em `diretorio/mensagens/sessao_<id>/<AAAA-MM-DD>/<primeiro id>-<último id>.jsonl.gz`.
+
+    Cada lote arquivado grava um arquivo por dia (gravação atômica) antes de apagar as
+    linhas do banco; se o processo cair no meio, o mesmo lote é regravado com o mesmo nome.
+    As mídias das mensagens arquivadas são copiadas para `diretorio/midias/` antes de
+    a referência no armazém ser liberada.
+    """
+
+    def __init__(self, diretorio: str = "./uploads/arquivo"):
+        self.diretorio = Path(diretorio)
+        self._lock = threading.Lock()
+
+        # Métricas
+        self._mensagens_arquivadas = 0
+        self._arquivos_gravados = 0
+        self._bytes_gravados = 0
+        self._midias_arquivadas = 0
+
+    def configurar(self, diretorio: Optional[str] = None):
+        """Define o diretório do arquivo."""
+        if diretorio:
+            self.diretorio = Path(diretorio)
+
+    def diretorio_sessao(self, sessao_id: int) -> Path:
+        return self.diretorio / "mensagens" / f"sessao_{sessao_id}"
+
+    def caminho_midia(self, hash_midia: str) -> Path:
+        """Caminho da cópia arquivada de uma mídia."""
+        return self.diretorio / "midias" / hash_midia[:2] / hash_midia
+
+    @staticmethod
+    def serializar(mensagem: Mensagem) -> Dict[str, Any]:
+        """Todas as colunas da mensagem, com datas em ISO 8601."""
+        registro = {}
+        for coluna in Mensagem.__table__.columns:
+            valor = getattr(mensagem, coluna.name)
+            registro[coluna.name] = valor.isoformat() if isinstance(valor, (datetime, date)) else valor
+        return registro
+
+    def arquivar_sessao(self, db: Session, sessao_id: int, antes_de: datetime, lote: int = 1000) -> int:
+        """
+        Move para o arquivo, em lotes, as mensagens da sessão criadas antes de `antes_de`.
+
+        Returns:
+            Número de mensagens arquivadas
+        """
+        from mensagem.mensagem_midia_service import armazem_midia
+        from mensagem.mensagem_contexto_service import cache_contexto
+
+        total = 0
+        while True:
+            mensagens = db.query(Mensagem)\
+                .filter(Mensagem.sessao_id == sessao_id, Mensagem.criado_em < antes_de)\
+                .order_by(Mensagem.id)\
+                .limit(lote)\
+                .all()
+            if not mensagens:
+                break
+
+            por_dia: Dict[str, List[Dict[str, Any]]] = {}
+            hashes = []
+            for mensagem in mensagens:
+                registro = self.serializar(mensagem)
+                if mensagem.conteudo_midia_hash:
+                    if self._arquivar_midia(armazem_midia, mensagem.conteudo_midia_hash):
+                        registro["midia_arquivada"] = str(
+                            self.caminho_midia(mensagem.conteudo_midia_hash).relative_to(self.diretorio)
+                        )
+                    hashes.append(mensagem.conteudo_midia_hash)
+                dia = (mensagem.criado_em or datetime.now()).strftime("%Y-%m-%d")
+                por_dia.setdefault(dia, []).append(registro)
+
+            for dia, registros in por_dia.items():
+                self._gravar_particao(sessao_id, dia, registros)
+
+            conversas = {m.telefone_cliente for m in mensagens}
+            db.query(Mensagem)\
+                .filter(Mensagem.id.in_([m.id for m in mensagens]))\
+                .delete(synchronize_session=False)
+            db.commit()
+            db.expunge_all()
+
+            armazem_midia.liberar(hashes)
+            for telefone_cliente in conversas:
+                cache_contexto.invalidar(sessao_id, telefone_cliente)
+
+            total += len(mensagens)
+            with self._lock:
+                self._mensagens_arquivadas += len(mensagens)
+            # Deixa outras escritas pegarem o lock do banco entre os lotes
+            time.sleep(0.05)
+
+        if total:
+            print(f"🗄️  [ARQUIVO] {total} mensagem(ns) da sessão {sessao_id} arquivada(s)")
+        return total
+
+    def _gravar_particao(self, sessao_id: int, dia: str, registros: List[Dict[str, Any]]):
+        """Grava um arquivo da partição do dia (atômico: temporário + rename)."""
+        pasta = self.diretorio_sessao(sessao_id) / dia
+        pasta.mkdir(parents=True, exist_ok=True)
+        destino = pasta / f"{registros[0]['id']}-{registros[-1]['id']}.jsonl.gz"
+        temporario = pasta / f".{destino.name}.{uuid4().hex}.tmp"
+
+        with gzip.open(temporario, "wt", encoding="utf-8") as arquivo:
+            for registro in registros:
+                arquivo.write(json.dumps(registro, ensure_ascii=False, default=str))
+                arquivo.write("\n")
+        os.replace(temporario, destino)
+
+        with self._lock:
+            self._arquivos_gravados += 1
+            self._bytes_gravados += destino.stat().st_size
+
+    def _arquivar_midia(self, armazem_midia, hash_midia: str) -> bool:
+        """Copia a mídia do armazém para o arquivo (uma vez por hash)."""
+        destino = self.caminho_midia(hash_midia)
+        if destino.exists():
+            return True
+        origem = armazem_midia.caminho(hash_midia)
+        if not origem.exists():
+            return False
+
+        destino.parent.mkdir(parents=True, exist_ok=True)
+        temporario = destino.with_name(f".{hash_midia}.{uuid4().hex}.tmp")
+        try:
+            os.link(origem, temporario)  # Mesmo disco: sem cópia
+        except OSError:
+            shutil.copyfile(origem, temporario)
+        os.replace(temporario, destino)
+        with self._lock:
+            self._midias_arquivadas += 1
+        return True
+
+    def listar_particoes(
+        self,
+        sessao_id: Optional[int] = None,
+        inicio: Optional[date] = None,
+        fim: Optional[date] = None
+    ) -> List[Tuple[int, str, Path]]:
+        """
+        Arquivos das partições no intervalo, em ordem (sessão, dia, primeiro id).
+        Partições fora do intervalo são descartadas pelo nome, sem abrir os arquivos.
+        """
+        raiz = self.diretorio / "mensagens"
+        if sessao_id is not None:
+            pastas_sessao = [self.diretorio_sessao(sessao_id)]
+        else:
+            pastas_sessao = sorted(raiz.glob("sessao_*")) if raiz.exists() else []
+
+        particoes = []
+        for pasta_sessao in pastas_sessao:
+            if not pasta_sessao.is_dir():
+                continue
+            id_sessao = int(pasta_sessao.name.split("_", 1)[1])
+            for pasta_dia in sorted(pasta_sessao.iterdir()):
+                dia = pasta_dia.name
+                if (inicio and dia < inicio.isoformat()) or (fim and dia > fim.isoformat()):
+                    continue
+                arquivos = sorted(
+                    pasta_dia.glob("*.jsonl.gz"),
+                    key=lambda caminho: int(caminho.name.split("-", 1)[0])
+                )
+                particoes.extend((id_sessao, dia, arquivo) for arquivo in arquivos)
+        return particoes
+
+    def ler(
+        self,
+        sessao_id: Optional[int] = None,
+        inicio: Optional[date] = None,
+        fim: Optional[date] = None
+    ) -> Iterator[Dict[str, Any]]:
+        """Lê as mensagens arquivadas do intervalo, uma por vez (streaming)."""
+        for _, _, arquivo in self.listar_particoes(sessao_id, inicio, fim):
+            with gzip.open(arquivo, "rt", encoding="utf-8") as linhas:
+                for linha in linhas:
+                    if linha.strip():
+                        yield json.loads(linha)
+
+    def exportar_ndjson(
+        self,
+        sessao_id: Optional[int] = None,
+        inicio: Optional[date] = None,
+        fim: Optional[date] = None
+    ) -> Iterator[bytes]:
+        """Mensagens arquivadas como NDJSON, para respostas em streaming."""
+        for registro in self.ler(sessao_id, inicio, fim):
+            yield (json.dumps(registro, ensure_ascii=False) + "\n").encode("utf-8")
+
+    def obter_metricas(self) -> Dict[str, Any]:
+        """Retorna o volume arquivado desde a inicialização."""
+        with self._lock:
+            return {
+                "diretorio": str(self.diretorio),
+                "mensagens_arquivadas": self._mensagens_arquivadas,
+                "arquivos_gravados": self._arquivos_gravados,
+                "bytes_gravados": self._bytes_gravados,
+                "midias_arquivadas": self._midias_arquivadas
+            }
+
+
+# Instância global do arquivo de mensagens
+arquivo_mensagens = ArquivoMensagens()
@@ -0,0 +1,162 @@
+"""
+Cache em memória do contexto recente das conversas.
+Guarda, por conversa (sessao_id, telefone_cliente), cópias leves das últimas mensagens
+com só os campos usados no histórico do agente. O banco só é consultado quando a
+conversa não está no cache (ou o cache não tem mensagens suficientes).
+"""
+from typing import Optional, List, Dict, Any, Tuple
+from collections import OrderedDict
+import threading
+
+
+class TurnoContexto:
+    """Cópia leve de uma mensagem, com os campos usados para montar o histórico."""
+
+    __slots__ = (
+        "id", "tipo", "direcao", "conteudo_texto", "resposta_texto",
+        "conteudo_midia_hash", "conteudo_mime_type", "conteudo_imagem_descricao",
+        "criado_em"
+    )
+
+    # Imagens legadas em base64 são migradas na inicialização; o cache nunca as carrega
+    conteudo_imagem_base64 = None
+
+    def __init__(self, mensagem):
+        for campo in self.__slots__:
+            setattr(self, campo, getattr(mensagem, campo, None))
+
+    def __repr__(self):
+        return f"<TurnoContexto(id={self.id}, direcao='{self.direcao}', tipo='{self.tipo}')>"
+
+
+class CacheContexto:
+    """
+    LRU thread-safe de conversas, cada uma com as mensagens mais recentes (da mais nova
+    para a mais antiga, como `listar_por_cliente`).
+
+    Mantido atualizado na escrita (`registrar`) e invalidado no `#limpar` e ao apagar
+    a sessão; mensagens de épocas anteriores ao `#limpar` são ignoradas. `completo` indica que a conversa inteira cabe no cache, o que permite
+    atender pedidos maiores que o número de mensagens guardadas.
+    """
+
+    def __init__(self, capacidade: int = 1000, mensagens_por_conversa: int = 30):
+        self.capacidade = capacidade
+        self.mensagens_por_conversa = mensagens_por_conversa
+        self._conversas: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Métricas
+        self._acertos = 0
+        self._falhas = 0
+        self._invalidacoes = 0
+
+    def configurar(self, capacidade: Optional[int] = None, mensagens_por_conversa: Optional[int] = None):
+        """Ajusta os limites do cache."""
+        with self._lock:
+            if capacidade is not None:
+                self.capacidade = max(0, int(capacidade))
+            if mensagens_por_conversa is not None:
+                self.mensagens_por_conversa = max(1, int(mensagens_por_conversa))
+            self._conversas.clear()
+
+    def obter(self, sessao_id: int, telefone_cliente: str, limite: int) -> Optional[List[TurnoContexto]]:
+        """
+        Retorna as `limite` mensagens mais recentes da conversa, ou None se o cache
+        não puder atender (a consulta ao banco deve ser feita e passada a `carregar`).
+        """
+        chave = (sessao_id, telefone_cliente)
+        with self._lock:
+            conversa = self._conversas.get(chave)
+            if conversa is None or (len(conversa["mensagens"]) < limite and not conversa["completo"]):
+                self._falhas += 1
+                return None
+            self._conversas.move_to_end(chave)
+            self._acertos += 1
+            return conversa["mensagens"][:limite]
+
+    def carregar(
+        self,
+        sessao_id: int,
+        telefone_cliente: str,
+        mensagens: List,
+        limite: int,
+        inicio_mensagem_id: int = 0
+    ) -> List[TurnoContexto]:
+        """
+        Guarda o resultado de uma consulta ao banco (mensagens da mais nova para a mais antiga).
+        `inicio_mensagem_id` é o início da época atual do histórico (mensagens de id
+        menor ou igual não entram mais no cache).
+
+        Returns:
+            As mensagens convertidas em TurnoContexto
+        """
+        turnos = [TurnoContexto(m) for m in mensagens]
+        if self.capacidade <= 0:
+            return turnos
+
+        with self._lock:
+            self._conversas[(sessao_id, telefone_cliente)] = {
+                "mensagens": turnos[:self.mensagens_por_conversa],
+                "completo": len(turnos) < limite and len(turnos) <= self.mensagens_por_conversa,
+                "inicio": inicio_mensagem_id
+            }
+            self._conversas.move_to_end((sessao_id, telefone_cliente))
+            while len(self._conversas) > self.capacidade:
+                self._conversas.popitem(last=False)
+        return turnos
+
+    def registrar(self, mensagem):
+        """
+        Atualiza o cache com uma mensagem gravada (nova ou alterada).
+        Conversas que não estão no cache são ignoradas: serão carregadas quando usadas.
+        """
+        chave = (mensagem.sessao_id, mensagem.telefone_cliente)
+        with self._lock:
+            conversa = self._conversas.get(chave)
+            if conversa is None or mensagem.id <= conversa["inicio"]:
+                return  # Fora do cache ou de uma época anterior (#limpar)
+
+            turno = TurnoContexto(mensagem)
+            mensagens = conversa["mensagens"]
+            for i, existente in enumerate(mensagens):
+                if existente.id == turno.id:
+                    mensagens[i] = turno
+                    return
+
+            # Mensagem nova: entra na frente (ids crescem com a chegada)
+            mensagens.insert(0, turno)
+            if len(mensagens) > self.mensagens_por_conversa:
+                del mensagens[self.mensagens_por_conversa:]
+                conversa["completo"] = False
+
+    def invalidar(self, sessao_id: int, telefone_cliente: str):
+        """Remove uma conversa do cache (ex.: #limpar)."""
+        with self._lock:
+            if self._conversas.pop((sessao_id, telefone_cliente), None) is not None:
+                self._invalidacoes += 1
+
+    def invalidar_sessao(self, sessao_id: int):
+        """Remove todas as conversas de uma sessão (ex.: sessão apagada)."""
+        with self._lock:
+            chaves: List[Tuple] = [chave for chave in self._conversas if chave[0] == sessao_id]
+            for chave in chaves:
+                del self._conversas[chave]
+            self._invalidacoes += len(chaves)
+
+    def obter_metricas(self) -> Dict[str, Any]:
+        """Retorna ocupação, acertos e falhas do cache."""
+        with self._lock:
+            consultas = self._acertos + self._falhas
+            return {
+                "conversas_em_cache": len(self._conversas),
+                "capacidade": self.capacidade,
+                "mensagens_por_conversa": self.mensagens_por_conversa,
+                "acertos": self._acertos,
+                "falhas": self._falhas,
+                "taxa_acerto": round(self._acertos / consultas, 3) if consultas else 0,
+                "invalidacoes": self._invalidacoes
+            }
+
+
+# Instância global do cache de contexto
+cache_contexto = CacheContexto()
@@ -0,0 +1,69 @@
+"""
+Deduplicação de mensagens recebidas do WhatsApp.
+O whatsmeow reentrega mensagens após reconexões; um LRU em memória dos IDs recentes
+descarta a reentrega antes de enfileirar, e o índice único
+(sessao_id, mensagem_id_whatsapp) garante a unicidade no banco.
+"""
+from typing import Dict, Any
+from collections import OrderedDict
+import threading
+
+
+class DeduplicadorMensagens:
+    """LRU thread-safe dos IDs de mensagens vistos recentemente, por sessão."""
+
+    def __init__(self, capacidade: int = 10000):
+        self.capacidade = capacidade
+        self._ids: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Métricas
+        self._duplicadas_memoria = 0
+        self._duplicadas_banco = 0
+
+    def registrar(self, sessao_id: int, mensagem_id: str) -> bool:
+        """
+        Registra o ID de uma mensagem recebida.
+
+        Returns:
+            True se a mensagem é nova, False se é uma reentrega recente (descartar)
+        """
+        if not mensagem_id:
+            return True
+
+        chave = (sessao_id, mensagem_id)
+        with self._lock:
+            if chave in self._ids:
+                self._ids.move_to_end(chave)
+                self._duplicadas_memoria += 1
+                return False
+
+            self._ids[chave] = True
+            if len(self._ids) > self.capacidade:
+                self._ids.popitem(last=False)
+            return True
+
+    def esquecer(self, sessao_id: int, mensagem_id: str):
+        """Remove um ID (ex.: a mensagem não chegou a ser enfileirada e pode ser reentregue)."""
+        with self._lock:
+            self._ids.pop((sessao_id, mensagem_id), None)
+
+    def contar_duplicada_banco(self):
+        """Conta uma duplicata barrada pelo banco (não estava mais no LRU)."""
+        with self._lock:
+            self._duplicadas_banco += 1
+
+    def obter_metricas(self) -> Dict[str, Any]:
+        """Retorna o tamanho do LRU e as duplicatas suprimidas."""
+        with self._lock:
+            return {
+                "ids_em_memoria": len(self._ids),
+                "capacidade": self.capacidade,
+                "duplicadas_memoria": self._duplicadas_memoria,
+                "duplicadas_banco": self._duplicadas_banco,
+                "duplicadas_suprimidas": self._duplicadas_memoria + self._duplicadas_banco
+            }
+
+
+# Instância global do deduplicador
+deduplicador_mensagens = DeduplicadorMensagens()
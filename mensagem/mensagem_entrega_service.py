@@ -0,0 +1,172 @@
+"""
+Entrega progressiva da resposta do agente.
+Enquanto o turno executa, o contato vê o indicador "digitando..."; com a resposta em
+streaming, cada parágrafo concluído vai para a fila de envio assim que o LLM o termina,
+em vez de a resposta inteira sair só no fim da geração.
+"""
+from typing import Optional, List, Callable, Any
+from concurrent.futures import Future
+import asyncio
+
+
+# Fim de parágrafo no texto gerado
+SEPARADOR_PARAGRAFO = "\n\n"
+# O WhatsApp apaga o "digitando..." sozinho depois de alguns segundos
+INTERVALO_DIGITANDO = 10.0
+
+
+class EntregaProgressiva:
+    """
+    Entrega da resposta de um turno.
+
+    `receber` é passado ao agente como `ao_receber_texto` e recebe (iteração, trecho):
+    o texto da iteração corrente do LLM é acumulado e cada parágrafo completo é
+    enfileirado (um bloco de código ``` não é partido). Se a iteração terminar pedindo
+    ferramentas, a seguinte recomeça o acumulado: o que não formou parágrafo não é enviado.
+
+    `concluir` envia o que faltou da resposta final e repassa a `ao_concluir` o resultado
+    de todas as partes; sem streaming, envia a resposta inteira, como um envio comum.
+    """
+
+    def __init__(
+        self,
+        sessao_id: int,
+        telefone_cliente: str,
+        descricao: str = "",
+        ao_iniciar: Optional[Callable[[], None]] = None
+    ):
+        self.sessao_id = sessao_id
+        self.telefone_cliente = telefone_cliente
+        self.descricao = descricao or f"resposta / {telefone_cliente}"
+        self.ao_iniciar = ao_iniciar
+
+        self._iteracao: Optional[int] = None
+        self._pendente = ""  # Texto da iteração ainda sem fim de parágrafo
+        self._consumido = ""  # Início do texto da iteração já enfileirado
+        self._paragrafos_anteriores: List[str] = []  # Enfileirados em iterações anteriores
+        self._paragrafos_iteracao: List[str] = []
+        self._futuros: List[Future] = []
+        self._digitando: Optional[asyncio.Task] = None
+
+    @property
+    def iniciada(self) -> bool:
+        """Indica se algum parágrafo já foi enfileirado."""
+        return bool(self._futuros)
+
+    def iniciar_digitando(self):
+        """Mantém o "digitando..." na conversa até concluir ou encerrar."""
+        if self._digitando is None:
+            self._digitando = asyncio.ensure_future(self._manter_digitando())
+
+    async def _manter_digitando(self):
+        from mensagem.mensagem_envio_service import fila_envio
+
+        while True:
+            fila_envio.sinalizar_digitando(self.sessao_id, self.telefone_cliente)
+            await asyncio.sleep(INTERVALO_DIGITANDO)
+
+    def encerrar(self, pausar: bool = True):
+        """Para de renovar o "digitando..." (e o tira da conversa, se `pausar`)."""
+        from mensagem.mensagem_envio_service import fila_envio
+
+        if self._digitando is None:
+            return
+        self._digitando.cancel()
+        self._digitando = None
+        if pausar:
+            fila_envio.sinalizar_digitando(self.sessao_id, self.telefone_cliente, digitando=False)
+
+    def receber(self, iteracao: int, trecho: str):
+        """Acumula um trecho gerado pelo LLM e enfileira os parágrafos que ele completar."""
+        if iteracao != self._iteracao:
+            self._iteracao = iteracao
+            self._paragrafos_anteriores.extend(self._paragrafos_iteracao)
+            self._paragrafos_iteracao = []
+            self._pendente = ""
+            self._consumido = ""
+
+        self._pendente += trecho
+        busca = 0
+        while True:
+            fim = self._pendente.find(SEPARADOR_PARAGRAFO, busca)
+            if fim < 0:
+                break
+            paragrafo = self._pendente[:fim]
+            if paragrafo.count("```") % 2:
+                # Dentro de um bloco de código: espera o fechamento
+                busca = fim + len(SEPARADOR_PARAGRAFO)
+                continue
+
+            fim += len(SEPARADOR_PARAGRAFO)
+            self._consumido += self._pendente[:fim]
+            self._pendente = self._pendente[fim:]
+            busca = 0
+            if paragrafo.strip():
+                self._enviar_paragrafo(paragrafo.strip())
+
+    def _enviar_paragrafo(self, paragrafo: str):
+        from mensagem.mensagem_envio_service import fila_envio
+
+        if not self._futuros and self.ao_iniciar:
+            self.ao_iniciar()
+        self._paragrafos_iteracao.append(paragrafo)
+        self._futuros.append(fila_envio.enviar(
+            self.sessao_id,
+            self.telefone_cliente,
+            paragrafo,
+            descricao=f"{self.descricao} / parágrafo {len(self._futuros) + 1}",
+            continuacao=bool(self._futuros)
+        ))
+
+    def _continua_iteracao(self, texto_final: str) -> bool:
+        """Indica se a resposta final é a iteração corrente (começa pelo que dela já foi enviado)."""
+        return bool(self._consumido) and texto_final.startswith(self._consumido)
+
+    def texto_entregue(self, texto_final: str) -> str:
+        """Texto que o contato recebe no total: parágrafos de iterações anteriores e a resposta final."""
+        anteriores = list(self._paragrafos_anteriores)
+        if not self._continua_iteracao(texto_final):
+            anteriores += self._paragrafos_iteracao
+        return SEPARADOR_PARAGRAFO.join(parte for parte in anteriores + [texto_final.strip()] if parte)
+
+    def concluir(
+        self,
+        texto_final: str,
+        ao_concluir: Optional[Callable[[List[Any], Optional[Exception]], None]] = None
+    ) -> Future:
+        """
+        Enfileira o restante da resposta final e encerra o "digitando...".
+
+        `ao_concluir` recebe as respostas de todas as partes da entrega e o primeiro erro
+        entre elas (os parágrafos saem antes, na mesma raia do contato).
+        """
+        from mensagem.mensagem_envio_service import fila_envio
+
+        if self._continua_iteracao(texto_final):
+            restante = texto_final[len(self._consumido):].strip()
+        else:
+            restante = texto_final.strip()
+        self.encerrar(pausar=not restante)
+
+        futuros = list(self._futuros)
+
+        def registrar(respostas: List[Any], erro: Optional[Exception]):
+            anteriores = []
+            for futuro in futuros:
+                if futuro.exception() is not None:
+                    erro = erro or futuro.exception()
+                else:
+                    anteriores.extend(futuro.result())
+            if ao_concluir:
+                ao_concluir(anteriores + respostas, erro)
+
+        if futuros:
+            print(f"📨 [ENVIO] {len(futuros)} parágrafo(s) enviados durante a geração ({self.descricao})")
+        return fila_envio.enviar(
+            self.sessao_id,
+            self.telefone_cliente,
+            [restante] if restante else [],
+            descricao=self.descricao,
+            ao_concluir=registrar,
+            continuacao=bool(futuros)
+        )
@@ -0,0 +1,474 @@
+"""
+Fila de envio de mensagens para o WhatsApp.
+Os envios saem de um event loop próprio, com ritmo controlado por token bucket
+por sessão e por contato, retentativas com backoff e métricas de latência, para
+que rajadas não disparem o bloqueio do WhatsApp nem prendam os workers de entrada.
+"""
+from typing import Optional, List, Dict, Any, Callable, Union, Tuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from collections import deque
+import asyncio
+import functools
+import random
+import threading
+import time
+import traceback
+from mensagem.mensagem_fila_service import Histograma
+
+
+# Parte de um envio: texto, ou função (cliente, jid) que envia e retorna o SendResponse
+Parte = Union[str, Callable[[Any, Any], Any]]
+# Chamado ao final do envio com (respostas, erro); executa fora do loop de envio
+AoConcluir = Callable[[List[Any], Optional[Exception]], None]
+
+# Erros do whatsmeow que acontecem antes de a mensagem sair (sem conexão, sem login,
+# limite de requisições ao buscar os dispositivos do contato): repetir não duplica o envio
+ERROS_ANTES_DO_ENVIO = ("websocket not connected", "not logged in", "rate-overlimit", "status 429")
+
+
+class ErroAntesDoEnvio(Exception):
+    """Falha anterior ao envio (a mensagem certamente não saiu); pode ser repetida."""
+    pass
+
+
+class BaldeTokens:
+    """
+    Token bucket: `taxa` tokens por segundo, acumulando até `capacidade` (rajada).
+    Usado apenas dentro do loop de envio, por isso não tem lock.
+    """
+
+    def __init__(self, taxa: float, capacidade: int):
+        self.taxa = taxa
+        self.capacidade = max(1, capacidade)
+        self.tokens = float(self.capacidade)
+        self.atualizado_em = time.monotonic()
+
+    def _repor(self):
+        agora = time.monotonic()
+        self.tokens = min(self.capacidade, self.tokens + (agora - self.atualizado_em) * self.taxa)
+        self.atualizado_em = agora
+
+    def reservar(self, quantidade: int = 1) -> float:
+        """
+        Reserva tokens (o saldo pode ficar negativo: os próximos esperam mais).
+
+        Returns:
+            Segundos a aguardar até os tokens reservados estarem disponíveis
+        """
+        if self.taxa <= 0:
+            return 0.0
+        self._repor()
+        self.tokens -= quantidade
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.taxa
+
+    def cheio(self) -> bool:
+        """Indica se o balde já se recompôs por completo (pode ser descartado)."""
+        self._repor()
+        return self.tokens >= self.capacidade
+
+
+class FilaEnvio:
+    """
+    Fila de envio por contato (sessao_id, telefone).
+
+    Cada contato tem uma raia atendida em ordem por uma corrotina; raias diferentes
+    avançam em paralelo, limitadas pelo balde da sessão (ritmo total da conta) e pelo
+    balde do contato. As chamadas ao Neonize rodam em um executor pequeno, fora do loop.
+
+    Um envio pode ter várias partes (resposta longa dividida, mídia + texto): elas saem
+    em sequência, sem intercalar com outros envios ao mesmo contato, com um pequeno
+    intervalo entre si. Cada parte é repetida até `max_tentativas` vezes com backoff, mas só
+    quando a falha é anterior ao envio: depois de uma falha ambígua (timeout, erro após a
+    chamada) a parte é dada como falha, para não chegar duas vezes ao contato.
+    """
+
+    def __init__(
+        self,
+        taxa_sessao: float = 1.0,
+        rajada_sessao: int = 5,
+        taxa_contato: float = 0.5,
+        rajada_contato: int = 3,
+        max_tentativas: int = 3,
+        backoff_base: float = 1.0,
+        intervalo_partes: float = 0.8,
+        max_caracteres_parte: int = 4000,
+        num_threads: int = 4
+    ):
+        self.taxa_sessao = taxa_sessao
+        self.rajada_sessao = rajada_sessao
+        self.taxa_contato = taxa_contato
+        self.rajada_contato = rajada_contato
+        self.max_tentativas = max_tentativas
+        self.backoff_base = backoff_base
+        self.intervalo_partes = intervalo_partes
+        self.max_caracteres_parte = max_caracteres_parte
+        self.num_threads = num_threads
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+        # Estado do loop de envio (acessado só pela thread do loop)
+        self._raias: Dict[Tuple[int, str], deque] = {}
+        self._consumidores: Dict[Tuple[int, str], asyncio.Task] = {}
+        self._baldes_sessao: Dict[int, BaldeTokens] = {}
+        self._baldes_contato: Dict[Tuple[int, str], BaldeTokens] = {}
+
+        # Métricas (sob self._lock)
+        self._pendentes = 0
+        self._enfileirados = 0
+        self._enviados = 0
+        self._partes_enviadas = 0
+        self._falhas = 0
+        self._retentativas = 0
+        self._falhas_ambiguas = 0
+        self._limitados = 0
+        self._sinais_digitando = 0
+        self._latencias_ms = deque(maxlen=1000)  # Enfileiramento -> último envio
+        self._histograma_latencia = Histograma()
+        self._histograma_chamada = Histograma()
+        self._histograma_limite = Histograma()
+
+    @property
+    def iniciada(self) -> bool:
+        """Indica se o loop de envio já foi iniciado."""
+        return self._loop is not None
+
+    def configurar(
+        self,
+        taxa_sessao: Optional[float] = None,
+        rajada_sessao: Optional[int] = None,
+        taxa_contato: Optional[float] = None,
+        rajada_contato: Optional[int] = None,
+        max_tentativas: Optional[int] = None,
+        intervalo_partes: Optional[float] = None,
+        max_caracteres_parte: Optional[int] = None
+    ):
+        """Ajusta ritmo e retentativas. Os baldes já criados mantêm os valores anteriores."""
+        if taxa_sessao is not None:
+            self.taxa_sessao = max(0.0, float(taxa_sessao))
+        if rajada_sessao is not None:
+            self.rajada_sessao = max(1, int(rajada_sessao))
+        if taxa_contato is not None:
+            self.taxa_contato = max(0.0, float(taxa_contato))
+        if rajada_contato is not None:
+            self.rajada_contato = max(1, int(rajada_contato))
+        if max_tentativas is not None:
+            self.max_tentativas = max(1, int(max_tentativas))
+        if intervalo_partes is not None:
+            self.intervalo_partes = max(0.0, float(intervalo_partes))
+        if max_caracteres_parte is not None:
+            self.max_caracteres_parte = max(0, int(max_caracteres_parte))
+
+    def iniciar(self):
+        """Inicia a thread do loop de envio (idempotente)."""
+        with self._lock:
+            if self.iniciada:
+                return
+            self._loop = asyncio.new_event_loop()
+            self._executor = ThreadPoolExecutor(max_workers=self.num_threads, thread_name_prefix="fila-envio")
+            self._thread = threading.Thread(target=self._executar_loop, name="fila-envio", daemon=True)
+            self._thread.start()
+
+        print(
+            f"✅ [ENVIO] Fila de envio iniciada "
+            f"(sessão: {self.taxa_sessao}/s, contato: {self.taxa_contato}/s, tentativas: {self.max_tentativas})"
+        )
+
+    def _executar_loop(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    def parar(self, timeout: float = 10.0):
+        """Aguarda até `timeout` segundos os envios pendentes e encerra o loop."""
+        with self._lock:
+            if not self.iniciada:
+                return
+            loop, thread, executor = self._loop, self._thread, self._executor
+
+        async def drenar():
+            tarefas = list(self._consumidores.values())
+            if tarefas:
+                await asyncio.wait(tarefas, timeout=timeout)
+
+        try:
+            asyncio.run_coroutine_threadsafe(drenar(), loop).result(timeout + 1)
+        except Exception:
+            pass
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout=5)
+        executor.shutdown(wait=False)
+
+        with self._lock:
+            self._loop = None
+            self._thread = None
+            self._executor = None
+            self._raias.clear()
+            self._consumidores.clear()
+            self._baldes_sessao.clear()
+            self._baldes_contato.clear()
+            self._pendentes = 0
+
+    def dividir_texto(self, texto: str) -> List[str]:
+        """Divide um texto longo em partes de até `max_caracteres_parte`, nos parágrafos."""
+        limite = self.max_caracteres_parte
+        if not limite or len(texto) <= limite:
+            return [texto]
+
+        partes, atual = [], ""
+        for paragrafo in texto.split("\n\n"):
+            # Parágrafo maior que o limite: corte seco
+            while len(paragrafo) > limite:
+                if atual:
+                    partes.append(atual)
+                    atual = ""
+                partes.append(paragrafo[:limite])
+                paragrafo = paragrafo[limite:]
+
+            candidato = f"{atual}\n\n{paragrafo}" if atual else paragrafo
+            if len(candidato) > limite:
+                partes.append(atual)
+                atual = paragrafo
+            else:
+                atual = candidato
+        if atual:
+            partes.append(atual)
+        return partes
+
+    def enviar(
+        self,
+        sessao_id: int,
+        telefone: str,
+        conteudo: Union[Parte, List[Parte]],
+        descricao: str = "",
+        ao_concluir: Optional[AoConcluir] = None,
+        continuacao: bool = False
+    ) -> Future:
+        """
+        Enfileira um envio ao contato. Não bloqueia.
+
+        Args:
+            conteudo: Texto (dividido se passar de `max_caracteres_parte`), função
+                (cliente, jid) para mídia, ou lista de partes enviadas em sequência
+            ao_concluir: Chamado com (respostas, erro) quando o envio termina
+            continuacao: Continua um envio anterior ao mesmo contato (ex.: parágrafos de
+                uma resposta em streaming): conta só para o balde da sessão
+
+        Returns:
+            Future com a lista de SendResponse (uma por parte) ou a exceção do envio
+        """
+        if not self.iniciada:
+            self.iniciar()
+
+        partes = []
+        for parte in (conteudo if isinstance(conteudo, list) else [conteudo]):
+            partes.extend(self.dividir_texto(parte) if isinstance(parte, str) else [parte])
+
+        futuro: Future = Future()
+        envio = {
+            "partes": partes,
+            "descricao": descricao or f"sessao {sessao_id} / {telefone}",
+            "enfileirado_em": time.time(),
+            "futuro": futuro,
+            "ao_concluir": ao_concluir,
+            "continuacao": continuacao
+        }
+        with self._lock:
+            self._pendentes += 1
+            self._enfileirados += 1
+        self._loop.call_soon_threadsafe(self._receber, (sessao_id, telefone), envio)
+        return futuro
+
+    def _receber(self, chave: Tuple[int, str], envio: Dict[str, Any]):
+        """Coloca o envio na raia do contato (no loop de envio)."""
+        self._raias.setdefault(chave, deque()).append(envio)
+        if chave not in self._consumidores:
+            self._consumidores[chave] = self._loop.create_task(self._consumir(chave))
+
+    async def _consumir(self, chave: Tuple[int, str]):
+        """Atende a raia de um contato até esvaziá-la."""
+        raia = self._raias[chave]
+        try:
+            while raia:
+                await self._entregar(chave, raia.popleft())
+        finally:
+            self._raias.pop(chave, None)
+            self._consumidores.pop(chave, None)
+            balde = self._baldes_contato.get(chave)
+            if balde and balde.cheio():
+                del self._baldes_contato[chave]
+
+    async def _entregar(self, chave: Tuple[int, str], envio: Dict[str, Any]):
+        """Aguarda o ritmo, envia as partes e resolve o Future do envio."""
+        sessao_id, telefone = chave
+        partes = envio["partes"]
+
+        balde_sessao = self._baldes_sessao.get(sessao_id)
+        if balde_sessao is None:
+            balde_sessao = self._baldes_sessao[sessao_id] = BaldeTokens(self.taxa_sessao, self.rajada_sessao)
+        balde_contato = self._baldes_contato.get(chave)
+        if balde_contato is None:
+            balde_contato = self._baldes_contato[chave] = BaldeTokens(self.taxa_contato, self.rajada_contato)
+
+        # Uma resposta com várias partes conta uma vez para o contato e parte a parte para a sessão
+        espera = balde_sessao.reservar(len(partes))
+        if not envio["continuacao"]:
+            espera = max(espera, balde_contato.reservar())
+        if espera > 0:
+            with self._lock:
+                self._limitados += 1
+                self._histograma_limite.registrar(espera * 1000)
+            await asyncio.sleep(espera)
+
+        respostas, erro = [], None
+        try:
+            for indice, parte in enumerate(partes):
+                if indice:
+                    await asyncio.sleep(self.intervalo_partes)
+                respostas.append(await self._enviar_parte(sessao_id, telefone, parte, envio["descricao"]))
+        except Exception as e:
+            erro = e
+
+        latencia_ms = (time.time() - envio["enfileirado_em"]) * 1000
+        with self._lock:
+            self._pendentes -= 1
+            self._partes_enviadas += len(respostas)
+            if erro is None:
+                self._enviados += 1
+                self._latencias_ms.append(latencia_ms)
+                self._histograma_latencia.registrar(latencia_ms)
+            else:
+                self._falhas += 1
+
+        if erro is None:
+            envio["futuro"].set_result(respostas)
+        else:
+            print(f"❌ [ENVIO] Falha ao enviar ({envio['descricao']}): {erro}")
+            envio["futuro"].set_exception(erro)
+
+        if envio["ao_concluir"]:
+            try:
+                await self._loop.run_in_executor(self._executor, envio["ao_concluir"], respostas, erro)
+            except Exception:
+                traceback.print_exc()
+
+    def sinalizar_digitando(self, sessao_id: int, telefone: str, digitando: bool = True):
+        """
+        Mostra (ou tira) o indicador "digitando..." na conversa do contato. Não bloqueia.
+        Fora das raias e dos baldes: não atrasa nem é atrasado pelos envios; falhas são ignoradas.
+        """
+        if not self.iniciada:
+            self.iniciar()
+        with self._lock:
+            self._sinais_digitando += 1
+        self._loop.call_soon_threadsafe(
+            self._loop.create_task, self._sinalizar_digitando(sessao_id, telefone, digitando)
+        )
+
+    async def _sinalizar_digitando(self, sessao_id: int, telefone: str, digitando: bool):
+        from sessao.sessao_service import gerenciador_sessoes
+        from neonize.utils import build_jid
+        from neonize.utils.enum import ChatPresence, ChatPresenceMedia
+
+        cliente = gerenciador_sessoes.obter_cliente(sessao_id)
+        if not cliente:
+            return
+        estado = ChatPresence.CHAT_PRESENCE_COMPOSING if digitando else ChatPresence.CHAT_PRESENCE_PAUSED
+        try:
+            await self._loop.run_in_executor(
+                self._executor,
+                functools.partial(
+                    cliente.send_chat_presence, build_jid(telefone), estado, ChatPresenceMedia.CHAT_PRESENCE_MEDIA_TEXT
+                )
+            )
+        except Exception as e:
+            print(f"⚠️  [ENVIO] Falha ao sinalizar digitação para {telefone}: {e}")
+
+    @staticmethod
+    def _falhou_antes_do_envio(erro: Exception) -> bool:
+        """Indica se o erro é sabidamente anterior ao envio (repetir não duplica a mensagem)."""
+        if isinstance(erro, ErroAntesDoEnvio):
+            return True
+        texto = str(erro).lower()
+        return any(trecho in texto for trecho in ERROS_ANTES_DO_ENVIO)
+
+    async def _enviar_parte(self, sessao_id: int, telefone: str, parte: Parte, descricao: str) -> Any:
+        """
+        Envia uma parte, repetindo com backoff exponencial as falhas anteriores ao envio
+        (sem cliente, desconectado, limite de requisições). As demais são propagadas sem
+        repetição: a mensagem pode ter saído.
+        """
+        from sessao.sessao_service import gerenciador_sessoes
+        from neonize.utils import build_jid
+
+        jid = build_jid(telefone)
+        tentativa = 1
+        while True:
+            inicio = time.time()
+            try:
+                cliente = gerenciador_sessoes.obter_cliente(sessao_id)
+                if not cliente or not cliente.is_connected:
+                    raise ErroAntesDoEnvio("Sessão desconectada")
+                if callable(parte):
+                    chamada = functools.partial(parte, cliente, jid)
+                else:
+                    chamada = functools.partial(cliente.send_message, jid, message=parte)
+                resposta = await self._loop.run_in_executor(self._executor, chamada)
+
+                with self._lock:
+                    self._histograma_chamada.registrar((time.time() - inicio) * 1000)
+                return resposta
+            except Exception as e:
+                if not self._falhou_antes_do_envio(e):
+                    print(f"⚠️  [ENVIO] Falha após a chamada de envio ({descricao}); sem nova tentativa para não duplicar")
+                    with self._lock:
+                        self._falhas_ambiguas += 1
+                    raise
+                if tentativa >= self.max_tentativas:
+                    raise
+                atraso = self.backoff_base * (2 ** (tentativa - 1)) * random.uniform(1.0, 1.5)
+                print(f"🔁 [ENVIO] Tentativa {tentativa} falhou ({descricao}): {e}. Nova tentativa em {atraso:.1f}s")
+                with self._lock:
+                    self._retentativas += 1
+                tentativa += 1
+                await asyncio.sleep(atraso)
+
+    @staticmethod
+    def _percentil(amostras: List[float], percentil: float) -> float:
+        """Calcula um percentil simples sobre uma lista de amostras."""
+        if not amostras:
+            return 0.0
+        ordenadas = sorted(amostras)
+        indice = min(len(ordenadas) - 1, int(round(percentil / 100 * (len(ordenadas) - 1))))
+        return ordenadas[indice]
+
+    def obter_metricas(self) -> Dict[str, Any]:
+        """Retorna um retrato das métricas de envio."""
+        with self._lock:
+            latencias = list(self._latencias_ms)
+            metricas = {
+                "taxa_sessao_por_s": self.taxa_sessao,
+                "taxa_contato_por_s": self.taxa_contato,
+                "pendentes": self._pendentes,
+                "contatos_na_fila": len(self._consumidores),
+                "enfileirados": self._enfileirados,
+                "enviados": self._enviados,
+                "partes_enviadas": self._partes_enviadas,
+                "falhas": self._falhas,
+                "retentativas": self._retentativas,
+                "falhas_ambiguas": self._falhas_ambiguas,
+                "limitados_por_ritmo": self._limitados,
+                "sinais_digitando": self._sinais_digitando,
+                "histograma_latencia_ms": self._histograma_latencia.to_dict(),
+                "histograma_chamada_ms": self._histograma_chamada.to_dict(),
+                "histograma_espera_ritmo_ms": self._histograma_limite.to_dict()
+            }
+
+        metricas["latencia_media_ms"] = round(sum(latencias) / len(latencias), 2) if latencias else 0
+        metricas["latencia_p95_ms"] = round(self._percentil(latencias, 95), 2)
+        return metricas
+
+
+# Instância global da fila de envio
+fila_envio = FilaEnvio()
@@ -0,0 +1,482 @@
+"""
+Fila de processamento de mensagens recebidas do WhatsApp.
+Pool fixo de workers com fila limitada; cada worker mantém um event loop próprio.
+As tarefas são organizadas em raias por conversa (sessao_id, telefone_cliente).
+"""
+from typing import Optional, List, Dict, Any, Callable, Awaitable, Hashable
+from collections import deque
+import asyncio
+import heapq
+import queue
+import threading
+import time
+import traceback
+from database import SessionLocal
+
+
+# Tarefa executada por um worker: recebe uma sessão do banco exclusiva do worker
+Tarefa = Callable[[Any], Awaitable[Any]]
+
+# Espera (segundos) antes de o agendador tentar de novo uma tarefa vencida com a fila cheia:
+# dobra a cada tentativa, até o máximo
+BACKOFF_AGENDADOR_BASE = 0.5
+BACKOFF_AGENDADOR_MAX = 30.0
+
+
+class Histograma:
+    """Histograma cumulativo de tempos (ms) em faixas fixas. Não é thread-safe: use sob lock."""
+
+    LIMITES_PADRAO_MS = (10, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+
+    def __init__(self, limites_ms: tuple = LIMITES_PADRAO_MS):
+        self.limites_ms = tuple(limites_ms)
+        self.contagens = [0] * (len(self.limites_ms) + 1)
+
+    def registrar(self, valor_ms: float):
+        """Conta uma amostra na primeira faixa que a comporta."""
+        for indice, limite in enumerate(self.limites_ms):
+            if valor_ms <= limite:
+                self.contagens[indice] += 1
+                return
+        self.contagens[-1] += 1
+
+    def to_dict(self) -> Dict[str, int]:
+        """Contagem por faixa, com chaves no formato "<=100" e "+inf"."""
+        faixas = {f"<={limite}": total for limite, total in zip(self.limites_ms, self.contagens)}
+        faixas["+inf"] = self.contagens[-1]
+        return faixas
+
+
+class FilaProcessamento:
+    """
+    Pool de workers para processar mensagens recebidas.
+
+    Substitui a criação de uma thread + event loop por mensagem: o número de
+    threads, de event loops e de conexões simultâneas com o banco fica limitado
+    ao número de workers, e a fila limitada absorve os picos.
+
+    Cada tarefa pertence a uma raia (chave). Tarefas da mesma raia executam uma
+    por vez, na ordem de chegada; raias diferentes executam em paralelo até o
+    número de workers, revezando entre si (uma tarefa por raia a cada rodada).
+
+    Tarefas também podem ser agendadas com atraso (agendar): um novo agendamento
+    na mesma raia substitui o anterior e reinicia a espera (debounce). Se a fila
+    estiver cheia no vencimento, o agendamento é refeito com backoff.
+
+    Tarefas enviadas como `cancelavel` podem ser interrompidas enquanto executam
+    (cancelar): o cancelamento acontece no próximo ponto de await da tarefa.
+    """
+
+    def __init__(
+        self,
+        num_workers: int = 4,
+        tamanho_fila: int = 500,
+        timeout_enfileirar: float = 2.0,
+        cancelamento_ativo: bool = True
+    ):
+        self.num_workers = num_workers
+        self.tamanho_fila = tamanho_fila
+        self.timeout_enfileirar = timeout_enfileirar
+        self.cancelamento_ativo = cancelamento_ativo
+
+        self._prontas: Optional[queue.Queue] = None  # Chaves de raias prontas para executar
+        self._workers: List[threading.Thread] = []
+        self._lock = threading.Lock()
+        self._vaga_livre = threading.Condition(self._lock)
+
+        # Raias: chave -> tarefas pendentes (tarefa, enfileirado_em, descricao, cancelavel)
+        self._raias: Dict[Hashable, deque] = {}
+        # Tarefas em execução: chave -> [loop, task, cancelavel]
+        self._em_execucao: Dict[Hashable, list] = {}
+        # Raias ativas (na fila de prontas ou em execução por algum worker)
+        self._raias_ativas = set()
+        self._pendentes = 0
+
+        # Agendamentos com atraso: chave -> (executar_em, primeiro_em, seq, tarefa, descricao, cancelavel, tentativas)
+        self._agendamentos: Dict[Hashable, tuple] = {}
+        self._heap_agendamentos: List[tuple] = []
+        self._seq_agendamento = 0
+        self._lock_agendador = threading.Lock()
+        self._novo_agendamento = threading.Condition(self._lock_agendador)
+        self._agendador: Optional[threading.Thread] = None
+        self._encerrando = False
+
+        # Métricas
+        self._ativos = 0
+        self._enfileiradas = 0
+        self._processadas = 0
+        self._erros = 0
+        self._rejeitadas = 0
+        self._reagendadas = 0
+        self._canceladas = 0
+        self._espera_max_ms = 0.0
+        self._esperas_ms = deque(maxlen=1000)  # Amostras recentes de tempo de espera
+        self._execucoes_ms = deque(maxlen=1000)  # Amostras recentes de tempo de execução
+        self._histograma_espera = Histograma()
+
+    @property
+    def iniciada(self) -> bool:
+        """Indica se os workers já foram iniciados."""
+        return self._prontas is not None
+
+    def configurar(
+        self,
+        num_workers: Optional[int] = None,
+        tamanho_fila: Optional[int] = None,
+        timeout_enfileirar: Optional[float] = None,
+        cancelamento_ativo: Optional[bool] = None
+    ):
+        """Ajusta os parâmetros do pool. Só tem efeito antes de iniciar()."""
+        if self.iniciada:
+            print("⚠️  [FILA] Pool já iniciado, nova configuração será ignorada")
+            return
+
+        if num_workers:
+            self.num_workers = max(1, int(num_workers))
+        if tamanho_fila:
+            self.tamanho_fila = max(1, int(tamanho_fila))
+        if timeout_enfileirar is not None:
+            self.timeout_enfileirar = max(0.0, float(timeout_enfileirar))
+        if cancelamento_ativo is not None:
+            self.cancelamento_ativo = bool(cancelamento_ativo)
+
+    def iniciar(self):
+        """Inicia os workers (idempotente)."""
+        with self._lock:
+            if self.iniciada:
+                return
+
+            self._prontas = queue.Queue()
+            for indice in range(self.num_workers):
+                worker = threading.Thread(
+                    target=self._executar_worker,
+                    args=(indice,),
+                    name=f"fila-mensagens-{indice}",
+                    daemon=True
+                )
+                worker.start()
+                self._workers.append(worker)
+
+            self._encerrando = False
+            self._agendador = threading.Thread(
+                target=self._executar_agendador,
+                name="fila-mensagens-agendador",
+                daemon=True
+            )
+            self._agendador.start()
+
+        print(f"✅ [FILA] {self.num_workers} worker(s) iniciados (fila máx: {self.tamanho_fila})")
+
+    def parar(self, timeout: float = 5.0):
+        """Sinaliza os workers para encerrar após as tarefas em andamento."""
+        with self._lock:
+            if not self.iniciada:
+                return
+            prontas = self._prontas
+            workers = list(self._workers)
+            agendador = self._agendador
+
+        with self._novo_agendamento:
+            self._encerrando = True
+            self._agendamentos.clear()
+            self._heap_agendamentos.clear()
+            self._novo_agendamento.notify_all()
+        if agendador:
+            agendador.join(timeout=timeout)
+
+        for _ in workers:
+            prontas.put(None)
+
+        for worker in workers:
+            worker.join(timeout=timeout)
+
+        with self._lock:
+            self._prontas = None
+            self._workers = []
+            self._agendador = None
+            self._raias.clear()
+            self._raias_ativas.clear()
+            self._em_execucao.clear()
+            self._pendentes = 0
+
+    def enviar(
+        self,
+        tarefa: Tarefa,
+        descricao: str = "",
+        chave: Optional[Hashable] = None,
+        cancelavel: bool = False,
+        timeout: Optional[float] = None
+    ) -> bool:
+        """
+        Enfileira uma tarefa para processamento.
+
+        Tarefas com a mesma `chave` executam em ordem, uma de cada vez. Sem chave,
+        a tarefa ocupa uma raia própria e pode executar em paralelo com qualquer outra.
+        Com `cancelavel`, a execução pode ser interrompida por cancelar(chave).
+
+        Se a fila estiver cheia, aguarda até `timeout` segundos (padrão:
+        `timeout_enfileirar`; 0 não espera) e, persistindo a lotação, rejeita a
+        tarefa em vez de criar mais carga.
+
+        Returns:
+            True se a tarefa foi enfileirada, False se foi rejeitada
+        """
+        if not self.iniciada:
+            self.iniciar()
+
+        if chave is None:
+            chave = object()
+
+        limite = time.time() + (self.timeout_enfileirar if timeout is None else timeout)
+        with self._vaga_livre:
+            while self._pendentes >= self.tamanho_fila:
+                restante = limite - time.time()
+                if restante <= 0:
+                    self._rejeitadas += 1
+                    print(f"⚠️  [FILA] Fila cheia ({self.tamanho_fila}), tarefa rejeitada: {descricao}")
+                    return False
+                self._vaga_livre.wait(restante)
+
+            self._raias.setdefault(chave, deque()).append((tarefa, time.time(), descricao, cancelavel))
+            self._pendentes += 1
+            self._enfileiradas += 1
+
+            # Raia ociosa: entra na fila de prontas
+            if chave not in self._raias_ativas:
+                self._raias_ativas.add(chave)
+                self._prontas.put(chave)
+
+        return True
+
+    def agendar(
+        self,
+        tarefa: Tarefa,
+        atraso: float,
+        chave: Hashable,
+        descricao: str = "",
+        atraso_maximo: Optional[float] = None,
+        cancelavel: bool = False
+    ):
+        """
+        Agenda uma tarefa para entrar na raia `chave` daqui a `atraso` segundos.
+
+        Se já houver um agendamento pendente para a mesma chave, ele é substituído
+        e a espera recomeça (debounce). `atraso_maximo` limita a espera total
+        contada a partir do primeiro agendamento ainda pendente.
+        """
+        if not self.iniciada:
+            self.iniciar()
+
+        agora = time.time()
+        with self._novo_agendamento:
+            anterior = self._agendamentos.get(chave)
+            primeiro_em = anterior[1] if anterior else agora
+
+            executar_em = agora + atraso
+            if atraso_maximo is not None:
+                executar_em = min(executar_em, primeiro_em + atraso_maximo)
+
+            self._seq_agendamento += 1
+            seq = self._seq_agendamento
+            self._agendamentos[chave] = (executar_em, primeiro_em, seq, tarefa, descricao, cancelavel, 0)
+            heapq.heappush(self._heap_agendamentos, (executar_em, seq, chave))
+            self._novo_agendamento.notify()
+
+    def _reagendar(self, chave: Hashable, tarefa: Tarefa, descricao: str, cancelavel: bool, tentativas: int):
+        """
+        Refaz um agendamento vencido que encontrou a fila cheia, com backoff exponencial.
+        Um agendamento mais recente na mesma raia prevalece (debounce) e descarta este.
+        """
+        atraso = min(BACKOFF_AGENDADOR_MAX, BACKOFF_AGENDADOR_BASE * (2 ** tentativas))
+        agora = time.time()
+        with self._novo_agendamento:
+            if self._encerrando or chave in self._agendamentos:
+                return
+            self._seq_agendamento += 1
+            seq = self._seq_agendamento
+            self._agendamentos[chave] = (agora + atraso, agora, seq, tarefa, descricao, cancelavel, tentativas + 1)
+            heapq.heappush(self._heap_agendamentos, (agora + atraso, seq, chave))
+            self._novo_agendamento.notify()
+
+        with self._lock:
+            self._reagendadas += 1
+        print(f"🔁 [FILA] Fila cheia; agendamento refeito em {atraso:.1f}s (tentativa {tentativas + 1}): {descricao}")
+
+    def _proximo_agendamento(self) -> Optional[tuple]:
+        """Aguarda o próximo agendamento vencido. Retorna None ao encerrar."""
+        with self._novo_agendamento:
+            while not self._encerrando:
+                if not self._heap_agendamentos:
+                    self._novo_agendamento.wait()
+                    continue
+
+                executar_em, seq, chave = self._heap_agendamentos[0]
+                atual = self._agendamentos.get(chave)
+                if not atual or atual[2] != seq:
+                    # Substituído por um agendamento mais recente
+                    heapq.heappop(self._heap_agendamentos)
+                    continue
+
+                espera = executar_em - time.time()
+                if espera > 0:
+                    self._novo_agendamento.wait(espera)
+                    continue
+
+                heapq.heappop(self._heap_agendamentos)
+                del self._agendamentos[chave]
+                return chave, atual[3], atual[4], atual[5], atual[6]
+        return None
+
+    def _executar_agendador(self):
+        """
+        Move os agendamentos vencidos para suas raias. Não espera vaga na fila (o que
+        atrasaria os demais agendamentos): com a fila cheia, o agendamento é refeito.
+        """
+        while True:
+            vencido = self._proximo_agendamento()
+            if vencido is None:
+                break
+            chave, tarefa, descricao, cancelavel, tentativas = vencido
+            if not self.enviar(tarefa, descricao=descricao, chave=chave, cancelavel=cancelavel, timeout=0):
+                self._reagendar(chave, tarefa, descricao, cancelavel, tentativas)
+
+    def cancelar(self, chave: Hashable) -> bool:
+        """
+        Solicita o cancelamento da tarefa em execução na raia `chave`, se ela for
+        cancelável. A tarefa recebe asyncio.CancelledError no próximo await.
+        Tarefas ainda na fila não são afetadas.
+
+        Returns:
+            True se o cancelamento foi solicitado
+        """
+        if not self.cancelamento_ativo:
+            return False
+
+        with self._lock:
+            execucao = self._em_execucao.get(chave)
+            if not execucao or not execucao[2]:
+                return False
+            loop, task, _ = execucao
+
+        loop.call_soon_threadsafe(self._cancelar_se_permitido, chave, task)
+        return True
+
+    def _cancelar_se_permitido(self, chave: Hashable, task: asyncio.Task):
+        """Executado no loop do worker: cancela a tarefa se ela ainda for cancelável."""
+        with self._lock:
+            execucao = self._em_execucao.get(chave)
+            permitido = bool(execucao) and execucao[1] is task and execucao[2]
+        if permitido and not task.done():
+            task.cancel()
+
+    def impedir_cancelamento(self, chave: Hashable):
+        """
+        Marca a tarefa em execução na raia como não cancelável a partir deste ponto.
+        Deve ser chamado pela própria tarefa antes de efeitos que não podem ser
+        interrompidos pela metade (ex.: envio da resposta).
+        """
+        with self._lock:
+            execucao = self._em_execucao.get(chave)
+            if execucao:
+                execucao[2] = False
+
+    def _executar_worker(self, indice: int):
+        """Loop principal de um worker: um único event loop durante toda a vida da thread."""
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        prontas = self._prontas
+
+        try:
+            while True:
+                chave = prontas.get()
+                if chave is None:
+                    break
+
+                with self._vaga_livre:
+                    tarefa, enfileirado_em, descricao, cancelavel = self._raias[chave].popleft()
+                    self._pendentes -= 1
+                    self._vaga_livre.notify()
+
+                    espera_ms = (time.time() - enfileirado_em) * 1000
+                    self._ativos += 1
+                    self._esperas_ms.append(espera_ms)
+                    self._histograma_espera.registrar(espera_ms)
+                    self._espera_max_ms = max(self._espera_max_ms, espera_ms)
+
+                inicio = time.time()
+                sucesso = True
+                cancelada = False
+                db = SessionLocal()
+                try:
+                    task = loop.create_task(tarefa(db))
+                    with self._lock:
+                        self._em_execucao[chave] = [loop, task, cancelavel]
+                    loop.run_until_complete(task)
+                except asyncio.CancelledError:
+                    cancelada = True
+                    print(f"🛑 [FILA] Tarefa cancelada no worker {indice}: {descricao}")
+                except Exception as e:
+                    sucesso = False
+                    print(f"❌ [FILA] Erro no worker {indice} ({descricao}): {e}")
+                    traceback.print_exc()
+                finally:
+                    db.close()
+                    with self._lock:
+                        self._em_execucao.pop(chave, None)
+                        self._ativos -= 1
+                        self._execucoes_ms.append((time.time() - inicio) * 1000)
+                        if cancelada:
+                            self._canceladas += 1
+                        elif sucesso:
+                            self._processadas += 1
+                        else:
+                            self._erros += 1
+
+                        # Devolver a raia ao fim da fila se ainda houver tarefas (revezamento)
+                        if self._raias.get(chave):
+                            prontas.put(chave)
+                        else:
+                            self._raias.pop(chave, None)
+                            self._raias_ativas.discard(chave)
+        finally:
+            loop.close()
+
+    @staticmethod
+    def _percentil(amostras: List[float], percentil: float) -> float:
+        """Calcula um percentil simples sobre uma lista de amostras."""
+        if not amostras:
+            return 0.0
+        ordenadas = sorted(amostras)
+        indice = min(len(ordenadas) - 1, int(round(percentil / 100 * (len(ordenadas) - 1))))
+        return ordenadas[indice]
+
+    def obter_metricas(self) -> Dict[str, Any]:
+        """Retorna um retrato das métricas do pool."""
+        with self._lock:
+            esperas = list(self._esperas_ms)
+            execucoes = list(self._execucoes_ms)
+            metricas = {
+                "workers": self.num_workers,
+                "workers_ocupados": self._ativos,
+                "fila_tamanho": self._pendentes,
+                "fila_capacidade": self.tamanho_fila,
+                "conversas_na_fila": len(self._raias_ativas),
+                "tarefas_agendadas": len(self._agendamentos),
+                "enfileiradas": self._enfileiradas,
+                "processadas": self._processadas,
+                "erros": self._erros,
+                "rejeitadas": self._rejeitadas,
+                "reagendadas": self._reagendadas,
+                "canceladas": self._canceladas,
+                "espera_max_ms": round(self._espera_max_ms, 2),
+                "histograma_espera_ms": self._histograma_espera.to_dict()
+            }
+
+        metricas["espera_media_ms"] = round(sum(esperas) / len(esperas), 2) if esperas else 0
+        metricas["espera_p95_ms"] = round(self._percentil(esperas, 95), 2)
+        metricas["execucao_media_ms"] = round(sum(execucoes) / len(execucoes), 2) if execucoes else 0
+        return metricas
+
+
+# Instância global da fila
+fila_processamento = FilaProcessamento()
@@ -5,6 +5,7 @@ from fastapi import APIRouter, Depends, Request, Query
 from fastapi.responses import HTMLResponse
 from fastapi.templating import Jinja2Templates
 from sqlalchemy.orm import Session
+from typing import Optional
 from database import get_db
 from mensagem.mensagem_service import MensagemService
 from sessao.sessao_service import SessaoService
@@ -18,9 +19,10 @@ def pagina_mensagens_sessao(
     sessao_id: int,
     request: Request,
     limite: int = Query(default=100, le=500),
+    cursor: Optional[str] = Query(default=None),
     db: Session = Depends(get_db)
 ):
-    """Página de mensagens de uma sessão."""
+    """Página de mensagens de uma sessão (paginação por cursor)."""
     sessao = SessaoService.obter_por_id(db, sessao_id)
     if not sessao:
         return templates.TemplateResponse("shared/erro.html", {
@@ -29,7 +31,14 @@ def pagina_mensagens_sessao(
             "titulo": "Erro"
         })
     
-    mensagens = MensagemService.listar_por_sessao(db, sessao_id, limite)
+    try:
+        mensagens = MensagemService.listar_por_sessao(db, sessao_id, limite, cursor=cursor)
+    except ValueError as e:
+        return templates.TemplateResponse("shared/erro.html", {
+            "request": request,
+            "mensagem": str(e),
+            "titulo": "Erro"
+        })
     clientes = MensagemService.obter_clientes_unicos(db, sessao_id)
     
     return templates.TemplateResponse("mensagens.html", {
@@ -37,6 +46,9 @@ def pagina_mensagens_sessao(
         "sessao": sessao,
         "mensagens": mensagens,
         "clientes": clientes,
+        "limite": limite,
+        "cursor": cursor,
+        "proximo_cursor": MensagemService.proximo_cursor(mensagens, limite),
         "titulo": f"Mensagens - {sessao.nome}"
     })
 
@@ -46,9 +58,11 @@ def pagina_conversa_cliente(
     sessao_id: int,
     telefone: str,
     request: Request,
+    limite: int = Query(default=100, le=500),
+    cursor: Optional[str] = Query(default=None),
     db: Session = Depends(get_db)
 ):
-    """Página de conversa com um cliente específico."""
+    """Página de conversa com um cliente específico (paginação por cursor)."""
     sessao = SessaoService.obter_por_id(db, sessao_id)
     if not sessao:
         return templates.TemplateResponse("shared/erro.html", {
@@ -57,12 +71,22 @@ def pagina_conversa_cliente(
             "titulo": "Erro"
         })
     
-    mensagens = MensagemService.listar_por_cliente(db, sessao_id, telefone, limite=100)
+    try:
+        mensagens = MensagemService.listar_por_cliente(db, sessao_id, telefone, limite, cursor)
+    except ValueError as e:
+        return templates.TemplateResponse("shared/erro.html", {
+            "request": request,
+            "mensagem": str(e),
+            "titulo": "Erro"
+        })
     
     return templates.TemplateResponse("conversa.html", {
         "request": request,
         "sessao": sessao,
         "telefone_cliente": telefone,
         "mensagens": mensagens,
+        "limite": limite,
+        "cursor": cursor,
+        "proximo_cursor": MensagemService.proximo_cursor(mensagens, limite),
         "titulo": f"Conversa com {telefone}"
     })
@@ -0,0 +1,187 @@
+"""
+Expurgo em segundo plano do histórico descartado pelo `#limpar`.
+O comando só avança a época da conversa (`epocas_conversas`); as mensagens antigas
+continuam no banco, fora do histórico do agente, até este serviço apagá-las em lotes
+curtos, sem segurar o lock de escrita do SQLite por muito tempo.
+"""
+from typing import Optional, Dict, Any
+from datetime import datetime, timedelta
+import threading
+import time
+from database import SessionLocal
+from mensagem.mensagem_model import Mensagem, EpocaConversa
+
+
+class ExpurgoHistorico:
+    """
+    Thread que apaga as mensagens de épocas anteriores das conversas.
+
+    Acorda quando um `#limpar` é registrado (`agendar`) e a cada `intervalo` segundos.
+    Mensagens de uma época só são apagadas `retencao_horas` depois do `#limpar`
+    (0 = assim que possível); até lá continuam disponíveis para as métricas.
+    """
+
+    # Pausa entre lotes, para outras escritas conseguirem o lock do banco
+    PAUSA_ENTRE_LOTES = 0.05
+
+    def __init__(self, lote: int = 500, intervalo: float = 300.0, retencao_horas: float = 0.0):
+        self.lote = lote
+        self.intervalo = intervalo
+        self.retencao_horas = retencao_horas
+
+        self._thread: Optional[threading.Thread] = None
+        self._acordar = threading.Event()
+        self._encerrando = False
+        self._lock = threading.Lock()
+
+        # Métricas
+        self._conversas_expurgadas = 0
+        self._mensagens_expurgadas = 0
+        self._falhas = 0
+        self._ultimo_expurgo: Optional[datetime] = None
+
+    def configurar(
+        self,
+        lote: Optional[int] = None,
+        intervalo: Optional[float] = None,
+        retencao_horas: Optional[float] = None
+    ):
+        """Ajusta tamanho do lote, intervalo entre verificações e retenção."""
+        if lote is not None:
+            self.lote = max(1, int(lote))
+        if intervalo is not None:
+            self.intervalo = max(1.0, float(intervalo))
+        if retencao_horas is not None:
+            self.retencao_horas = max(0.0, float(retencao_horas))
+
+    def iniciar(self):
+        """Inicia a thread de expurgo (idempotente)."""
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._encerrando = False
+            self._thread = threading.Thread(target=self._executar, name="expurgo-historico", daemon=True)
+            self._thread.start()
+        print(f"✅ [HISTORICO] Expurgo iniciado (lote: {self.lote}, retenção: {self.retencao_horas} h)")
+
+    def parar(self, timeout: float = 5.0):
+        """Encerra a thread após o lote em andamento."""
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread:
+            self._encerrando = True
+            self._acordar.set()
+            thread.join(timeout=timeout)
+
+    def agendar(self):
+        """Pede um expurgo assim que possível (chamado após o `#limpar`)."""
+        self._acordar.set()
+
+    def _executar(self):
+        while not self._encerrando:
+            self._acordar.wait(self.intervalo)
+            self._acordar.clear()
+            if self._encerrando:
+                break
+            try:
+                self.expurgar_pendentes()
+            except Exception as e:
+                print(f"❌ [HISTORICO] Erro no expurgo: {e}")
+                with self._lock:
+                    self._falhas += 1
+
+    def expurgar_pendentes(self) -> int:
+        """
+        Apaga as mensagens antigas das conversas com expurgo pendente e vencido.
+
+        Returns:
+            Número de mensagens apagadas
+        """
+        limite = datetime.now() - timedelta(hours=self.retencao_horas)
+        db = SessionLocal()
+        try:
+            epocas = db.query(EpocaConversa)\
+                .filter(
+                    EpocaConversa.expurgo_pendente == True,
+                    EpocaConversa.reiniciado_em <= limite
+                )\
+                .all()
+
+            total = 0
+            for epoca in epocas:
+                if self._encerrando:
+                    break
+                total += self._expurgar_conversa(db, epoca)
+            return total
+        finally:
+            db.close()
+
+    def _expurgar_conversa(self, db, epoca: EpocaConversa) -> int:
+        """Apaga em lotes as mensagens da conversa anteriores à época e libera suas mídias."""
+        from mensagem.mensagem_midia_service import armazem_midia
+
+        sessao_id, telefone_cliente = epoca.sessao_id, epoca.telefone_cliente
+        numero_epoca, inicio = epoca.epoca, epoca.inicio_mensagem_id
+        apagadas = 0
+        while not self._encerrando:
+            linhas = db.query(Mensagem.id, Mensagem.conteudo_midia_hash)\
+                .filter(
+                    Mensagem.sessao_id == sessao_id,
+                    Mensagem.telefone_cliente == telefone_cliente,
+                    Mensagem.id <= inicio
+                )\
+                .limit(self.lote)\
+                .all()
+            if not linhas:
+                break
+
+            db.query(Mensagem)\
+                .filter(Mensagem.id.in_([id_mensagem for id_mensagem, _ in linhas]))\
+                .delete(synchronize_session=False)
+            db.commit()
+            armazem_midia.liberar([hash_midia for _, hash_midia in linhas])
+            apagadas += len(linhas)
+            time.sleep(self.PAUSA_ENTRE_LOTES)
+
+        if self._encerrando:
+            return apagadas  # Continua no próximo início
+
+        # Só conclui se não houve outro #limpar durante o expurgo
+        db.query(EpocaConversa)\
+            .filter(EpocaConversa.id == epoca.id, EpocaConversa.epoca == numero_epoca)\
+            .update({EpocaConversa.expurgo_pendente: False}, synchronize_session=False)
+        db.commit()
+
+        with self._lock:
+            self._conversas_expurgadas += 1
+            self._mensagens_expurgadas += apagadas
+            self._ultimo_expurgo = datetime.now()
+        print(f"🧹 [HISTORICO] {apagadas} mensagem(ns) antiga(s) de {telefone_cliente} expurgada(s)")
+        return apagadas
+
+    def obter_metricas(self) -> Dict[str, Any]:
+        """Retorna conversas e mensagens expurgadas e as pendências."""
+        db = SessionLocal()
+        try:
+            pendentes = db.query(EpocaConversa)\
+                .filter(EpocaConversa.expurgo_pendente == True)\
+                .count()
+        finally:
+            db.close()
+
+        with self._lock:
+            return {
+                "em_execucao": bool(self._thread and self._thread.is_alive()),
+                "lote": self.lote,
+                "retencao_horas": self.retencao_horas,
+                "conversas_pendentes": pendentes,
+                "conversas_expurgadas": self._conversas_expurgadas,
+                "mensagens_expurgadas": self._mensagens_expurgadas,
+                "falhas": self._falhas,
+                "ultimo_expurgo": self._ultimo_expurgo.isoformat() if self._ultimo_expurgo else None
+            }
+
+
+# Instância global do expurgo de histórico
+expurgo_historico = ExpurgoHistorico()
@@ -0,0 +1,218 @@
+"""
+Pré-processamento das imagens recebidas antes de irem para o LLM.
+Reduz a imagem ao lado máximo configurado e a recomprime em JPEG em um pool de
+processos (o PIL não roda no event loop dos workers), guardando o resultado em
+cache pelo hash do conteúdo original.
+"""
+from typing import Optional, Dict, Any, Iterable
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from uuid import uuid4
+
+
+# Depois de uma falha, a mesma imagem (com os mesmos parâmetros) só é tentada de novo após este tempo (s)
+ESPERA_NOVA_TENTATIVA = 3600.0
+
+
+def _otimizar_arquivo(origem: str, destino: str, lado_maximo: int, qualidade: int) -> int:
+    """
+    Executado no processo filho: reduz e recomprime a imagem de `origem` em `destino`.
+
+    Returns:
+        Tamanho em bytes da imagem otimizada
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(origem) as imagem:
+        imagem = ImageOps.exif_transpose(imagem)
+        if imagem.mode not in ("RGB", "L"):
+            imagem = imagem.convert("RGB")
+        imagem.thumbnail((lado_maximo, lado_maximo), Image.LANCZOS)
+
+        temporario = f"{destino}.{uuid4().hex}.tmp"
+        imagem.save(temporario, "JPEG", quality=qualidade, optimize=True)
+    os.replace(temporario, destino)
+    return os.path.getsize(destino)
+
+
+class ProcessadorImagens:
+    """
+    Pool de processos para otimizar imagens, com cache em disco.
+
+    A versão otimizada fica em `<armazém>/otimizadas/<2 primeiros>/<hash>_<lado>_q<qualidade>.jpg`;
+    a mesma imagem (mesmo hash) nunca é processada duas vezes com os mesmos parâmetros.
+    Se a otimização falhar, o LLM recebe a imagem original, e a falha fica em cache
+    (`ESPERA_NOVA_TENTATIVA`) para a imagem não voltar ao pool a cada turno.
+    """
+
+    MIME_OTIMIZADA = "image/jpeg"
+
+    def __init__(self, lado_maximo: int = 1024, qualidade: int = 80, num_processos: int = 2):
+        self.lado_maximo = lado_maximo
+        self.qualidade = qualidade
+        self.num_processos = num_processos
+
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        # Cache negativo: caminho da versão otimizada -> horário da falha
+        self._falhas_recentes: Dict[str, float] = {}
+
+        # Métricas
+        self._acertos_cache = 0
+        self._otimizadas = 0
+        self._falhas = 0
+        self._falhas_evitadas = 0
+        self._bytes_originais = 0
+        self._bytes_otimizados = 0
+        self._tempo_total_ms = 0.0
+
+    def configurar(
+        self,
+        lado_maximo: Optional[int] = None,
+        qualidade: Optional[int] = None,
+        num_processos: Optional[int] = None
+    ):
+        """Ajusta os parâmetros. O número de processos só vale antes do primeiro uso."""
+        if lado_maximo is not None:
+            self.lado_maximo = max(64, int(lado_maximo))
+        if qualidade is not None:
+            self.qualidade = min(95, max(10, int(qualidade)))
+        if num_processos is not None:
+            self.num_processos = max(1, int(num_processos))
+
+    def _obter_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                # spawn: o processo principal tem várias threads (fork não é seguro)
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.num_processos,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._pool
+
+    def parar(self):
+        """Encerra o pool de processos."""
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+    def caminho_otimizada(self, hash_midia: str, lado_maximo: Optional[int] = None) -> Path:
+        """Caminho em cache da versão otimizada de um hash."""
+        from mensagem.mensagem_midia_service import armazem_midia
+
+        lado = lado_maximo or self.lado_maximo
+        return armazem_midia.diretorio / "otimizadas" / hash_midia[:2] / f"{hash_midia}_{lado}_q{self.qualidade}.jpg"
+
+    def remover_cache(self, hash_midia: str):
+        """Apaga as versões otimizadas de um hash (quando o original é apagado)."""
+        from mensagem.mensagem_midia_service import armazem_midia
+
+        pasta = armazem_midia.diretorio / "otimizadas" / hash_midia[:2]
+        for arquivo in pasta.glob(f"{hash_midia}_*.jpg"):
+            arquivo.unlink(missing_ok=True)
+
+    def em_cache(self, hash_midia: str, lado_maximo: Optional[int] = None) -> Optional[Path]:
+        """Versão otimizada já gerada, sem processar (não bloqueia); None se ainda não existir."""
+        destino = self.caminho_otimizada(hash_midia, lado_maximo)
+        if destino.exists():
+            with self._lock:
+                self._acertos_cache += 1
+            return destino
+        return None
+
+    async def otimizar(self, hash_midia: str, lado_maximo: Optional[int] = None) -> Optional[Path]:
+        """
+        Garante a versão otimizada da imagem, processando-a no pool se não estiver em cache.
+
+        Returns:
+            Caminho da imagem otimizada, ou None se a otimização falhar (ou tiver
+            falhado há menos de `ESPERA_NOVA_TENTATIVA` segundos)
+        """
+        from mensagem.mensagem_midia_service import armazem_midia
+
+        destino = self.em_cache(hash_midia, lado_maximo)
+        if destino:
+            return destino
+
+        destino = self.caminho_otimizada(hash_midia, lado_maximo)
+        with self._lock:
+            falhou_em = self._falhas_recentes.get(str(destino))
+            if falhou_em is not None and time.time() - falhou_em < ESPERA_NOVA_TENTATIVA:
+                self._falhas_evitadas += 1
+                return None
+
+        origem = armazem_midia.caminho(hash_midia)
+        destino.parent.mkdir(parents=True, exist_ok=True)
+        inicio = time.time()
+        try:
+            tamanho = await asyncio.get_running_loop().run_in_executor(
+                self._obter_pool(),
+                _otimizar_arquivo,
+                str(origem),
+                str(destino),
+                lado_maximo or self.lado_maximo,
+                self.qualidade
+            )
+        except Exception as e:
+            print(f"⚠️  [IMAGEM] Falha ao otimizar {hash_midia[:12]}: {e}")
+            with self._lock:
+                self._falhas += 1
+                self._falhas_recentes[str(destino)] = time.time()
+            return None
+
+        with self._lock:
+            self._falhas_recentes.pop(str(destino), None)
+        self._registrar(hash_midia, origem, tamanho, inicio)
+        return destino
+
+    async def otimizar_varias(self, hashes: Iterable[str]) -> Dict[str, Path]:
+        """
+        Otimiza várias imagens em paralelo no pool.
+
+        Returns:
+            Hash -> caminho da versão otimizada (as que falharem ficam de fora)
+        """
+        hashes = list(dict.fromkeys(hashes))
+        caminhos = await asyncio.gather(*(self.otimizar(hash_midia) for hash_midia in hashes))
+        return {hash_midia: caminho for hash_midia, caminho in zip(hashes, caminhos) if caminho}
+
+    def _registrar(self, hash_midia: str, origem: Path, tamanho: int, inicio: float):
+        """Contabiliza uma otimização nas métricas."""
+        tempo_ms = (time.time() - inicio) * 1000
+        original = origem.stat().st_size
+        with self._lock:
+            self._otimizadas += 1
+            self._bytes_originais += original
+            self._bytes_otimizados += tamanho
+            self._tempo_total_ms += tempo_ms
+        print(f"🖼️  [IMAGEM] Otimizada {hash_midia[:12]}: {original // 1024} KB → {tamanho // 1024} KB em {tempo_ms:.0f} ms")
+
+    def obter_metricas(self) -> Dict[str, Any]:
+        """Retorna otimizações, acertos de cache e economia de bytes."""
+        with self._lock:
+            return {
+                "lado_maximo": self.lado_maximo,
+                "qualidade": self.qualidade,
+                "processos": self.num_processos,
+                "otimizadas": self._otimizadas,
+                "acertos_cache": self._acertos_cache,
+                "falhas": self._falhas,
+                "falhas_evitadas": self._falhas_evitadas,
+                "bytes_originais": self._bytes_originais,
+                "bytes_otimizados": self._bytes_otimizados,
+                "reducao_percentual": (
+                    round(100 * (1 - self._bytes_otimizados / self._bytes_originais), 1)
+                    if self._bytes_originais else 0
+                ),
+                "tempo_medio_ms": round(self._tempo_total_ms / self._otimizadas, 2) if self._otimizadas else 0
+            }
+
+
+# Instância global do processador de imagens
+processador_imagens = ProcessadorImagens()
@@ -0,0 +1,206 @@
+"""
+Armazenamento de mídias por conteúdo.
+Cada arquivo é gravado uma única vez, com o nome igual ao SHA-256 do conteúdo;
+as mensagens guardam só o hash (`Mensagem.conteudo_midia_hash`) e a tabela `midias`
+conta quantas mensagens referenciam cada arquivo.
+"""
+from typing import Optional, Iterator, BinaryIO, Iterable
+from pathlib import Path
+from sqlalchemy.exc import IntegrityError
+import base64
+import hashlib
+import os
+from uuid import uuid4
+from database import SessionLocal
+from mensagem.mensagem_model import Mensagem, Midia
+
+
+class ArmazemMidia:
+    """
+    Blobs endereçados por hash em `diretorio/<2 primeiros>/<hash>`.
+
+    Mídias idênticas (o mesmo arquivo reenviado, encaminhado etc.) ocupam um único
+    arquivo. O arquivo é apagado quando a última mensagem que o referencia é removida.
+    Os bytes só são lidos quando alguém precisa deles (prompt, download).
+
+    `salvar` soma a referência antes de olhar o arquivo, e `liberar` apaga os arquivos
+    antes de confirmar a remoção dos registros: um `salvar` concorrente do mesmo conteúdo
+    espera a transação de `liberar` e regrava o arquivo apagado.
+    """
+
+    TAMANHO_BLOCO = 64 * 1024
+
+    def __init__(self, diretorio: str = "./uploads/midia"):
+        self.diretorio = Path(diretorio)
+
+    def configurar(self, diretorio: Optional[str] = None):
+        """Define o diretório dos blobs."""
+        if diretorio:
+            self.diretorio = Path(diretorio)
+
+    @staticmethod
+    def calcular_hash(dados: bytes) -> str:
+        """SHA-256 (hex) do conteúdo."""
+        return hashlib.sha256(dados).hexdigest()
+
+    def caminho(self, hash_midia: str) -> Path:
+        """Caminho do arquivo de um hash."""
+        return self.diretorio / hash_midia[:2] / hash_midia
+
+    def existe(self, hash_midia: str) -> bool:
+        return self.caminho(hash_midia).exists()
+
+    def salvar(self, dados: bytes, mime_type: Optional[str] = None) -> str:
+        """
+        Soma uma referência e grava o conteúdo (se o arquivo não existir).
+        Quem chama deve devolver a referência (liberar) se desistir de usá-la.
+
+        Returns:
+            Hash do conteúdo
+        """
+        hash_midia = self.calcular_hash(dados)
+        destino = self.caminho(hash_midia)
+
+        # Referência primeiro: com ela o arquivo não é mais apagado por liberar
+        self._referenciar(hash_midia, mime_type, len(dados))
+
+        if not destino.exists():
+            try:
+                destino.parent.mkdir(parents=True, exist_ok=True)
+                # Gravação atômica: nunca expõe um arquivo pela metade com o nome final
+                temporario = destino.with_name(f".{hash_midia}.{uuid4().hex}.tmp")
+                with open(temporario, "wb") as arquivo:
+                    arquivo.write(dados)
+                os.replace(temporario, destino)
+            except OSError:
+                self.liberar([hash_midia])
+                raise
+
+        return hash_midia
+
+    def _referenciar(self, hash_midia: str, mime_type: Optional[str], tamanho: int):
+        """Soma uma referência ao hash, criando o registro na primeira vez."""
+        db = SessionLocal()
+        try:
+            atualizados = db.query(Midia)\
+                .filter(Midia.hash == hash_midia)\
+                .update({Midia.referencias: Midia.referencias + 1}, synchronize_session=False)
+            if not atualizados:
+                db.add(Midia(hash=hash_midia, mime_type=mime_type, tamanho=tamanho, referencias=1))
+            try:
+                db.commit()
+            except IntegrityError:
+                # Outro worker criou o registro ao mesmo tempo
+                db.rollback()
+                db.query(Midia)\
+                    .filter(Midia.hash == hash_midia)\
+                    .update({Midia.referencias: Midia.referencias + 1}, synchronize_session=False)
+                db.commit()
+        finally:
+            db.close()
+
+    def liberar(self, hashes: Iterable[str]):
+        """
+        Devolve uma referência de cada hash; apaga os arquivos que ficarem sem referências.
+        Os arquivos são apagados dentro da transação que remove os registros.
+        """
+        from mensagem.mensagem_imagem_service import processador_imagens
+
+        hashes = [h for h in hashes if h]
+        if not hashes:
+            return
+
+        db = SessionLocal()
+        try:
+            for hash_midia in hashes:
+                db.query(Midia)\
+                    .filter(Midia.hash == hash_midia)\
+                    .update({Midia.referencias: Midia.referencias - 1}, synchronize_session=False)
+            orfas = [
+                h for (h,) in db.query(Midia.hash)
+                .filter(Midia.hash.in_(set(hashes)), Midia.referencias <= 0)
+                .all()
+            ]
+            if orfas:
+                db.query(Midia).filter(Midia.hash.in_(orfas)).delete(synchronize_session=False)
+                # Com a escrita ainda pendente, um salvar do mesmo conteúdo não consegue
+                # somar a referência até o commit, e depois dele regrava o arquivo
+                db.flush()
+                for hash_midia in orfas:
+                    try:
+                        self.caminho(hash_midia).unlink(missing_ok=True)
+                        processador_imagens.remover_cache(hash_midia)
+                    except OSError as e:
+                        print(f"⚠️  [MIDIA] Erro ao apagar {hash_midia}: {e}")
+            db.commit()
+        finally:
+            db.close()
+
+        if orfas:
+            print(f"🧹 [MIDIA] {len(orfas)} arquivo(s) sem referências apagado(s)")
+
+    def abrir(self, hash_midia: str) -> BinaryIO:
+        """Abre o arquivo para leitura (quem chama fecha)."""
+        return open(self.caminho(hash_midia), "rb")
+
+    def ler_em_blocos(self, hash_midia: str, tamanho_bloco: int = TAMANHO_BLOCO) -> Iterator[bytes]:
+        """Lê o arquivo em blocos, sem carregá-lo inteiro na memória."""
+        with self.abrir(hash_midia) as arquivo:
+            while True:
+                bloco = arquivo.read(tamanho_bloco)
+                if not bloco:
+                    break
+                yield bloco
+
+    def ler(self, hash_midia: str) -> Optional[bytes]:
+        """Lê o conteúdo inteiro (None se o arquivo não existir)."""
+        try:
+            return self.caminho(hash_midia).read_bytes()
+        except FileNotFoundError:
+            print(f"⚠️  [MIDIA] Arquivo não encontrado: {hash_midia}")
+            return None
+
+    def ler_base64(self, hash_midia: str) -> Optional[str]:
+        """Conteúdo em base64, para data URLs dos prompts."""
+        dados = self.ler(hash_midia)
+        return base64.b64encode(dados).decode("utf-8") if dados is not None else None
+
+    def migrar_legado(self, lote: int = 50) -> int:
+        """
+        Move para o armazém as imagens ainda guardadas em `conteudo_imagem_base64`
+        e limpa a coluna. Processa em lotes; seguro para rodar a cada inicialização.
+
+        Returns:
+            Número de mensagens migradas
+        """
+        migradas = 0
+        db = SessionLocal()
+        try:
+            while True:
+                mensagens = db.query(Mensagem)\
+                    .filter(
+                        Mensagem.conteudo_imagem_base64.isnot(None),
+                        Mensagem.conteudo_midia_hash.is_(None)
+                    )\
+                    .limit(lote)\
+                    .all()
+                if not mensagens:
+                    break
+
+                for mensagem in mensagens:
+                    try:
+                        dados = base64.b64decode(mensagem.conteudo_imagem_base64)
+                        mensagem.conteudo_midia_hash = self.salvar(dados, mensagem.conteudo_mime_type)
+                        mensagem.conteudo_imagem_path = str(self.caminho(mensagem.conteudo_midia_hash))
+                    except Exception as e:
+                        print(f"⚠️  [MIDIA] Imagem da mensagem {mensagem.id} inválida, descartada: {e}")
+                    mensagem.conteudo_imagem_base64 = None
+                    migradas += 1
+                db.commit()
+        finally:
+            db.close()
+        return migradas
+
+
+# Instância global do armazém de mídias
+armazem_midia = ArmazemMidia()
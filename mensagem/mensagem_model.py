@@ -1,7 +1,7 @@
 """
 Modelo de dados para mensagens.
 """
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text, ForeignKey, JSON
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text, ForeignKey, JSON, Index
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from database import Base
@@ -13,6 +13,13 @@ class Mensagem(Base):
     Armazena todas as mensagens recebidas e enviadas.
     """
     __tablename__ = "mensagens"
+    __table_args__ = (
+        # Reentregas do WhatsApp não geram uma segunda mensagem
+        Index("uq_mensagens_sessao_mensagem_whatsapp", "sessao_id", "mensagem_id_whatsapp", unique=True),
+        # Listagens por conversa e por sessão, ordenadas por data (paginação por chave)
+        Index("ix_mensagens_sessao_telefone_criado", "sessao_id", "telefone_cliente", "criado_em"),
+        Index("ix_mensagens_sessao_criado", "sessao_id", "criado_em"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     sessao_id = Column(Integer, ForeignKey("sessoes.id"), nullable=False, index=True)
@@ -29,9 +36,13 @@ class Mensagem(Base):
     # Conteúdo
     conteudo_texto = Column(Text, nullable=True)
     conteudo_imagem_path = Column(String(500), nullable=True)  # Caminho local da imagem
-    conteudo_imagem_base64 = Column(Text, nullable=True)  # Imagem em base64
+    conteudo_imagem_base64 = Column(Text, nullable=True)  # Legado: imagem em base64 (migrada para o armazém de mídias)
+    conteudo_midia_hash = Column(String(64), nullable=True, index=True)  # SHA-256 da mídia no armazém (tabela midias)
     conteudo_imagem_url = Column(String(500), nullable=True)  # URL da imagem
     conteudo_mime_type = Column(String(100), nullable=True)
+    conteudo_imagem_descricao = Column(Text, nullable=True)  # Descrição da imagem pelo modelo (usada no histórico)
+    
+    enviado_em = Column(DateTime, nullable=True)  # Horário da mensagem no WhatsApp (Info.Timestamp)
     
     # Metadados da conversa
     contexto = Column(JSON, nullable=True)  # Histórico de mensagens para contexto
@@ -51,6 +62,13 @@ class Mensagem(Base):
     processada = Column(Boolean, default=False)
     respondida = Column(Boolean, default=False)
     
+    # Diário de processamento das mensagens recebidas
+    status = Column(String(20), nullable=True, index=True)  # recebida, enfileirada, processando, enviando, respondida, erro
+    lease_dono = Column(String(100), nullable=True)  # Instância que está processando o turno
+    lease_expira_em = Column(DateTime(timezone=True), nullable=True)
+    tentativas = Column(Integer, default=0)  # Turnos interrompidos (reinício durante o processamento)
+    resposta_id_whatsapp = Column(String(100), nullable=True)  # ID da resposta enviada
+    
     # Timestamps
     criado_em = Column(DateTime(timezone=True), server_default=func.now(), index=True)
     processado_em = Column(DateTime(timezone=True), nullable=True)
@@ -61,3 +79,68 @@ class Mensagem(Base):
 
     def __repr__(self):
         return f"<Mensagem(id={self.id}, telefone='{self.telefone_cliente}', tipo='{self.tipo}', direcao='{self.direcao}')>"
+
+
+class Midia(Base):
+    """
+    Tabela de mídias do armazenamento por conteúdo.
+    Um registro por arquivo (hash), com o número de mensagens que o referenciam.
+    """
+    __tablename__ = "midias"
+
+    hash = Column(String(64), primary_key=True)  # SHA-256 do conteúdo (nome do arquivo)
+    mime_type = Column(String(100), nullable=True)
+    tamanho = Column(Integer, nullable=False, default=0)  # Bytes
+    referencias = Column(Integer, nullable=False, default=0)
+    criado_em = Column(DateTime(timezone=True), server_default=func.now())
+
+    def __repr__(self):
+        return f"<Midia(hash='{self.hash[:12]}', referencias={self.referencias})>"
+
+
+class ResumoConversa(Base):
+    """
+    Tabela de resumos das conversas.
+    Resumo acumulado das mensagens que já saíram da janela de contexto do agente,
+    atualizado de forma incremental (uma linha por conversa).
+    """
+    __tablename__ = "resumos_conversas"
+    __table_args__ = (
+        Index("uq_resumos_conversas_sessao_telefone", "sessao_id", "telefone_cliente", unique=True),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    sessao_id = Column(Integer, ForeignKey("sessoes.id", ondelete="CASCADE"), nullable=False)
+    telefone_cliente = Column(String(20), nullable=False)
+    resumo = Column(Text, nullable=False, default="")
+    ate_mensagem_id = Column(Integer, nullable=False, default=0)  # Última mensagem incluída no resumo
+    mensagens_resumidas = Column(Integer, nullable=False, default=0)
+    criado_em = Column(DateTime(timezone=True), server_default=func.now())
+    atualizado_em = Column(DateTime(timezone=True), onupdate=func.now())
+
+    def __repr__(self):
+        return f"<ResumoConversa(sessao_id={self.sessao_id}, telefone='{self.telefone_cliente}', ate={self.ate_mensagem_id})>"
+
+
+class EpocaConversa(Base):
+    """
+    Tabela de épocas do histórico das conversas.
+    O `#limpar` só avança a época: mensagens com id até `inicio_mensagem_id` deixam de
+    fazer parte do histórico e são expurgadas depois, em segundo plano.
+    """
+    __tablename__ = "epocas_conversas"
+    __table_args__ = (
+        Index("uq_epocas_conversas_sessao_telefone", "sessao_id", "telefone_cliente", unique=True),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    sessao_id = Column(Integer, ForeignKey("sessoes.id", ondelete="CASCADE"), nullable=False)
+    telefone_cliente = Column(String(20), nullable=False)
+    epoca = Column(Integer, nullable=False, default=0)  # Número de #limpar da conversa
+    inicio_mensagem_id = Column(Integer, nullable=False, default=0)  # Mensagens com id <= ficam fora do histórico
+    reiniciado_em = Column(DateTime, nullable=True)  # Último #limpar
+    expurgo_pendente = Column(Boolean, nullable=False, default=False)  # Há mensagens antigas a expurgar
+    criado_em = Column(DateTime(timezone=True), server_default=func.now())
+
+    def __repr__(self):
+        return f"<EpocaConversa(sessao_id={self.sessao_id}, telefone='{self.telefone_cliente}', epoca={self.epoca})>"
@@ -0,0 +1,178 @@
+"""
+Retenção de dados: tarefas periódicas de manutenção executadas em lotes.
+Arquiva as mensagens além da retenção de cada sessão e apaga as métricas antigas
+do RAG, em uma thread própria, fora do caminho das mensagens.
+"""
+from typing import Optional, Dict, Any, Callable
+from datetime import datetime, timedelta
+import threading
+import time
+from sqlalchemy.orm import Session
+from database import SessionLocal
+
+
+class RetencaoDados:
+    """
+    Agendador das tarefas de retenção.
+
+    Cada tarefa recebe uma sessão do banco, faz seu trabalho em lotes curtos e
+    devolve o número de itens processados. Todas rodam a cada `intervalo_horas`
+    (e quando `agendar` é chamado); a falha de uma não impede as demais.
+    """
+
+    def __init__(self, intervalo_horas: float = 6.0):
+        self.intervalo_horas = intervalo_horas
+        self._tarefas: Dict[str, Callable[[Session], int]] = {}
+
+        self._thread: Optional[threading.Thread] = None
+        self._acordar = threading.Event()
+        self._encerrando = False
+        self._lock = threading.Lock()
+        self._lock_execucao = threading.Lock()  # Uma execução por vez (thread ou chamada manual)
+
+        # Métricas por tarefa
+        self._metricas: Dict[str, Dict[str, Any]] = {}
+
+    def configurar(self, intervalo_horas: Optional[float] = None):
+        """Ajusta o intervalo entre execuções."""
+        if intervalo_horas is not None:
+            self.intervalo_horas = max(0.01, float(intervalo_horas))
+
+    def registrar(self, nome: str, tarefa: Callable[[Session], int]):
+        """Registra uma tarefa de retenção."""
+        with self._lock:
+            self._tarefas[nome] = tarefa
+            self._metricas.setdefault(nome, {
+                "execucoes": 0,
+                "itens": 0,
+                "falhas": 0,
+                "ultimo_erro": None,
+                "ultima_execucao": None,
+                "ultima_duracao_ms": 0
+            })
+
+    def iniciar(self):
+        """Inicia a thread de retenção (idempotente)."""
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._encerrando = False
+            self._thread = threading.Thread(target=self._executar, name="retencao-dados", daemon=True)
+            self._thread.start()
+        print(f"✅ [RETENCAO] Tarefas de retenção iniciadas (a cada {self.intervalo_horas} h)")
+
+    def parar(self, timeout: float = 5.0):
+        """Encerra a thread após a tarefa em andamento."""
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread:
+            self._encerrando = True
+            self._acordar.set()
+            thread.join(timeout=timeout)
+
+    def agendar(self):
+        """Pede uma execução assim que possível."""
+        self._acordar.set()
+
+    def _executar(self):
+        while not self._encerrando:
+            self._acordar.wait(self.intervalo_horas * 3600)
+            self._acordar.clear()
+            if self._encerrando:
+                break
+            self.executar_tarefas()
+
+    def executar_tarefas(self) -> Dict[str, int]:
+        """
+        Executa todas as tarefas registradas, cada uma com sua sessão do banco.
+
+        Returns:
+            Itens processados por tarefa
+        """
+        with self._lock:
+            tarefas = list(self._tarefas.items())
+
+        with self._lock_execucao:
+            return self._executar_tarefas(tarefas)
+
+    def _executar_tarefas(self, tarefas) -> Dict[str, int]:
+        resultado = {}
+        for nome, tarefa in tarefas:
+            if self._encerrando:
+                break
+            inicio = time.time()
+            db = SessionLocal()
+            try:
+                itens = tarefa(db) or 0
+                erro = None
+            except Exception as e:
+                db.rollback()
+                itens, erro = 0, str(e)
+                print(f"❌ [RETENCAO] Erro na tarefa {nome}: {e}")
+            finally:
+                db.close()
+
+            with self._lock:
+                metricas = self._metricas[nome]
+                metricas["execucoes"] += 1
+                metricas["itens"] += itens
+                metricas["ultima_execucao"] = datetime.now().isoformat()
+                metricas["ultima_duracao_ms"] = round((time.time() - inicio) * 1000, 2)
+                if erro:
+                    metricas["falhas"] += 1
+                    metricas["ultimo_erro"] = erro
+            resultado[nome] = itens
+        return resultado
+
+    def obter_metricas(self) -> Dict[str, Any]:
+        """Retorna o estado do agendador e as métricas de cada tarefa."""
+        from mensagem.mensagem_arquivo_service import arquivo_mensagens
+
+        with self._lock:
+            return {
+                "em_execucao": bool(self._thread and self._thread.is_alive()),
+                "intervalo_horas": self.intervalo_horas,
+                "tarefas": {nome: dict(metricas) for nome, metricas in self._metricas.items()},
+                "arquivo": arquivo_mensagens.obter_metricas()
+            }
+
+
+def arquivar_mensagens_antigas(db: Session) -> int:
+    """
+    Tarefa: arquiva as mensagens além da retenção de cada sessão
+    (`Sessao.retencao_dias`, ou `processamento_arquivo_retencao_dias` se 0).
+    """
+    from config.config_service import ConfiguracaoService
+    from sessao.sessao_model import Sessao
+    from mensagem.mensagem_arquivo_service import arquivo_mensagens
+
+    padrao = int(ConfiguracaoService.obter_valor(db, "processamento_arquivo_retencao_dias", 0) or 0)
+    lote = int(ConfiguracaoService.obter_valor(db, "processamento_arquivo_lote", 1000) or 1000)
+
+    total = 0
+    for sessao_id, retencao_dias in db.query(Sessao.id, Sessao.retencao_dias).all():
+        dias = retencao_dias or padrao
+        if dias <= 0:
+            continue
+        antes_de = datetime.now() - timedelta(days=dias)
+        total += arquivo_mensagens.arquivar_sessao(db, sessao_id, antes_de, lote)
+    return total
+
+
+def limpar_metricas_rag(db: Session) -> int:
+    """Tarefa: apaga as métricas do RAG mais antigas que `processamento_rag_metricas_retencao_dias`."""
+    from config.config_service import ConfiguracaoService
+    from rag.rag_metrica_service import RAGMetricaService
+
+    dias = int(ConfiguracaoService.obter_valor(db, "processamento_rag_metricas_retencao_dias", 90) or 0)
+    if dias <= 0:
+        return 0
+    lote = int(ConfiguracaoService.obter_valor(db, "processamento_arquivo_lote", 1000) or 1000)
+    return RAGMetricaService.deletar_metricas_antigas(db, dias, lote)
+
+
+# Instância global da retenção de dados
+retencao_dados = RetencaoDados()
+retencao_dados.registrar("arquivo_mensagens", arquivar_mensagens_antigas)
+retencao_dados.registrar("metricas_rag", limpar_metricas_rag)
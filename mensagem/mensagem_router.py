@@ -1,26 +1,41 @@
 """
 Rotas da API para mensagens.
 """
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
+from datetime import date
 from database import get_db
-from mensagem.mensagem_schema import MensagemResposta, MensagemEnviar, HistoricoMensagens
+from mensagem.mensagem_schema import MensagemResposta, MensagemResumo, MensagemEnviar, HistoricoMensagens
 from mensagem.mensagem_service import MensagemService
 from sessao.sessao_service import SessaoService
 
 router = APIRouter(prefix="/api/mensagens", tags=["Mensagens"])
 
 
-@router.get("/sessao/{sessao_id}", response_model=List[MensagemResposta])
+@router.get("/sessao/{sessao_id}", response_model=List[MensagemResumo])
 def listar_mensagens_sessao(
     sessao_id: int,
+    response: Response,
     limite: int = Query(default=100, le=500),
-    offset: int = Query(default=0, ge=0),
+    offset: int = Query(default=0, ge=0, description="Obsoleto: prefira `cursor`"),
+    cursor: Optional[str] = Query(default=None, description="Valor de X-Proximo-Cursor da página anterior"),
     db: Session = Depends(get_db)
 ):
-    """Lista mensagens de uma sessão."""
-    return MensagemService.listar_por_sessao(db, sessao_id, limite, offset)
+    """
+    Lista mensagens de uma sessão, da mais nova para a mais antiga (resumo; o detalhe
+    completo está em GET /api/mensagens/{id}).
+    O cursor da próxima página vem no cabeçalho `X-Proximo-Cursor`.
+    """
+    try:
+        mensagens = MensagemService.listar_por_sessao(db, sessao_id, limite, offset, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    proximo_cursor = MensagemService.proximo_cursor(mensagens, limite)
+    if proximo_cursor is not None:
+        response.headers["X-Proximo-Cursor"] = proximo_cursor
+    return mensagens
 
 
 @router.get("/sessao/{sessao_id}/cliente/{telefone}", response_model=HistoricoMensagens)
@@ -28,26 +43,64 @@ def listar_mensagens_cliente(
     sessao_id: int,
     telefone: str,
     limite: int = Query(default=50, le=200),
+    cursor: Optional[str] = Query(default=None, description="proximo_cursor da página anterior"),
     db: Session = Depends(get_db)
 ):
-    """Lista mensagens de um cliente específico."""
-    mensagens = MensagemService.listar_por_cliente(db, sessao_id, telefone, limite)
+    """Lista mensagens de um cliente específico (paginação por cursor)."""
+    try:
+        mensagens = MensagemService.listar_por_cliente(db, sessao_id, telefone, limite, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     return HistoricoMensagens(
         telefone_cliente=telefone,
         mensagens=mensagens,
-        total=len(mensagens)
+        total=len(mensagens),
+        proximo_cursor=MensagemService.proximo_cursor(mensagens, limite)
+    )
+
+
+@router.get("/sessao/{sessao_id}/arquivo")
+def exportar_arquivo_sessao(
+    sessao_id: int,
+    inicio: Optional[date] = Query(default=None, description="Primeiro dia (AAAA-MM-DD)"),
+    fim: Optional[date] = Query(default=None, description="Último dia (AAAA-MM-DD)"),
+):
+    """Exporta as mensagens arquivadas da sessão em NDJSON (streaming)."""
+    from mensagem.mensagem_arquivo_service import arquivo_mensagens
+    
+    return StreamingResponse(
+        arquivo_mensagens.exportar_ndjson(sessao_id, inicio, fim),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="mensagens_sessao_{sessao_id}.ndjson"'}
     )
 
 
 @router.get("/{mensagem_id}", response_model=MensagemResposta)
 def obter_mensagem(mensagem_id: int, db: Session = Depends(get_db)):
-    """Obtém uma mensagem específica."""
+    """Obtém uma mensagem específica, com todos os campos (ferramentas usadas etc.)."""
     mensagem = MensagemService.obter_por_id(db, mensagem_id)
     if not mensagem:
         raise HTTPException(status_code=404, detail="Mensagem não encontrada")
     return mensagem
 
 
+@router.get("/{mensagem_id}/midia")
+def obter_midia_mensagem(mensagem_id: int, db: Session = Depends(get_db)):
+    """Baixa a mídia de uma mensagem (lida do armazém em blocos)."""
+    from mensagem.mensagem_midia_service import armazem_midia
+    
+    mensagem = MensagemService.obter_por_id(db, mensagem_id)
+    if not mensagem or not mensagem.conteudo_midia_hash:
+        raise HTTPException(status_code=404, detail="Mídia não encontrada")
+    if not armazem_midia.existe(mensagem.conteudo_midia_hash):
+        raise HTTPException(status_code=404, detail="Arquivo da mídia não encontrado")
+    
+    return StreamingResponse(
+        armazem_midia.ler_em_blocos(mensagem.conteudo_midia_hash),
+        media_type=mensagem.conteudo_mime_type or "application/octet-stream"
+    )
+
+
 @router.post("/enviar")
 def enviar_mensagem(mensagem: MensagemEnviar, db: Session = Depends(get_db)):
     """Envia uma mensagem através de uma sessão."""
@@ -21,13 +21,33 @@ class MensagemCriar(MensagemBase):
     pass
 
 
+class MensagemResumo(MensagemBase):
+    """Schema das listagens: sem contexto, ferramentas usadas e demais campos pesados."""
+    id: int
+    conteudo_midia_hash: Optional[str] = None
+    conteudo_mime_type: Optional[str] = None
+    resposta_texto: Optional[str] = None
+    resposta_tempo_ms: Optional[int] = None
+    resposta_modelo: Optional[str] = None
+    processada: bool
+    respondida: bool
+    status: Optional[str] = None
+    criado_em: datetime
+    respondido_em: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+
 class MensagemResposta(MensagemBase):
     """Schema de resposta com dados completos."""
     id: int
     mensagem_id_whatsapp: Optional[str] = None
     conteudo_imagem_path: Optional[str] = None
+    conteudo_midia_hash: Optional[str] = None
     conteudo_imagem_url: Optional[str] = None
     conteudo_mime_type: Optional[str] = None
+    conteudo_imagem_descricao: Optional[str] = None
     resposta_texto: Optional[str] = None
     resposta_tokens_input: Optional[int] = None
     resposta_tokens_output: Optional[int] = None
@@ -37,6 +57,8 @@ class MensagemResposta(MensagemBase):
     ferramentas_usadas: Optional[List[Dict[str, Any]]] = None
     processada: bool
     respondida: bool
+    status: Optional[str] = None
+    resposta_id_whatsapp: Optional[str] = None
     criado_em: datetime
     processado_em: Optional[datetime] = None
     respondido_em: Optional[datetime] = None
@@ -55,5 +77,6 @@ class MensagemEnviar(BaseModel):
 class HistoricoMensagens(BaseModel):
     """Schema para histórico de mensagens de um cliente."""
     telefone_cliente: str
-    mensagens: List[MensagemResposta]
+    mensagens: List[MensagemResumo]
     total: int
+    proximo_cursor: Optional[str] = None  # Passar como `cursor` para a próxima página
@@ -0,0 +1,122 @@
+"""
+Tarefas assíncronas de segundo plano dos turnos (descrição de imagens, resumo das conversas).
+Rodam em um event loop próprio, sempre ativo, em vez do loop do worker: aquele só gira
+enquanto o worker executa um turno, e uma tarefa deixada nele ficaria parada até o
+próximo turno do mesmo worker.
+"""
+from typing import Optional, Dict, Any, Coroutine
+from concurrent.futures import Future
+import asyncio
+import threading
+import traceback
+
+
+class TarefasSegundoPlano:
+    """
+    Loop asyncio em uma thread própria.
+
+    `agendar` recebe a corrotina de qualquer thread e não bloqueia; cada tarefa usa sua
+    própria sessão do banco. Falhas são registradas e não se propagam a quem agendou.
+    """
+
+    def __init__(self):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+        # Métricas (sob self._lock)
+        self._em_andamento = 0
+        self._agendadas = 0
+        self._concluidas = 0
+        self._falhas = 0
+        self._ultimo_erro: Optional[str] = None
+
+    @property
+    def iniciada(self) -> bool:
+        """Indica se o loop de segundo plano já foi iniciado."""
+        return self._loop is not None
+
+    def iniciar(self):
+        """Inicia a thread do loop (idempotente)."""
+        with self._lock:
+            if self.iniciada:
+                return
+            self._loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(target=self._executar_loop, name="segundo-plano", daemon=True)
+            self._thread.start()
+        print("✅ [SEGUNDO_PLANO] Loop de tarefas de segundo plano iniciado")
+
+    def _executar_loop(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    def parar(self, timeout: float = 10.0):
+        """Aguarda até `timeout` segundos as tarefas em andamento e encerra o loop."""
+        with self._lock:
+            if not self.iniciada:
+                return
+            loop, thread = self._loop, self._thread
+
+        async def drenar():
+            tarefas = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+            if tarefas:
+                await asyncio.wait(tarefas, timeout=timeout)
+
+        try:
+            asyncio.run_coroutine_threadsafe(drenar(), loop).result(timeout + 1)
+        except Exception:
+            pass
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout=5)
+
+        with self._lock:
+            self._loop = None
+            self._thread = None
+
+    def agendar(self, corrotina: Coroutine, descricao: str = "") -> Future:
+        """
+        Executa a corrotina no loop de segundo plano. Não bloqueia.
+
+        Returns:
+            Future com o resultado da corrotina (None se ela falhar)
+        """
+        if not self.iniciada:
+            self.iniciar()
+        with self._lock:
+            self._agendadas += 1
+            self._em_andamento += 1
+        return asyncio.run_coroutine_threadsafe(self._executar(corrotina, descricao), self._loop)
+
+    async def _executar(self, corrotina: Coroutine, descricao: str) -> Any:
+        try:
+            resultado = await corrotina
+            erro = None
+        except Exception as e:
+            resultado, erro = None, e
+            print(f"❌ [SEGUNDO_PLANO] Erro em {descricao or 'tarefa'}: {e}")
+            traceback.print_exc()
+
+        with self._lock:
+            self._em_andamento -= 1
+            if erro is None:
+                self._concluidas += 1
+            else:
+                self._falhas += 1
+                self._ultimo_erro = f"{descricao}: {erro}" if descricao else str(erro)
+        return resultado
+
+    def obter_metricas(self) -> Dict[str, Any]:
+        """Retorna o estado do loop e as contagens de tarefas."""
+        with self._lock:
+            return {
+                "em_execucao": bool(self._thread and self._thread.is_alive()),
+                "em_andamento": self._em_andamento,
+                "agendadas": self._agendadas,
+                "concluidas": self._concluidas,
+                "falhas": self._falhas,
+                "ultimo_erro": self._ultimo_erro
+            }
+
+
+# Instância global das tarefas de segundo plano
+tarefas_segundo_plano = TarefasSegundoPlano()
@@ -1,19 +1,57 @@
 """
 Serviço de lógica de negócio para mensagens.
 """
-from sqlalchemy.orm import Session
-from typing import Optional, List
+from sqlalchemy.orm import Session, load_only
+from sqlalchemy import or_, and_, func, literal, String
+from sqlalchemy.exc import IntegrityError
+from typing import Optional, List, Dict, Tuple
 from datetime import datetime, timedelta
-import os
-import base64
+from uuid import uuid4
 from pathlib import Path
-from PIL import Image
-import io
+import asyncio
+import base64
+import functools
+import os
+import socket
+import time
 from neonize.events import MessageEv
-from mensagem.mensagem_model import Mensagem
+from mensagem.mensagem_model import Mensagem, ResumoConversa, EpocaConversa
 from mensagem.mensagem_schema import MensagemCriar
 
 
+# Agrupamento de mensagens em um único turno do agente
+MAX_MENSAGENS_AGRUPADAS = 20
+FATOR_ESPERA_MAXIMA_AGRUPAMENTO = 3  # Espera total máxima = janela x fator
+IDADE_MAXIMA_PENDENTE = timedelta(minutes=10)  # Mensagens mais antigas não são respondidas
+
+# Registrado em resposta_erro quando uma mensagem nova do contato interrompe o turno
+MOTIVO_TURNO_CANCELADO = "Turno cancelado: nova mensagem do contato"
+
+# Diário de processamento das mensagens recebidas (Mensagem.status)
+STATUS_RECEBIDA = "recebida"  # Salva; sem turno agendado (ex.: auto-responder desligado)
+STATUS_ENFILEIRADA = "enfileirada"  # Turno do agente agendado ou na fila
+STATUS_PROCESSANDO = "processando"  # Turno em execução, protegido por lease
+STATUS_ENVIANDO = "enviando"  # Resposta gerada e salva; envio em andamento
+STATUS_RESPONDIDA = "respondida"
+STATUS_ERRO = "erro"
+STATUS_IGNORADA = "ignorada"  # Enviada com a sessão offline e descartada pela política "ultima"
+
+# Colunas das listagens (MensagemResumo). Contexto, ferramentas usadas (com os resultados
+# completos) e imagens legadas em base64 só são carregados no detalhe da mensagem.
+COLUNAS_RESUMO = (
+    Mensagem.id, Mensagem.sessao_id, Mensagem.telefone_cliente, Mensagem.nome_cliente,
+    Mensagem.tipo, Mensagem.direcao, Mensagem.conteudo_texto, Mensagem.conteudo_midia_hash,
+    Mensagem.conteudo_mime_type, Mensagem.resposta_texto, Mensagem.resposta_tempo_ms,
+    Mensagem.resposta_modelo, Mensagem.processada, Mensagem.respondida, Mensagem.status,
+    Mensagem.criado_em, Mensagem.respondido_em
+)
+
+DURACAO_LEASE = timedelta(seconds=90)  # Renovada enquanto o turno executa
+MAX_TENTATIVAS_TURNO = 3  # Turnos interrompidos por reinício antes de desistir da mensagem
+ATRASO_RECUPERACAO = 10.0  # Segundos para as sessões reconectarem antes de retomar turnos
+INSTANCIA_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:8]}"
+
+
 class MensagemService:
     """Serviço para gerenciar mensagens."""
 
@@ -22,33 +60,198 @@ class MensagemService:
         db: Session,
         sessao_id: int,
         limite: int = 100,
-        offset: int = 0
+        offset: int = 0,
+        cursor: Optional[str] = None
     ) -> List[Mensagem]:
-        """Lista mensagens de uma sessão."""
-        return db.query(Mensagem)\
+        """
+        Lista mensagens de uma sessão, da mais nova para a mais antiga.
+        Com `cursor` (ver proximo_cursor) usa paginação por chave em vez de OFFSET.
+        Carrega só as colunas do resumo (COLUNAS_RESUMO).
+
+        Raises:
+            ValueError: Cursor inválido
+        """
+        query = db.query(Mensagem)\
+            .options(load_only(*COLUNAS_RESUMO))\
             .filter(Mensagem.sessao_id == sessao_id)\
-            .order_by(Mensagem.criado_em.desc())\
-            .limit(limite)\
-            .offset(offset)\
-            .all()
+            .order_by(Mensagem.criado_em.desc(), Mensagem.id.desc())
+        if cursor is not None:
+            query = MensagemService._apos_cursor(db, query, cursor)
+        elif offset:
+            query = query.offset(offset)
+        return query.limit(limite).all()
 
     @staticmethod
     def listar_por_cliente(
         db: Session,
         sessao_id: int,
         telefone_cliente: str,
-        limite: int = 50
+        limite: int = 50,
+        cursor: Optional[str] = None
     ) -> List[Mensagem]:
-        """Lista mensagens de um cliente específico."""
-        return db.query(Mensagem)\
+        """
+        Lista mensagens de um cliente específico (paginação por chave com `cursor`).
+        Carrega só as colunas do resumo (COLUNAS_RESUMO).
+
+        Raises:
+            ValueError: Cursor inválido
+        """
+        query = db.query(Mensagem)\
+            .options(load_only(*COLUNAS_RESUMO))\
             .filter(
                 Mensagem.sessao_id == sessao_id,
                 Mensagem.telefone_cliente == telefone_cliente
-            )\
-            .order_by(Mensagem.criado_em.desc())\
+            )
+        if cursor is not None:
+            query = MensagemService._apos_cursor(db, query, cursor)
+        return query\
+            .order_by(Mensagem.criado_em.desc(), Mensagem.id.desc())\
             .limit(limite)\
             .all()
 
+    @staticmethod
+    def _decodificar_cursor(cursor: str) -> Tuple[int, Optional[str]]:
+        """
+        Separa o cursor em (id, criado_em no formato gravado pelo SQLite).
+        Cursores antigos (só o id) vêm sem criado_em.
+        """
+        criado_em, _, id_cursor = cursor.rpartition("-")
+        if not id_cursor.isdigit() or (criado_em and (len(criado_em) != 20 or not criado_em.isdigit())):
+            raise ValueError("Cursor inválido")
+        if not criado_em:
+            return int(id_cursor), None
+        texto = f"{criado_em[:4]}-{criado_em[4:6]}-{criado_em[6:8]} {criado_em[8:10]}:{criado_em[10:12]}:{criado_em[12:14]}"
+        if int(criado_em[14:]):
+            texto += f".{criado_em[14:]}"
+        return int(id_cursor), texto
+
+    @staticmethod
+    def _apos_cursor(db: Session, query, cursor: str):
+        """
+        Restringe a consulta às mensagens depois do cursor na ordem (criado_em, id) decrescente.
+        O criado_em é lido pelo próprio banco, para comparar no mesmo formato gravado; se a
+        mensagem do cursor já não existir (expurgada, arquivada), vale o que veio no cursor.
+        """
+        id_cursor, criado_em_texto = MensagemService._decodificar_cursor(cursor)
+        criado_em_cursor = db.query(Mensagem.criado_em)\
+            .filter(Mensagem.id == id_cursor)\
+            .scalar_subquery()
+        if criado_em_texto is not None:
+            criado_em_cursor = func.coalesce(criado_em_cursor, literal(criado_em_texto, String()))
+        elif not db.query(Mensagem.id).filter(Mensagem.id == id_cursor).first():
+            raise ValueError("Cursor expirado: a mensagem não existe mais; recomece a listagem")
+        return query.filter(or_(
+            Mensagem.criado_em < criado_em_cursor,
+            and_(Mensagem.criado_em == criado_em_cursor, Mensagem.id < id_cursor)
+        ))
+
+    @staticmethod
+    def proximo_cursor(mensagens: List[Mensagem], limite: int) -> Optional[str]:
+        """
+        Cursor da próxima página (None se esta foi a última): `<criado_em>-<id>` da
+        última mensagem, com criado_em em AAAAMMDDhhmmssffffff. Continua válido se
+        essa mensagem for removida.
+        """
+        if not mensagens or len(mensagens) < limite:
+            return None
+        ultima = mensagens[-1]
+        if ultima.criado_em is None:
+            return str(ultima.id)
+        return f"{ultima.criado_em:%Y%m%d%H%M%S%f}-{ultima.id}"
+
+    @staticmethod
+    def listar_historico(
+        db: Session,
+        sessao_id: int,
+        telefone_cliente: str,
+        limite: int = 10,
+        inicio: Optional[int] = None
+    ) -> List:
+        """
+        Mensagens recentes de uma conversa para o histórico do agente (da mais nova
+        para a mais antiga), como cópias leves (TurnoContexto).
+        Usa o cache de contexto; o banco só é consultado quando a conversa não está em
+        cache, carregando apenas as colunas usadas no histórico.
+        `inicio`: início do histórico já conhecido (ver obter_inicio_historico).
+        """
+        from mensagem.mensagem_contexto_service import cache_contexto, TurnoContexto
+        
+        turnos = cache_contexto.obter(sessao_id, telefone_cliente, limite)
+        if turnos is not None:
+            return turnos
+        
+        limite_consulta = max(limite, cache_contexto.mensagens_por_conversa)
+        if inicio is None:
+            inicio = MensagemService.obter_inicio_historico(db, sessao_id, telefone_cliente)
+        colunas = [getattr(Mensagem, campo) for campo in TurnoContexto.__slots__]
+        mensagens = db.query(Mensagem)\
+            .options(load_only(Mensagem.sessao_id, Mensagem.telefone_cliente, *colunas))\
+            .filter(
+                Mensagem.sessao_id == sessao_id,
+                Mensagem.telefone_cliente == telefone_cliente,
+                Mensagem.id > inicio
+            )\
+            .order_by(Mensagem.criado_em.desc(), Mensagem.id.desc())\
+            .limit(limite_consulta)\
+            .all()
+        return cache_contexto.carregar(sessao_id, telefone_cliente, mensagens, limite_consulta, inicio)[:limite]
+
+    @staticmethod
+    def obter_inicio_historico(db: Session, sessao_id: int, telefone_cliente: str) -> int:
+        """
+        Id a partir do qual as mensagens fazem parte do histórico da conversa
+        (as de id menor ou igual foram descartadas por um `#limpar`).
+        """
+        inicio = db.query(EpocaConversa.inicio_mensagem_id).filter(
+            EpocaConversa.sessao_id == sessao_id,
+            EpocaConversa.telefone_cliente == telefone_cliente
+        ).scalar()
+        return inicio or 0
+
+    @staticmethod
+    def reiniciar_historico(db: Session, sessao_id: int, telefone_cliente: str) -> EpocaConversa:
+        """
+        Descarta o histórico da conversa em O(1): avança a época para depois da última
+        mensagem gravada e apaga o resumo. As mensagens antigas saem do histórico na
+        hora e são expurgadas depois pelo `expurgo_historico`.
+        """
+        from mensagem.mensagem_contexto_service import cache_contexto
+        from mensagem.mensagem_historico_service import expurgo_historico
+        
+        # Maior id de toda a tabela: leitura direta do fim do índice da chave primária
+        ultimo_id = db.query(func.max(Mensagem.id)).scalar() or 0
+        epoca = db.query(EpocaConversa).filter(
+            EpocaConversa.sessao_id == sessao_id,
+            EpocaConversa.telefone_cliente == telefone_cliente
+        ).first()
+        if epoca is None:
+            epoca = EpocaConversa(sessao_id=sessao_id, telefone_cliente=telefone_cliente, epoca=0)
+            db.add(epoca)
+        epoca.epoca = (epoca.epoca or 0) + 1
+        epoca.inicio_mensagem_id = ultimo_id
+        epoca.reiniciado_em = datetime.now()
+        epoca.expurgo_pendente = True
+        
+        db.query(ResumoConversa)\
+            .filter(
+                ResumoConversa.sessao_id == sessao_id,
+                ResumoConversa.telefone_cliente == telefone_cliente
+            )\
+            .delete()
+        db.commit()
+        
+        cache_contexto.invalidar(sessao_id, telefone_cliente)
+        expurgo_historico.agendar()
+        return epoca
+
+    @staticmethod
+    def obter_resumo(db: Session, sessao_id: int, telefone_cliente: str) -> Optional[ResumoConversa]:
+        """Resumo acumulado das mensagens da conversa que saíram da janela de contexto."""
+        return db.query(ResumoConversa).filter(
+            ResumoConversa.sessao_id == sessao_id,
+            ResumoConversa.telefone_cliente == telefone_cliente
+        ).first()
+
     @staticmethod
     def obter_por_id(db: Session, mensagem_id: int) -> Optional[Mensagem]:
         """Obtém uma mensagem pelo ID."""
@@ -64,39 +267,110 @@ class MensagemService:
         return db_mensagem
 
     @staticmethod
-    def salvar_imagem(imagem_bytes: bytes, telefone: str, sessao_id: int) -> tuple[str, str]:
+    def salvar_imagem(imagem_bytes: bytes, mime_type: Optional[str] = None) -> Optional[str]:
         """
-        Salva uma imagem localmente e retorna o caminho e base64.
+        Salva uma imagem no armazém de mídias (por conteúdo, sem duplicar arquivos iguais).
+        A mensagem guarda só o hash; a referência deve ser liberada se a mensagem não for salva.
         
         Returns:
-            tuple: (caminho_arquivo, base64_string)
+            Hash da imagem, ou None em caso de erro
         """
-        # Criar diretório se não existir
-        upload_dir = Path("./uploads") / f"sessao_{sessao_id}" / telefone
-        upload_dir.mkdir(parents=True, exist_ok=True)
-        
-        # Gerar nome único para arquivo
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"img_{timestamp}.jpg"
-        filepath = upload_dir / filename
+        from mensagem.mensagem_midia_service import armazem_midia
         
-        # Salvar imagem
         try:
-            # Abrir e converter para RGB (caso seja RGBA)
-            img = Image.open(io.BytesIO(imagem_bytes))
-            if img.mode in ('RGBA', 'LA', 'P'):
-                img = img.convert('RGB')
-            
-            # Salvar
-            img.save(filepath, 'JPEG', quality=85)
-            
-            # Converter para base64
-            base64_string = base64.b64encode(imagem_bytes).decode('utf-8')
-            
-            return str(filepath), base64_string
+            return armazem_midia.salvar(imagem_bytes, mime_type)
         except Exception as e:
             print(f"Erro ao salvar imagem: {e}")
-            return None, None
+            return None
+
+    @staticmethod
+    def obter_imagem_base64(mensagem: Mensagem) -> Optional[str]:
+        """
+        Carrega a imagem da mensagem em base64, só quando o prompt precisa dela.
+        Lê do armazém de mídias; mensagens antigas ainda não migradas usam a coluna legada.
+        """
+        if mensagem.conteudo_midia_hash:
+            from mensagem.mensagem_midia_service import armazem_midia
+            return armazem_midia.ler_base64(mensagem.conteudo_midia_hash)
+        return mensagem.conteudo_imagem_base64
+
+    @staticmethod
+    def obter_imagem_data_url(mensagem: Mensagem, otimizadas: Optional[Dict[str, Path]] = None) -> Optional[str]:
+        """
+        Data URL da imagem para o prompt do LLM.
+        Usa a versão reduzida/recomprimida pelo processador de imagens: a de
+        `otimizadas` (hash -> caminho, resolvidas antes com `processador_imagens.otimizar`)
+        ou a que já estiver em cache. Não processa a imagem aqui (não bloqueia o loop
+        do worker); sem versão otimizada, envia a original.
+        """
+        if mensagem.conteudo_midia_hash:
+            from mensagem.mensagem_imagem_service import processador_imagens
+            otimizada = (otimizadas or {}).get(mensagem.conteudo_midia_hash) or processador_imagens.em_cache(
+                mensagem.conteudo_midia_hash
+            )
+            if otimizada:
+                imagem_base64 = base64.b64encode(otimizada.read_bytes()).decode("utf-8")
+                return f"data:{processador_imagens.MIME_OTIMIZADA};base64,{imagem_base64}"
+
+        imagem_base64 = MensagemService.obter_imagem_base64(mensagem)
+        if not imagem_base64:
+            return None
+        return f"data:{mensagem.conteudo_mime_type or 'image/jpeg'};base64,{imagem_base64}"
+
+    @staticmethod
+    def extrair_telefone_cliente(event: MessageEv) -> str:
+        """Extrai o telefone do remetente de um evento de mensagem."""
+        sender_jid = event.Info.MessageSource.Sender
+        # Converter JID protobuf para string
+        if hasattr(sender_jid, 'User'):
+            return sender_jid.User
+        return str(sender_jid).split('@')[0] if '@' in str(sender_jid) else str(sender_jid)
+
+    @staticmethod
+    def extrair_timestamp(event: MessageEv) -> float:
+        """
+        Horário da mensagem no WhatsApp (Info.Timestamp), em segundos.
+        Aceita o valor em segundos ou milissegundos; sem horário, usa o atual.
+        """
+        timestamp = getattr(event.Info, 'Timestamp', 0) or 0
+        if not timestamp:
+            return time.time()
+        if timestamp > 10 ** 11:  # Milissegundos
+            timestamp = timestamp / 1000
+        return float(timestamp)
+
+    @staticmethod
+    def avancar_marca_dagua(sessao_id: int, enviado_em: datetime):
+        """
+        Avança a marca d'água da sessão (nunca retrocede, mesmo com workers em paralelo).
+        Avança em memória; o banco é atualizado no máximo a cada INTERVALO_GRAVACAO_MARCAS
+        segundos, ao desconectar e no encerramento, e não a cada mensagem.
+        """
+        from sessao.sessao_service import SessaoService, gerenciador_sessoes
+
+        if gerenciador_sessoes.avancar_marca_dagua(sessao_id, enviado_em.timestamp()):
+            SessaoService.gravar_marcas_dagua()
+
+    @staticmethod
+    def ja_recebida(db: Session, sessao_id: int, mensagem_id_whatsapp: Optional[str]) -> bool:
+        """Verifica se uma mensagem do WhatsApp já foi registrada nesta sessão."""
+        if not mensagem_id_whatsapp:
+            return False
+        return db.query(Mensagem.id)\
+            .filter(
+                Mensagem.sessao_id == sessao_id,
+                Mensagem.mensagem_id_whatsapp == mensagem_id_whatsapp
+            )\
+            .first() is not None
+
+    @staticmethod
+    def torna_turno_obsoleto(event: MessageEv) -> bool:
+        """
+        Indica se a mensagem recebida torna obsoleta uma resposta em andamento
+        para o mesmo contato. Comandos (#...) não interrompem o turno atual.
+        """
+        texto = event.Message.conversation if hasattr(event.Message, 'conversation') else ""
+        return not (texto and texto.strip().startswith("#"))
 
     @staticmethod
     async def processar_mensagem_recebida(
@@ -109,24 +383,31 @@ class MensagemService:
         """
         from sessao.sessao_service import SessaoService
         from agente.agente_service import AgenteService
+        from mensagem.mensagem_envio_service import fila_envio
         
         # Obter informações da mensagem
         message = event.Message
         info = event.Info
         
         # Extrair dados do sender
-        sender_jid = info.MessageSource.Sender
-        # Converter JID protobuf para string
-        if hasattr(sender_jid, 'User'):
-            telefone_cliente = sender_jid.User
-        else:
-            telefone_cliente = str(sender_jid).split('@')[0] if '@' in str(sender_jid) else str(sender_jid)
+        telefone_cliente = MensagemService.extrair_telefone_cliente(event)
         
         # Obter sessão
         sessao = SessaoService.obter_por_id(db, sessao_id)
         if not sessao or not sessao.ativa:
             return
         
+        # Reentrega que escapou do LRU (ex.: após reinício): já está no banco
+        if MensagemService.ja_recebida(db, sessao_id, info.ID):
+            from mensagem.mensagem_dedup_service import deduplicador_mensagens
+            deduplicador_mensagens.contar_duplicada_banco()
+            print(f"♻️  Mensagem {info.ID} já registrada, ignorando reentrega")
+            return
+        
+        # Avançar a marca d'água da sessão (filtro de history sync na próxima conexão)
+        enviado_em = datetime.fromtimestamp(MensagemService.extrair_timestamp(event))
+        MensagemService.avancar_marca_dagua(sessao_id, enviado_em)
+        
         # Criar registro de mensagem
         db_mensagem = Mensagem(
             sessao_id=sessao_id,
@@ -134,6 +415,8 @@ class MensagemService:
             mensagem_id_whatsapp=info.ID,
             tipo="texto",
             direcao="recebida",
+            enviado_em=enviado_em,
+            status=STATUS_RECEBIDA,
             processada=False,
             respondida=False
         )
@@ -150,29 +433,22 @@ class MensagemService:
             if comando == "#limpar":
                 print(f"🧹 Comando #limpar recebido de {telefone_cliente}")
                 
-                # Deletar histórico de mensagens deste cliente
-                mensagens_deletadas = db.query(Mensagem)\
-                    .filter(
-                        Mensagem.sessao_id == sessao_id,
-                        Mensagem.telefone_cliente == telefone_cliente
-                    )\
-                    .delete()
-                
-                db.commit()
-                print(f"✅ {mensagens_deletadas} mensagem(ns) deletada(s)")
+                # Nova época do histórico; as mensagens antigas são expurgadas em segundo plano
+                epoca = MensagemService.reiniciar_historico(db, sessao_id, telefone_cliente)
+                print(f"✅ Histórico reiniciado (época {epoca.epoca}, a partir da mensagem {epoca.inicio_mensagem_id + 1})")
                 
                 # Enviar confirmação
                 from sessao.sessao_service import gerenciador_sessoes
                 cliente = gerenciador_sessoes.obter_cliente(sessao_id)
                 
                 if cliente:
-                    from neonize.utils import build_jid
-                    jid = build_jid(telefone_cliente)
-                    cliente.send_message(
-                        jid, 
-                        message="🧹 *Histórico limpo!*\n\nSeu histórico de conversas foi apagado.\nVamos começar uma nova conversa! 🆕"
+                    fila_envio.enviar(
+                        sessao_id,
+                        telefone_cliente,
+                        "🧹 *Histórico limpo!*\n\nSeu histórico de conversas foi apagado.\nVamos começar uma nova conversa! 🆕",
+                        descricao=f"#limpar / {telefone_cliente}"
                     )
-                    print(f"📤 Confirmação enviada ao usuário")
+                    print(f"📤 Confirmação enfileirada para o usuário")
                 
                 return  # Não processar com agente
 
@@ -183,9 +459,6 @@ class MensagemService:
                 cliente = gerenciador_sessoes.obter_cliente(sessao_id)
                 
                 if cliente:
-                    from neonize.utils import build_jid
-                    jid = build_jid(telefone_cliente)
-                    
                     ajuda_texto = """📚 *Comandos Disponíveis:*
 
 🤖 *#listar* - Lista todos os agentes disponíveis
@@ -196,19 +469,20 @@ class MensagemService:
 
 💬 Para conversar normalmente, basta enviar sua mensagem!"""
                     
-                    cliente.send_message(jid, message=ajuda_texto)
-                    print(f"📤 Ajuda enviada ao usuário")
+                    fila_envio.enviar(sessao_id, telefone_cliente, ajuda_texto, descricao=f"#ajuda / {telefone_cliente}")
+                    print(f"📤 Ajuda enfileirada para o usuário")
                 
                 return  # Não processar com agente
             
             elif comando == "#status":
                 print(f"📊 Comando #status recebido de {telefone_cliente}")
                 
-                # Contar mensagens do usuário
+                # Contar mensagens do usuário (desde o último #limpar)
                 total_msgs = db.query(Mensagem)\
                     .filter(
                         Mensagem.sessao_id == sessao_id,
-                        Mensagem.telefone_cliente == telefone_cliente
+                        Mensagem.telefone_cliente == telefone_cliente,
+                        Mensagem.id > MensagemService.obter_inicio_historico(db, sessao_id, telefone_cliente)
                     )\
                     .count()
                 
@@ -216,10 +490,6 @@ class MensagemService:
                 cliente = gerenciador_sessoes.obter_cliente(sessao_id)
                 
                 if cliente:
-                    from neonize.utils import build_jid
-                    from agente.agente_service import AgenteService
-                    jid = build_jid(telefone_cliente)
-                    
                     # Obter agente ativo
                     agente_nome = "Nenhum"
                     if sessao.agente_ativo_id:
@@ -235,8 +505,8 @@ class MensagemService:
 
 Digite *#ajuda* para ver comandos disponíveis."""
                     
-                    cliente.send_message(jid, message=status_texto)
-                    print(f"📤 Status enviado ao usuário")
+                    fila_envio.enviar(sessao_id, telefone_cliente, status_texto, descricao=f"#status / {telefone_cliente}")
+                    print(f"📤 Status enfileirado para o usuário")
                 
                 return  # Não processar com agente    
             # Comando para listar agentes
@@ -250,9 +520,6 @@ Digite *#ajuda* para ver comandos disponíveis."""
                 cliente = gerenciador_sessoes.obter_cliente(sessao_id)
                 
                 if cliente:
-                    from neonize.utils import build_jid
-                    jid = build_jid(telefone_cliente)
-                    
                     if agentes:
                         lista_texto = "🤖 *Agentes Disponíveis:*\n\n"
                         for agente in agentes:
@@ -270,8 +537,8 @@ Digite *#ajuda* para ver comandos disponíveis."""
                         lista_texto = "⚠️ *Nenhum agente disponível*\n\n"
                         lista_texto += "Entre em contato com o administrador para configurar agentes."
                     
-                    cliente.send_message(jid, message=lista_texto)
-                    print(f"📤 Lista de agentes enviada ao usuário")
+                    fila_envio.enviar(sessao_id, telefone_cliente, lista_texto, descricao=f"#listar / {telefone_cliente}")
+                    print(f"📤 Lista de agentes enfileirada para o usuário")
                 
                 return  # Não processar com agente
             
@@ -292,29 +559,23 @@ Digite *#ajuda* para ver comandos disponíveis."""
                     db.commit()
                     
                     if cliente:
-                        from neonize.utils import build_jid
-                        jid = build_jid(telefone_cliente)
-                        
                         confirmacao = f"✅ *Agente Ativado!*\n\n"
                         confirmacao += f"🤖 *{agente.nome}*\n"
                         if agente.descricao:
                             confirmacao += f"_{agente.descricao}_\n\n"
                         confirmacao += f"Agora estou pronto para ajudar como {agente.agente_papel}!"
                         
-                        cliente.send_message(jid, message=confirmacao)
+                        fila_envio.enviar(sessao_id, telefone_cliente, confirmacao, descricao=f"#{agente.codigo} / {telefone_cliente}")
                         print(f"✅ Agente {agente.codigo} ativado para sessão {sessao_id}")
                     
                     return  # Não processar com agente
                 elif cliente:
                     # Agente não encontrado
-                    from neonize.utils import build_jid
-                    jid = build_jid(telefone_cliente)
-                    
                     erro_msg = f"❌ *Agente não encontrado*\n\n"
                     erro_msg += f"O código *#{codigo_agente}* não corresponde a nenhum agente ativo.\n\n"
                     erro_msg += "Digite *#listar* para ver os agentes disponíveis."
                     
-                    cliente.send_message(jid, message=erro_msg)
+                    fila_envio.enviar(sessao_id, telefone_cliente, erro_msg, descricao=f"#{codigo_agente} / {telefone_cliente}")
                     print(f"⚠️ Agente {codigo_agente} não encontrado")
                     
                     return  # Não processar com agente
@@ -329,124 +590,643 @@ Digite *#ajuda* para ver comandos disponíveis."""
             db_mensagem.conteudo_texto = message.imageMessage.caption if hasattr(message.imageMessage, 'caption') else ""
             print(f"🖼️  Mensagem com imagem")
             
-            # Baixar imagem
+            # Baixar imagem (só se o agente tiver um modelo capaz de vê-la)
             try:
                 from sessao.sessao_service import gerenciador_sessoes
                 cliente = gerenciador_sessoes.obter_cliente(sessao_id)
                 
+                agente = AgenteService.obter_por_id(db, sessao.agente_ativo_id) if sessao.agente_ativo_id else None
+                if agente and not await AgenteService.obter_modelo_visao(db, agente):
+                    print("🙈 Agente sem modelo com visão: download da imagem ignorado")
+                    cliente = None
+                
                 if cliente:
                     # Download da imagem usando download_any
                     imagem_bytes = cliente.download_any(message)
                     
                     if imagem_bytes:
-                        # Salvar imagem
-                        caminho, base64_str = MensagemService.salvar_imagem(
-                            imagem_bytes,
-                            telefone_cliente,
-                            sessao_id
-                        )
+                        # Salvar imagem no armazém de mídias (a mensagem guarda só o hash)
+                        mime_type = message.imageMessage.mimetype or "image/jpeg"
+                        hash_midia = MensagemService.salvar_imagem(imagem_bytes, mime_type)
                         
-                        if caminho:
-                            db_mensagem.conteudo_imagem_path = caminho
-                            db_mensagem.conteudo_imagem_base64 = base64_str
-                            db_mensagem.conteudo_mime_type = message.image_message.mime_type
+                        if hash_midia:
+                            from mensagem.mensagem_midia_service import armazem_midia
+                            db_mensagem.conteudo_midia_hash = hash_midia
+                            db_mensagem.conteudo_imagem_path = str(armazem_midia.caminho(hash_midia))
+                            db_mensagem.conteudo_mime_type = mime_type
+                            # Gera já a versão otimizada para o LLM (fica em cache para o turno)
+                            from mensagem.mensagem_imagem_service import processador_imagens
+                            await processador_imagens.otimizar(hash_midia)
             except Exception as e:
                 print(f"Erro ao baixar imagem: {e}")
         
-        # Salvar mensagem
+        # Salvar mensagem (já como enfileirada se o agente vai responder)
+        if sessao.auto_responder:
+            db_mensagem.status = STATUS_ENFILEIRADA
         db.add(db_mensagem)
-        db.commit()
+        try:
+            db.commit()
+        except IntegrityError:
+            # Mesma mensagem gravada em paralelo (índice único sessão + ID do WhatsApp)
+            db.rollback()
+            from mensagem.mensagem_dedup_service import deduplicador_mensagens
+            from mensagem.mensagem_midia_service import armazem_midia
+            armazem_midia.liberar([db_mensagem.conteudo_midia_hash])
+            deduplicador_mensagens.contar_duplicada_banco()
+            print(f"♻️  Mensagem {info.ID} já registrada, ignorando reentrega")
+            return
         db.refresh(db_mensagem)
         
-        # Se auto-responder está ativo, processar com agente
+        from mensagem.mensagem_contexto_service import cache_contexto
+        cache_contexto.registrar(db_mensagem)
+        
+        # Se auto-responder está ativo, agendar o turno do agente
         if sessao.auto_responder:
-            try:
-                # Obter histórico de mensagens do cliente
-                historico = MensagemService.listar_por_cliente(
+            MensagemService.agendar_resposta(sessao, telefone_cliente)
+
+    @staticmethod
+    def listar_pendentes(
+        db: Session,
+        sessao_id: int,
+        telefone_cliente: str,
+        inicio: Optional[int] = None
+    ) -> List[Mensagem]:
+        """
+        Lista mensagens recebidas de um cliente que ainda aguardam resposta do agente,
+        em ordem de chegada. Mensagens antigas demais não são mais respondidas.
+        `inicio`: início do histórico já conhecido (ver obter_inicio_historico).
+        """
+        if inicio is None:
+            inicio = MensagemService.obter_inicio_historico(db, sessao_id, telefone_cliente)
+        agora = datetime.now()
+        data_limite = agora - IDADE_MAXIMA_PENDENTE
+        pendentes = db.query(Mensagem)\
+            .filter(
+                Mensagem.sessao_id == sessao_id,
+                Mensagem.telefone_cliente == telefone_cliente,
+                # Mensagens anteriores ao último #limpar não são mais respondidas
+                Mensagem.id > inicio,
+                Mensagem.direcao == "recebida",
+                Mensagem.processada == False,
+                Mensagem.criado_em >= data_limite,
+                # Mensagens em um turno com lease válido pertencem a outro worker/instância
+                or_(
+                    Mensagem.status.is_(None),
+                    Mensagem.status != STATUS_PROCESSANDO,
+                    Mensagem.lease_expira_em.is_(None),
+                    Mensagem.lease_expira_em < agora
+                )
+            )\
+            .order_by(Mensagem.id.desc())\
+            .limit(MAX_MENSAGENS_AGRUPADAS)\
+            .all()
+        return list(reversed(pendentes))
+
+    @staticmethod
+    def descartar_atrasadas(db: Session, sessao_id: int, pendentes: List[Mensagem]) -> List[Mensagem]:
+        """
+        Política de recuperação "ultima": das mensagens enviadas enquanto a sessão
+        estava offline, só a mais recente de cada contato é respondida. As demais
+        ficam registradas no histórico como ignoradas.
+        """
+        from sessao.sessao_service import gerenciador_sessoes, TOLERANCIA_RELOGIO
+
+        conectado_em = gerenciador_sessoes.conectado_em.get(sessao_id)
+        if not conectado_em or len(pendentes) < 2:
+            return pendentes
+
+        limite = datetime.fromtimestamp(conectado_em - TOLERANCIA_RELOGIO)
+        ultima = pendentes[-1]
+        descartadas = [
+            m for m in pendentes[:-1]
+            if m.enviado_em and m.enviado_em < limite
+        ]
+        if not descartadas:
+            return pendentes
+
+        for mensagem in descartadas:
+            mensagem.status = STATUS_IGNORADA
+            mensagem.processada = True
+            mensagem.processado_em = datetime.now()
+            mensagem.contexto = {"ignorada": "recuperacao", "respondida_em": ultima.id}
+        db.commit()
+        print(f"⏭️  {len(descartadas)} mensagem(ns) atrasada(s) de {ultima.telefone_cliente} ignorada(s) (política: ultima)")
+
+        ids_descartadas = {m.id for m in descartadas}
+        return [m for m in pendentes if m.id not in ids_descartadas]
+
+    @staticmethod
+    def agendar_resposta(sessao, telefone_cliente: str, atraso: Optional[float] = None):
+        """
+        Agenda o turno do agente na raia da conversa.
+
+        Sem janela de agrupamento, o turno entra na raia logo após a mensagem; com
+        janela, cada nova mensagem do contato reinicia a espera. Em ambos os casos o
+        turno responde de uma vez todas as mensagens pendentes do contato.
+        Com `atraso`, o turno é adiado por esse tempo (ex.: aguardando vaga).
+        """
+        from mensagem.mensagem_fila_service import fila_processamento
+
+        sessao_id = sessao.id
+        chave = (sessao_id, telefone_cliente)
+        descricao = f"sessao {sessao_id} / {telefone_cliente} / turno do agente"
+
+        async def tarefa(db_worker: Session):
+            await MensagemService.responder_conversa(db_worker, sessao_id, telefone_cliente)
+
+        janela = sessao.janela_agrupamento_segundos or 0
+        if atraso:
+            fila_processamento.agendar(
+                tarefa,
+                atraso=atraso,
+                chave=chave,
+                descricao=descricao,
+                cancelavel=True
+            )
+        elif janela > 0:
+            fila_processamento.agendar(
+                tarefa,
+                atraso=janela,
+                chave=chave,
+                descricao=descricao,
+                atraso_maximo=janela * FATOR_ESPERA_MAXIMA_AGRUPAMENTO,
+                cancelavel=True
+            )
+        else:
+            fila_processamento.enviar(tarefa, descricao=descricao, chave=chave, cancelavel=True)
+
+    @staticmethod
+    async def responder_conversa(db: Session, sessao_id: int, telefone_cliente: str):
+        """
+        Responde as mensagens pendentes de uma conversa, respeitando os limites de
+        turnos simultâneos da sessão e global (controle de admissão).
+
+        Sem vaga, o turno é adiado sem ocupar o worker; se a espera passar do limite
+        configurado, o contato recebe um aviso de que a resposta vai demorar.
+        """
+        from agente.agente_turno_service import ContextoTurno
+        from mensagem.mensagem_admissao_service import controle_admissao
+
+        chave = (sessao_id, telefone_cliente)
+        # Sessão, agente ativo, início do histórico e resumo em uma consulta
+        contexto = ContextoTurno.carregar(db, sessao_id, telefone_cliente)
+        sessao = contexto.sessao if contexto else None
+        if not sessao or not sessao.ativa or not sessao.auto_responder:
+            controle_admissao.desistir(chave)
+            return
+
+        pendentes = MensagemService.listar_pendentes(
+            db, sessao_id, telefone_cliente, inicio=contexto.inicio_historico
+        )
+        if sessao.politica_recuperacao == "ultima":
+            pendentes = MensagemService.descartar_atrasadas(db, sessao_id, pendentes)
+        if not pendentes:
+            controle_admissao.desistir(chave)
+            return  # Já respondidas por um turno anterior
+
+        admissao = controle_admissao.admitir(chave, sessao_id, sessao.max_turnos_simultaneos or 0)
+        if not admissao["admitido"]:
+            print(f"🚦 Limite de turnos ({admissao['motivo']}) atingido, adiando resposta para {telefone_cliente}")
+            if admissao["avisar"]:
+                MensagemService.enviar_aviso_ocupado(db, sessao_id, telefone_cliente)
+            MensagemService.agendar_resposta(sessao, telefone_cliente, atraso=controle_admissao.intervalo_retentativa)
+            return
+
+        try:
+            await MensagemService.executar_turno(db, sessao, pendentes, contexto)
+        finally:
+            controle_admissao.liberar(sessao_id)
+
+    @staticmethod
+    def enviar_aviso_ocupado(db: Session, sessao_id: int, telefone_cliente: str):
+        """Envia ao contato a mensagem padrão de sistema ocupado."""
+        from config.config_service import ConfiguracaoService
+        from sessao.sessao_service import gerenciador_sessoes
+
+        from mensagem.mensagem_envio_service import fila_envio
+
+        cliente = gerenciador_sessoes.obter_cliente(sessao_id)
+        if not cliente:
+            return
+
+        try:
+            aviso = ConfiguracaoService.obter_valor(
+                db,
+                "processamento_mensagem_ocupado",
+                "⏳ Estamos com muitas conversas no momento. Recebemos sua mensagem e você terá uma resposta em breve!"
+            )
+            fila_envio.enviar(sessao_id, telefone_cliente, aviso, descricao=f"aviso de ocupado / {telefone_cliente}")
+            print(f"📤 Aviso de ocupado enfileirado para {telefone_cliente}")
+        except Exception as e:
+            print(f"❌ Erro ao enviar aviso de ocupado: {e}")
+
+    @staticmethod
+    async def executar_turno(db: Session, sessao, pendentes: List[Mensagem], contexto=None):
+        """
+        Executa um turno do agente para uma conversa.
+        Todas as mensagens pendentes do contato entram no mesmo prompt e recebem
+        uma única resposta, registrada na mensagem mais recente.
+
+        O turno pode ser cancelado por uma nova mensagem do contato enquanto o agente
+        trabalha: a mensagem fica pendente com MOTIVO_TURNO_CANCELADO e as
+        ferramentas já executadas, que o próximo turno reaproveita.
+
+        Estados no diário: as mensagens passam a "processando" (com lease renovada
+        durante o turno), a resposta é salva como "enviando" antes de ir para a fila
+        de envio e só depois do envio a mensagem fica "respondida" (confirmar_envio).
+        Um reinício no meio do envio nunca gera resposta duplicada (ver recuperar_pendentes).
+        O worker não espera o envio: ele segue para a próxima conversa.
+
+        O contato vê "digitando..." durante o turno. Com `processamento_resposta_streaming`,
+        o LLM responde em streaming e cada parágrafo concluído já vai para a fila de envio
+        (EntregaProgressiva); ao sair o primeiro, as mensagens passam a "enviando" e o
+        turno deixa de ser cancelável.
+
+        `contexto` é o ContextoTurno carregado por responder_conversa (sessão, agente,
+        início do histórico, resumo), passado até a chamada ao LLM.
+        """
+        from agente.agente_service import AgenteService
+        from config.config_service import ConfiguracaoService
+        from mensagem.mensagem_fila_service import fila_processamento
+        from mensagem.mensagem_envio_service import fila_envio
+        from mensagem.mensagem_entrega_service import EntregaProgressiva
+        from mensagem.mensagem_segundo_plano_service import tarefas_segundo_plano
+        from mensagem.mensagem_contexto_service import cache_contexto
+
+        sessao_id = sessao.id
+        db_mensagem = pendentes[-1]
+        telefone_cliente = db_mensagem.telefone_cliente
+        agrupadas = pendentes[:-1]
+        ids_turno = {m.id for m in pendentes}
+        if agrupadas:
+            print(f"🧩 Agrupando {len(pendentes)} mensagens de {telefone_cliente} em um único turno")
+
+        def finalizar_agrupadas():
+            """Marca as mensagens agrupadas como tratadas junto com a principal."""
+            db_mensagem.lease_dono = None
+            db_mensagem.lease_expira_em = None
+            for agrupada in agrupadas:
+                agrupada.status = db_mensagem.status
+                agrupada.lease_dono = None
+                agrupada.lease_expira_em = None
+                agrupada.processada = True
+                agrupada.processado_em = db_mensagem.processado_em
+                agrupada.respondida = db_mensagem.respondida
+                agrupada.respondido_em = db_mensagem.respondido_em
+                agrupada.contexto = {"agrupada_em": db_mensagem.id}
+
+        # Resultados de ferramentas de turnos cancelados ainda pendentes
+        resultados_reaproveitaveis = {}
+        for pendente in pendentes:
+            if pendente.resposta_erro == MOTIVO_TURNO_CANCELADO:
+                resultados_reaproveitaveis.update(
+                    AgenteService.extrair_resultados_reaproveitaveis(pendente.ferramentas_usadas)
+                )
+        ferramentas_executadas = []
+
+        def iniciar_entrega():
+            """O primeiro parágrafo vai sair: o turno não pode mais ser cancelado nem refeito."""
+            fila_processamento.impedir_cancelamento((sessao_id, telefone_cliente))
+            for pendente in pendentes:
+                pendente.status = STATUS_ENVIANDO
+            db.commit()
+
+        entrega = EntregaProgressiva(
+            sessao_id,
+            telefone_cliente,
+            descricao=f"resposta / {telefone_cliente} / msg {db_mensagem.id}",
+            ao_iniciar=iniciar_entrega
+        )
+        streaming = ConfiguracaoService.obter_valor(db, "processamento_resposta_streaming", True)
+
+        # Reivindicar as mensagens do turno e manter a lease enquanto ele executa
+        MensagemService.iniciar_processamento(db, pendentes)
+        renovacao_lease = asyncio.ensure_future(MensagemService.manter_lease(list(ids_turno)))
+
+        try:
+            entrega.iniciar_digitando()
+            
+            # Obter histórico de mensagens do cliente (sem as mensagens deste turno);
+            # o agente usa as que couberem no orçamento de tokens
+            historico = [
+                m for m in MensagemService.listar_historico(
                     db,
                     sessao_id,
                     telefone_cliente,
-                    limite=10
+                    limite=cache_contexto.mensagens_por_conversa,
+                    inicio=contexto.inicio_historico if contexto else None
                 )
+                if m.id not in ids_turno
+            ]
+            
+            # Processar com agente
+            resposta = await AgenteService.processar_mensagem(
+                db,
+                sessao,
+                db_mensagem,
+                historico,
+                mensagens_agrupadas=agrupadas,
+                ferramentas_executadas=ferramentas_executadas,
+                resultados_reaproveitaveis=resultados_reaproveitaveis,
+                contexto=contexto,
+                ao_receber_texto=entrega.receber if streaming else None
+            )
+            
+            # A partir daqui a resposta será entregue: não pode mais ser cancelada
+            fila_processamento.impedir_cancelamento((sessao_id, telefone_cliente))
+            
+            # Atualizar mensagem com resposta (com streaming, inclui parágrafos de iterações
+            # anteriores que já foram enviados)
+            texto_resposta = entrega.texto_entregue(resposta.get("texto") or "")
+            db_mensagem.resposta_texto = texto_resposta
+            db_mensagem.resposta_tokens_input = resposta.get("tokens_input")
+            db_mensagem.resposta_tokens_output = resposta.get("tokens_output")
+            db_mensagem.resposta_tempo_ms = resposta.get("tempo_ms")
+            db_mensagem.resposta_modelo = resposta.get("modelo")
+            db_mensagem.ferramentas_usadas = resposta.get("ferramentas")
+            db_mensagem.resposta_erro = None
+            db_mensagem.processada = True
+            db_mensagem.processado_em = datetime.now()
+            db_mensagem.status = STATUS_RESPONDIDA
+            
+            # Enviar resposta
+            if texto_resposta:
+                from sessao.sessao_service import gerenciador_sessoes
+                cliente = gerenciador_sessoes.obter_cliente(sessao_id)
                 
-                # Processar com agente
-                resposta = await AgenteService.processar_mensagem(
-                    db,
-                    sessao,
-                    db_mensagem,
-                    historico
+                if cliente:
+                    # Registrar a resposta antes de enviar: um reinício daqui em diante não reenvia
+                    db_mensagem.status = STATUS_ENVIANDO
+                else:
+                    db_mensagem.status = STATUS_ERRO
+                    db_mensagem.resposta_erro = "Sessão desconectada: resposta não enviada"
+            
+            finalizar_agrupadas()
+            db.commit()
+            cache_contexto.registrar(db_mensagem)
+            
+            # Descrever as imagens do turno para os próximos turnos não as reenviarem
+            ids_imagens = [m.id for m in pendentes if m.tipo == "imagem" and not m.conteudo_imagem_descricao]
+            if ids_imagens and resposta.get("visao"):
+                # No loop de segundo plano: o do worker para quando o turno termina
+                tarefas_segundo_plano.agendar(
+                    AgenteService.descrever_imagens(ids_imagens, resposta.get("modelo"), resposta.get("agente_id")),
+                    descricao=f"descrição de imagens / msg {db_mensagem.id}"
                 )
-                
-                # Atualizar mensagem com resposta
-                db_mensagem.resposta_texto = resposta.get("texto")
-                db_mensagem.resposta_tokens_input = resposta.get("tokens_input")
-                db_mensagem.resposta_tokens_output = resposta.get("tokens_output")
-                db_mensagem.resposta_tempo_ms = resposta.get("tempo_ms")
-                db_mensagem.resposta_modelo = resposta.get("modelo")
-                db_mensagem.ferramentas_usadas = resposta.get("ferramentas")
+            
+            # Incorporar ao resumo as mensagens que saíram da janela de contexto (se alguma
+            # saiu desde o último resumo)
+            if resposta.get("resumir_antes_de") is not None:
+                tarefas_segundo_plano.agendar(
+                    AgenteService.atualizar_resumo(
+                        sessao_id, telefone_cliente, resposta["resumir_antes_de"], resposta.get("agente_id")
+                    ),
+                    descricao=f"resumo / {telefone_cliente}"
+                )
+            
+            if db_mensagem.status == STATUS_ENVIANDO:
+                # O que ainda não saiu durante a geração (ou a resposta inteira, sem streaming)
+                entrega.concluir(
+                    resposta.get("texto") or "",
+                    ao_concluir=functools.partial(
+                        MensagemService.confirmar_envio, db_mensagem.id, [m.id for m in agrupadas]
+                    )
+                )
+            
+        except asyncio.CancelledError:
+            db.rollback()
+            if entrega.iniciada:
+                # Parte da resposta já saiu: refazer o turno repetiria os parágrafos enviados
+                print(f"🛑 Turno de {telefone_cliente} interrompido durante a entrega da resposta")
+                db_mensagem.resposta_erro = "Turno interrompido durante a entrega da resposta"
                 db_mensagem.processada = True
                 db_mensagem.processado_em = datetime.now()
-                
-                # Enviar resposta
-                if resposta.get("texto"):
-                    from sessao.sessao_service import gerenciador_sessoes
-                    cliente = gerenciador_sessoes.obter_cliente(sessao_id)
-                    
-                    if cliente:
-                        from neonize.utils import build_jid
-                        jid = build_jid(telefone_cliente)
-                        # Parâmetro correto: message (str ou Message object)
-                        cliente.send_message(jid, message=resposta["texto"])
-                        
-                        db_mensagem.respondida = True
-                        db_mensagem.respondido_em = datetime.now()
-                
+                db_mensagem.status = STATUS_ERRO
+                finalizar_agrupadas()
                 db.commit()
+                raise
+            
+            print(f"🛑 Turno de {telefone_cliente} cancelado por nova mensagem")
+            
+            # Registrar o cancelamento e o trabalho já feito; as mensagens continuam pendentes
+            db_mensagem.resposta_erro = MOTIVO_TURNO_CANCELADO
+            if ferramentas_executadas:
+                db_mensagem.ferramentas_usadas = ferramentas_executadas
+            for pendente in pendentes:
+                pendente.status = STATUS_ENFILEIRADA
+                pendente.lease_dono = None
+                pendente.lease_expira_em = None
+            db.commit()
+            
+            # Garantir um novo turno para as mensagens pendentes
+            MensagemService.agendar_resposta(sessao, telefone_cliente)
+            raise
+            
+        except Exception as e:
+            print(f"Erro ao processar mensagem com agente: {e}")
+            
+            # Salvar erro no banco antes de avisar o usuário (um reinício não repete o aviso)
+            db.rollback()
+            db_mensagem.resposta_erro = str(e)
+            db_mensagem.processada = True
+            db_mensagem.processado_em = datetime.now()
+            db_mensagem.status = STATUS_ERRO
+            finalizar_agrupadas()
+            db.commit()
+            
+            # Enviar mensagem de erro amigável para o usuário
+            try:
+                from sessao.sessao_service import gerenciador_sessoes
+                cliente = gerenciador_sessoes.obter_cliente(sessao_id)
                 
-            except Exception as e:
-                print(f"Erro ao processar mensagem com agente: {e}")
-                
-                # Salvar erro no banco
-                db_mensagem.resposta_erro = str(e)
-                db_mensagem.processada = True
-                db_mensagem.processado_em = datetime.now()
-                
-                # Enviar mensagem de erro amigável para o usuário
-                try:
-                    from sessao.sessao_service import gerenciador_sessoes
-                    cliente = gerenciador_sessoes.obter_cliente(sessao_id)
+                if cliente:
+                    # Mensagem de erro amigável
+                    erro_msg = f"❌ *Erro ao processar sua mensagem*\n\n"
                     
-                    if cliente:
-                        from neonize.utils import build_jid
-                        jid = build_jid(telefone_cliente)
-                        
-                        # Mensagem de erro amigável
-                        erro_msg = f"❌ *Erro ao processar sua mensagem*\n\n"
-                        
-                        # Identificar tipo de erro
-                        erro_str = str(e).lower()
-                        if "api key" in erro_str or "openrouter" in erro_str:
-                            erro_msg += "⚙️ O sistema não está configurado corretamente.\n"
-                            erro_msg += "Por favor, contate o administrador."
-                        elif "timeout" in erro_str or "connection" in erro_str:
-                            erro_msg += "🌐 Problema de conexão com o servidor.\n"
-                            erro_msg += "Tente novamente em alguns instantes."
-                        elif "rate limit" in erro_str:
-                            erro_msg += "⏱️ Muitas requisições.\n"
-                            erro_msg += "Aguarde um momento e tente novamente."
-                        else:
-                            erro_msg += f"🔧 Erro técnico: {str(e)[:100]}\n"
-                            erro_msg += "Por favor, tente novamente ou contate o suporte."
-                        
-                        cliente.send_message(jid, message=erro_msg)
-                        print(f"📤 Mensagem de erro enviada ao usuário")
-                        
-                        db_mensagem.respondida = True
-                        db_mensagem.respondido_em = datetime.now()
-                except Exception as send_error:
-                    print(f"❌ Erro ao enviar mensagem de erro: {send_error}")
-                
+                    # Identificar tipo de erro
+                    erro_str = str(e).lower()
+                    if "api key" in erro_str or "openrouter" in erro_str:
+                        erro_msg += "⚙️ O sistema não está configurado corretamente.\n"
+                        erro_msg += "Por favor, contate o administrador."
+                    elif "timeout" in erro_str or "connection" in erro_str:
+                        erro_msg += "🌐 Problema de conexão com o servidor.\n"
+                        erro_msg += "Tente novamente em alguns instantes."
+                    elif "rate limit" in erro_str:
+                        erro_msg += "⏱️ Muitas requisições.\n"
+                        erro_msg += "Aguarde um momento e tente novamente."
+                    else:
+                        erro_msg += f"🔧 Erro técnico: {str(e)[:100]}\n"
+                        erro_msg += "Por favor, tente novamente ou contate o suporte."
+                    
+                    fila_envio.enviar(
+                        sessao_id,
+                        telefone_cliente,
+                        erro_msg,
+                        descricao=f"erro / {telefone_cliente} / msg {db_mensagem.id}",
+                        ao_concluir=functools.partial(
+                            MensagemService.confirmar_envio, db_mensagem.id, [m.id for m in agrupadas]
+                        )
+                    )
+                    print(f"📤 Mensagem de erro enfileirada para o usuário")
+            except Exception as send_error:
+                print(f"❌ Erro ao enviar mensagem de erro: {send_error}")
+        
+        finally:
+            renovacao_lease.cancel()
+            entrega.encerrar()
+
+    @staticmethod
+    def confirmar_envio(
+        mensagem_id: int,
+        ids_agrupadas: List[int],
+        respostas: list,
+        erro: Optional[Exception]
+    ):
+        """
+        Registra o resultado do envio da resposta de um turno. Chamado pela fila de
+        envio ao concluir (usa sua própria sessão do banco).
+
+        Mensagens "enviando" passam a "respondida" ou "erro"; mensagens já em "erro"
+        (aviso de falha do agente) só registram se o aviso chegou ao contato.
+        """
+        from database import SessionLocal
+
+        db = SessionLocal()
+        try:
+            mensagens = db.query(Mensagem)\
+                .filter(
+                    Mensagem.id.in_([mensagem_id] + list(ids_agrupadas)),
+                    Mensagem.status.in_([STATUS_ENVIANDO, STATUS_ERRO])
+                )\
+                .all()
+            agora = datetime.now()
+            for mensagem in mensagens:
+                if erro is None:
+                    if mensagem.status == STATUS_ENVIANDO:
+                        mensagem.status = STATUS_RESPONDIDA
+                    mensagem.respondida = True
+                    mensagem.respondido_em = agora
+                elif mensagem.status == STATUS_ENVIANDO:
+                    mensagem.status = STATUS_ERRO
+                    if mensagem.id == mensagem_id:
+                        mensagem.resposta_erro = f"Falha no envio: {erro}"
+
+                if mensagem.id == mensagem_id and respostas:
+                    mensagem.resposta_id_whatsapp = getattr(respostas[0], "ID", None) or None
+            db.commit()
+        finally:
+            db.close()
+
+    @staticmethod
+    def iniciar_processamento(db: Session, mensagens: List[Mensagem]):
+        """Marca as mensagens do turno como em processamento por esta instância (lease)."""
+        expira_em = datetime.now() + DURACAO_LEASE
+        for mensagem in mensagens:
+            mensagem.status = STATUS_PROCESSANDO
+            mensagem.lease_dono = INSTANCIA_ID
+            mensagem.lease_expira_em = expira_em
+        db.commit()
+
+    @staticmethod
+    async def manter_lease(ids_mensagens: List[int]):
+        """
+        Renova periodicamente a lease das mensagens de um turno em execução.
+        Usa uma sessão própria do banco para não interferir na sessão do turno.
+        """
+        from database import SessionLocal
+
+        while True:
+            await asyncio.sleep(DURACAO_LEASE.total_seconds() / 3)
+            db = SessionLocal()
+            try:
+                db.query(Mensagem)\
+                    .filter(
+                        Mensagem.id.in_(ids_mensagens),
+                        Mensagem.status == STATUS_PROCESSANDO,
+                        Mensagem.lease_dono == INSTANCIA_ID
+                    )\
+                    .update(
+                        {Mensagem.lease_expira_em: datetime.now() + DURACAO_LEASE},
+                        synchronize_session=False
+                    )
                 db.commit()
+            except Exception as e:
+                print(f"⚠️  Erro ao renovar lease do turno: {e}")
+                db.rollback()
+            finally:
+                db.close()
+
+    @staticmethod
+    def recuperar_pendentes(db: Session) -> int:
+        """
+        Retoma, após um reinício, os turnos que ficaram sem resposta.
+
+        - "enfileirada" e "processando" (lease expirada ou de outra instância):
+          a conversa volta para a fila, depois de dar tempo às sessões de reconectar
+        - "enviando": o envio pode ter acontecido; a mensagem é marcada como erro
+          em vez de reenviada, para nunca responder duas vezes
+        - Mensagens antigas demais ou interrompidas MAX_TENTATIVAS_TURNO vezes
+          são encerradas como erro
+
+        Returns:
+            Número de conversas reagendadas
+        """
+        from sessao.sessao_service import SessaoService
+
+        agora = datetime.now()
+        data_limite = agora - IDADE_MAXIMA_PENDENTE
+
+        interrompidas = db.query(Mensagem)\
+            .filter(
+                Mensagem.direcao == "recebida",
+                Mensagem.status.in_([STATUS_ENFILEIRADA, STATUS_PROCESSANDO, STATUS_ENVIANDO])
+            )\
+            .all()
+
+        conversas = {}
+        for mensagem in interrompidas:
+            if mensagem.status == STATUS_PROCESSANDO and mensagem.lease_dono == INSTANCIA_ID:
+                continue  # Turno em andamento nesta instância
+
+            erro = None
+            if mensagem.status == STATUS_ENVIANDO:
+                erro = "Envio interrompido por reinício; resposta não reenviada para evitar duplicidade"
+            elif mensagem.criado_em and mensagem.criado_em.replace(tzinfo=None) < data_limite:
+                erro = "Mensagem expirada sem resposta"
+            elif mensagem.status == STATUS_PROCESSANDO:
+                mensagem.tentativas = (mensagem.tentativas or 0) + 1
+                if mensagem.tentativas >= MAX_TENTATIVAS_TURNO:
+                    erro = f"Turno interrompido {mensagem.tentativas} vezes; mensagem descartada"
+
+            if erro:
+                mensagem.status = STATUS_ERRO
+                mensagem.resposta_erro = erro
+                mensagem.processada = True
+                mensagem.processado_em = agora
+                mensagem.lease_dono = None
+                mensagem.lease_expira_em = None
+                continue
+
+            # Esperar a lease de outra instância expirar antes de retomar
+            atraso = ATRASO_RECUPERACAO
+            if mensagem.status == STATUS_PROCESSANDO and mensagem.lease_expira_em:
+                restante = (mensagem.lease_expira_em.replace(tzinfo=None) - agora).total_seconds()
+                atraso = max(atraso, restante + 1)
+
+            chave = (mensagem.sessao_id, mensagem.telefone_cliente)
+            conversas[chave] = max(conversas.get(chave, 0), atraso)
+
+        db.commit()
+
+        reagendadas = 0
+        for (sessao_id, telefone_cliente), atraso in conversas.items():
+            sessao = SessaoService.obter_por_id(db, sessao_id)
+            if not sessao or not sessao.ativa or not sessao.auto_responder:
+                continue
+            MensagemService.agendar_resposta(sessao, telefone_cliente, atraso=atraso)
+            reagendadas += 1
+
+        return reagendadas
 
     @staticmethod
     def contar_mensagens_por_sessao(db: Session, sessao_id: int) -> int:
@@ -49,3 +49,75 @@ def obter_uso_ferramentas(
 ):
     """Obtém estatísticas de uso de ferramentas."""
     return MetricaService.obter_uso_ferramentas(db, sessao_id)
+
+
+@router.get("/processamento")
+def obter_metricas_processamento():
+    """Obtém métricas da fila de processamento de mensagens."""
+    return MetricaService.obter_metricas_processamento()
+
+
+@router.get("/admissao")
+def obter_metricas_admissao():
+    """Obtém métricas do controle de admissão de turnos do agente."""
+    return MetricaService.obter_metricas_admissao()
+
+
+@router.get("/deduplicacao")
+def obter_metricas_deduplicacao():
+    """Obtém métricas de mensagens duplicadas suprimidas."""
+    return MetricaService.obter_metricas_deduplicacao()
+
+
+@router.get("/envio")
+def obter_metricas_envio():
+    """Obtém métricas da fila de envio de mensagens."""
+    return MetricaService.obter_metricas_envio()
+
+
+@router.get("/segundo-plano")
+def obter_metricas_segundo_plano():
+    """Obtém métricas das tarefas de segundo plano dos turnos."""
+    return MetricaService.obter_metricas_segundo_plano()
+
+
+@router.get("/contexto")
+def obter_metricas_contexto():
+    """Obtém métricas do cache de contexto das conversas."""
+    return MetricaService.obter_metricas_contexto()
+
+
+@router.get("/catalogo-ferramentas")
+def obter_metricas_catalogo_ferramentas():
+    """Obtém métricas do catálogo de ferramentas dos agentes."""
+    return MetricaService.obter_metricas_catalogo_ferramentas()
+
+
+@router.get("/configuracoes")
+def obter_metricas_configuracoes():
+    """Obtém métricas do cache de configurações."""
+    return MetricaService.obter_metricas_configuracoes()
+
+
+@router.get("/imagens")
+def obter_metricas_imagens():
+    """Obtém métricas da otimização de imagens enviadas ao LLM."""
+    return MetricaService.obter_metricas_imagens()
+
+
+@router.get("/historico")
+def obter_metricas_historico():
+    """Obtém métricas do expurgo das mensagens descartadas pelo #limpar."""
+    return MetricaService.obter_metricas_historico()
+
+
+@router.get("/retencao")
+def obter_metricas_retencao():
+    """Obtém métricas das tarefas de retenção de dados."""
+    return MetricaService.obter_metricas_retencao()
+
+
+@router.get("/sessoes")
+def obter_metricas_sessoes():
+    """Obtém memória e threads por sessão conectada (comparação entre backends)."""
+    return MetricaService.obter_metricas_sessoes()
@@ -142,12 +142,19 @@ class MetricaService:
     def obter_metricas_periodo(
         db: Session,
         sessao_id: Optional[int] = None,
-        dias: int = 7
+        dias: int = 7,
+        incluir_arquivo: bool = True
     ) -> Dict[str, Any]:
-        """Obtém métricas de um período específico."""
+        """
+        Obtém métricas de um período específico.
+        Com `incluir_arquivo`, soma as mensagens do período que já foram para o arquivo
+        (lidas em streaming, só das partições dos dias do período).
+        """
         data_inicio = datetime.now() - timedelta(days=dias)
         
-        query = db.query(Mensagem).filter(Mensagem.criado_em >= data_inicio)
+        # Só as colunas usadas na contagem
+        query = db.query(Mensagem.criado_em, Mensagem.direcao, Mensagem.respondida)\
+            .filter(Mensagem.criado_em >= data_inicio)
         if sessao_id:
             query = query.filter(Mensagem.sessao_id == sessao_id)
         
@@ -155,8 +162,8 @@ class MetricaService:
         
         # Agrupar por dia
         mensagens_por_dia = {}
-        for msg in mensagens:
-            dia = msg.criado_em.strftime("%Y-%m-%d")
+        
+        def contar(dia: str, direcao: str, respondida: bool):
             if dia not in mensagens_por_dia:
                 mensagens_por_dia[dia] = {
                     "total": 0,
@@ -165,17 +172,31 @@ class MetricaService:
                 }
             
             mensagens_por_dia[dia]["total"] += 1
-            if msg.direcao == "recebida":
+            if direcao == "recebida":
                 mensagens_por_dia[dia]["recebidas"] += 1
-            if msg.respondida:
+            if respondida:
                 mensagens_por_dia[dia]["respondidas"] += 1
         
+        for msg in mensagens:
+            contar(msg.criado_em.strftime("%Y-%m-%d"), msg.direcao, msg.respondida)
+        total_periodo = len(mensagens)
+        
+        if incluir_arquivo:
+            from mensagem.mensagem_arquivo_service import arquivo_mensagens
+            
+            inicio_iso = data_inicio.isoformat()
+            for registro in arquivo_mensagens.ler(sessao_id or None, data_inicio.date()):
+                if (registro.get("criado_em") or "") < inicio_iso:
+                    continue
+                contar(registro["criado_em"][:10], registro.get("direcao"), registro.get("respondida"))
+                total_periodo += 1
+        
         return {
             "periodo_dias": dias,
             "data_inicio": data_inicio.strftime("%Y-%m-%d"),
             "data_fim": datetime.now().strftime("%Y-%m-%d"),
-            "mensagens_por_dia": mensagens_por_dia,
-            "total_periodo": len(mensagens)
+            "mensagens_por_dia": dict(sorted(mensagens_por_dia.items())),
+            "total_periodo": total_periodo
         }
 
     @staticmethod
@@ -208,14 +229,17 @@ class MetricaService:
 
     @staticmethod
     def obter_uso_ferramentas(db: Session, sessao_id: Optional[int] = None) -> List[Dict[str, Any]]:
-        """Obtém estatísticas de uso de ferramentas."""
-        query = db.query(Mensagem)\
+        """
+        Obtém estatísticas de uso de ferramentas.
+        Lê só a coluna `ferramentas_usadas`, em blocos, sem montar as mensagens inteiras.
+        """
+        query = db.query(Mensagem.ferramentas_usadas)\
             .filter(Mensagem.ferramentas_usadas.isnot(None))
         
         if sessao_id:
             query = query.filter(Mensagem.sessao_id == sessao_id)
         
-        mensagens = query.all()
+        mensagens = query.yield_per(500)
         
         # Contar uso de cada ferramenta
         uso_ferramentas = {}
@@ -234,3 +258,75 @@ class MetricaService:
         ]
         
         return resultado
+
+    @staticmethod
+    def obter_metricas_processamento() -> Dict[str, Any]:
+        """Obtém métricas do pool de processamento de mensagens (fila e workers)."""
+        from mensagem.mensagem_fila_service import fila_processamento
+        return fila_processamento.obter_metricas()
+
+    @staticmethod
+    def obter_metricas_admissao() -> Dict[str, Any]:
+        """Obtém métricas do controle de admissão (turnos em andamento, recusas e espera por vaga)."""
+        from mensagem.mensagem_admissao_service import controle_admissao
+        return controle_admissao.obter_metricas()
+
+    @staticmethod
+    def obter_metricas_deduplicacao() -> Dict[str, Any]:
+        """Obtém métricas da deduplicação de mensagens recebidas (reentregas suprimidas)."""
+        from mensagem.mensagem_dedup_service import deduplicador_mensagens
+        return deduplicador_mensagens.obter_metricas()
+
+    @staticmethod
+    def obter_metricas_envio() -> Dict[str, Any]:
+        """Obtém métricas da fila de envio (ritmo, retentativas e latência de envio)."""
+        from mensagem.mensagem_envio_service import fila_envio
+        return fila_envio.obter_metricas()
+
+    @staticmethod
+    def obter_metricas_segundo_plano() -> Dict[str, Any]:
+        """Obtém métricas das tarefas de segundo plano dos turnos (descrições de imagens e resumos)."""
+        from mensagem.mensagem_segundo_plano_service import tarefas_segundo_plano
+        return tarefas_segundo_plano.obter_metricas()
+
+    @staticmethod
+    def obter_metricas_contexto() -> Dict[str, Any]:
+        """Obtém métricas do cache de contexto das conversas (acertos e falhas)."""
+        from mensagem.mensagem_contexto_service import cache_contexto
+        return cache_contexto.obter_metricas()
+
+    @staticmethod
+    def obter_metricas_catalogo_ferramentas() -> Dict[str, Any]:
+        """Obtém métricas do catálogo compilado de ferramentas dos agentes (acertos e tempo de construção)."""
+        from agente.agente_catalogo_service import catalogo_ferramentas
+        return catalogo_ferramentas.obter_metricas()
+
+    @staticmethod
+    def obter_metricas_configuracoes() -> Dict[str, Any]:
+        """Obtém métricas do snapshot das configurações em memória (versão e recargas)."""
+        from config.config_cache_service import cache_configuracoes
+        return cache_configuracoes.obter_metricas()
+
+    @staticmethod
+    def obter_metricas_imagens() -> Dict[str, Any]:
+        """Obtém métricas do pré-processamento de imagens (cache e redução de tamanho)."""
+        from mensagem.mensagem_imagem_service import processador_imagens
+        return processador_imagens.obter_metricas()
+
+    @staticmethod
+    def obter_metricas_historico() -> Dict[str, Any]:
+        """Obtém métricas do expurgo do histórico descartado pelo #limpar."""
+        from mensagem.mensagem_historico_service import expurgo_historico
+        return expurgo_historico.obter_metricas()
+
+    @staticmethod
+    def obter_metricas_retencao() -> Dict[str, Any]:
+        """Obtém métricas das tarefas de retenção (arquivo de mensagens e métricas do RAG)."""
+        from mensagem.mensagem_retencao_service import retencao_dados
+        return retencao_dados.obter_metricas()
+
+    @staticmethod
+    def obter_metricas_sessoes() -> Dict[str, Any]:
+        """Obtém memória e threads do processo por sessão conectada e o backend em uso."""
+        from sessao.sessao_service import gerenciador_sessoes
+        return gerenciador_sessoes.obter_metricas()
@@ -0,0 +1,51 @@
+"""
+Ambiente do Alembic.
+Usa o mesmo engine/metadata da aplicação (database.py).
+"""
+from alembic import context
+from database import Base, engine
+
+# Importar modelos para popular o metadata (usado pelo --autogenerate)
+import config.config_model  # noqa: F401
+import sessao.sessao_model  # noqa: F401
+import mensagem.mensagem_model  # noqa: F401
+import agente.agente_model  # noqa: F401
+import ferramenta.ferramenta_model  # noqa: F401
+import ferramenta.ferramenta_variavel_model  # noqa: F401
+import rag.rag_model  # noqa: F401
+import rag.rag_metrica_model  # noqa: F401
+import mcp_client.mcp_client_model  # noqa: F401
+import mcp_client.mcp_tool_model  # noqa: F401
+import llm_providers.llm_providers_model  # noqa: F401
+
+target_metadata = Base.metadata
+
+
+def run_migrations_offline():
+    """Gera o SQL das migrações sem conectar ao banco."""
+    context.configure(
+        url=str(engine.url),
+        target_metadata=target_metadata,
+        literal_binds=True,
+        render_as_batch=engine.dialect.name == "sqlite"
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online():
+    """Aplica as migrações usando o engine da aplicação."""
+    with engine.connect() as connection:
+        context.configure(
+            connection=connection,
+            target_metadata=target_metadata,
+            render_as_batch=engine.dialect.name == "sqlite"
+        )
+        with context.begin_transaction():
+            context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
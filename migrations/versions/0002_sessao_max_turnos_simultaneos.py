@@ -0,0 +1,38 @@
+"""Limite de turnos simultâneos do agente por sessão
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0002"
+down_revision: Union[str, Sequence[str], None] = "0001"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _colunas(tabela: str) -> set:
+    """Colunas existentes (bancos novos já saem completos do create_all)."""
+    return {c["name"] for c in sa.inspect(op.get_bind()).get_columns(tabela)}
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if "max_turnos_simultaneos" not in _colunas("sessoes"):
+        op.add_column(
+            "sessoes",
+            sa.Column("max_turnos_simultaneos", sa.Integer(), nullable=True, server_default="0")
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table("sessoes") as batch_op:
+        batch_op.drop_column("max_turnos_simultaneos")
@@ -0,0 +1,74 @@
+"""Diário de processamento das mensagens recebidas (status, lease)
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0003"
+down_revision: Union[str, Sequence[str], None] = "0002"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+COLUNAS = (
+    ("status", sa.String(20)),
+    ("lease_dono", sa.String(100)),
+    ("lease_expira_em", sa.DateTime(timezone=True)),
+    ("tentativas", sa.Integer()),
+    ("resposta_id_whatsapp", sa.String(100)),
+)
+
+
+def _colunas(tabela: str) -> set:
+    """Colunas existentes (bancos novos já saem completos do create_all)."""
+    return {c["name"] for c in sa.inspect(op.get_bind()).get_columns(tabela)}
+
+
+def _indices(tabela: str) -> set:
+    """Índices existentes."""
+    return {i["name"] for i in sa.inspect(op.get_bind()).get_indexes(tabela)}
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    existentes = _colunas("mensagens")
+    for nome, tipo in COLUNAS:
+        if nome not in existentes:
+            op.add_column("mensagens", sa.Column(nome, tipo, nullable=True))
+
+    if "ix_mensagens_status" not in _indices("mensagens"):
+        op.create_index("ix_mensagens_status", "mensagens", ["status"])
+
+    # Preencher o status das mensagens recebidas antes do diário
+    mensagens = sa.table(
+        "mensagens",
+        sa.column("status", sa.String),
+        sa.column("direcao", sa.String),
+        sa.column("processada", sa.Boolean),
+        sa.column("resposta_erro", sa.Text),
+    )
+    op.execute(
+        mensagens.update()
+        .where(mensagens.c.direcao == "recebida", mensagens.c.status.is_(None))
+        .values(status=sa.case(
+            (sa.and_(mensagens.c.processada == sa.true(), mensagens.c.resposta_erro.isnot(None)), "erro"),
+            (mensagens.c.processada == sa.true(), "respondida"),
+            else_="recebida"
+        ))
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_mensagens_status", table_name="mensagens")
+    with op.batch_alter_table("mensagens") as batch_op:
+        for nome, _ in reversed(COLUNAS):
+            batch_op.drop_column(nome)
@@ -0,0 +1,60 @@
+"""Mensagem do WhatsApp única por sessão
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0004"
+down_revision: Union[str, Sequence[str], None] = "0003"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+INDICE = "uq_mensagens_sessao_mensagem_whatsapp"
+
+
+def _indices(tabela: str) -> set:
+    """Índices existentes."""
+    return {i["name"] for i in sa.inspect(op.get_bind()).get_indexes(tabela)}
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if INDICE in _indices("mensagens"):
+        return
+
+    # Duplicatas já gravadas: mantém o ID do WhatsApp só na primeira ocorrência
+    mensagens = sa.table(
+        "mensagens",
+        sa.column("id", sa.Integer),
+        sa.column("sessao_id", sa.Integer),
+        sa.column("mensagem_id_whatsapp", sa.String),
+    )
+    primeira = (
+        sa.select(sa.func.min(mensagens.c.id))
+        .where(mensagens.c.mensagem_id_whatsapp.isnot(None))
+        .group_by(mensagens.c.sessao_id, mensagens.c.mensagem_id_whatsapp)
+    )
+    op.execute(
+        mensagens.update()
+        .where(
+            mensagens.c.mensagem_id_whatsapp.isnot(None),
+            mensagens.c.id.notin_(primeira)
+        )
+        .values(mensagem_id_whatsapp=None)
+    )
+
+    op.create_index(INDICE, "mensagens", ["sessao_id", "mensagem_id_whatsapp"], unique=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(INDICE, table_name="mensagens")
@@ -0,0 +1,47 @@
+"""Marca d'água de mensagens por sessão e política de recuperação
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0005"
+down_revision: Union[str, Sequence[str], None] = "0004"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _colunas(tabela: str) -> set:
+    """Colunas existentes (bancos novos já saem completos do create_all)."""
+    return {c["name"] for c in sa.inspect(op.get_bind()).get_columns(tabela)}
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    colunas_sessoes = _colunas("sessoes")
+    if "politica_recuperacao" not in colunas_sessoes:
+        op.add_column(
+            "sessoes",
+            sa.Column("politica_recuperacao", sa.String(20), nullable=True, server_default="todas")
+        )
+    if "ultima_mensagem_em" not in colunas_sessoes:
+        op.add_column("sessoes", sa.Column("ultima_mensagem_em", sa.DateTime(), nullable=True))
+
+    if "enviado_em" not in _colunas("mensagens"):
+        op.add_column("mensagens", sa.Column("enviado_em", sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table("mensagens") as batch_op:
+        batch_op.drop_column("enviado_em")
+    with op.batch_alter_table("sessoes") as batch_op:
+        batch_op.drop_column("ultima_mensagem_em")
+        batch_op.drop_column("politica_recuperacao")
@@ -0,0 +1,55 @@
+"""Armazenamento de mídias por conteúdo
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0006"
+down_revision: Union[str, Sequence[str], None] = "0005"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _colunas(tabela: str) -> set:
+    """Colunas existentes (bancos novos já saem completos do create_all)."""
+    return {c["name"] for c in sa.inspect(op.get_bind()).get_columns(tabela)}
+
+
+def _indices(tabela: str) -> set:
+    return {i["name"] for i in sa.inspect(op.get_bind()).get_indexes(tabela)}
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if not sa.inspect(op.get_bind()).has_table("midias"):
+        op.create_table(
+            "midias",
+            sa.Column("hash", sa.String(64), primary_key=True),
+            sa.Column("mime_type", sa.String(100), nullable=True),
+            sa.Column("tamanho", sa.Integer(), nullable=False, server_default="0"),
+            sa.Column("referencias", sa.Integer(), nullable=False, server_default="0"),
+            sa.Column("criado_em", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        )
+
+    if "conteudo_midia_hash" not in _colunas("mensagens"):
+        op.add_column("mensagens", sa.Column("conteudo_midia_hash", sa.String(64), nullable=True))
+    if "ix_mensagens_conteudo_midia_hash" not in _indices("mensagens"):
+        op.create_index("ix_mensagens_conteudo_midia_hash", "mensagens", ["conteudo_midia_hash"])
+    # As imagens em base64 existentes são movidas para o armazém na inicialização
+    # (armazem_midia.migrar_legado), que também grava os arquivos.
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_mensagens_conteudo_midia_hash", table_name="mensagens")
+    with op.batch_alter_table("mensagens") as batch_op:
+        batch_op.drop_column("conteudo_midia_hash")
+    op.drop_table("midias")
@@ -0,0 +1,42 @@
+"""Descrição das imagens e imagens brutas no histórico do agente
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0007"
+down_revision: Union[str, Sequence[str], None] = "0006"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _colunas(tabela: str) -> set:
+    """Colunas existentes (bancos novos já saem completos do create_all)."""
+    return {c["name"] for c in sa.inspect(op.get_bind()).get_columns(tabela)}
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if "conteudo_imagem_descricao" not in _colunas("mensagens"):
+        op.add_column("mensagens", sa.Column("conteudo_imagem_descricao", sa.Text(), nullable=True))
+    if "imagens_brutas_historico" not in _colunas("agentes"):
+        op.add_column(
+            "agentes",
+            sa.Column("imagens_brutas_historico", sa.Integer(), nullable=True, server_default="0")
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table("agentes") as batch_op:
+        batch_op.drop_column("imagens_brutas_historico")
+    with op.batch_alter_table("mensagens") as batch_op:
+        batch_op.drop_column("conteudo_imagem_descricao")
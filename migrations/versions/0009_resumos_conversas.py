@@ -0,0 +1,47 @@
+"""Resumo acumulado das conversas
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-18 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0009"
+down_revision: Union[str, Sequence[str], None] = "0008"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if not sa.inspect(op.get_bind()).has_table("resumos_conversas"):
+        op.create_table(
+            "resumos_conversas",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column(
+                "sessao_id", sa.Integer(),
+                sa.ForeignKey("sessoes.id", ondelete="CASCADE"), nullable=False
+            ),
+            sa.Column("telefone_cliente", sa.String(20), nullable=False),
+            sa.Column("resumo", sa.Text(), nullable=False, server_default=""),
+            sa.Column("ate_mensagem_id", sa.Integer(), nullable=False, server_default="0"),
+            sa.Column("mensagens_resumidas", sa.Integer(), nullable=False, server_default="0"),
+            sa.Column("criado_em", sa.DateTime(timezone=True), server_default=sa.func.now()),
+            sa.Column("atualizado_em", sa.DateTime(timezone=True), nullable=True),
+        )
+        op.create_index("ix_resumos_conversas_id", "resumos_conversas", ["id"])
+        op.create_index(
+            "uq_resumos_conversas_sessao_telefone", "resumos_conversas",
+            ["sessao_id", "telefone_cliente"], unique=True
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("resumos_conversas")
@@ -0,0 +1,40 @@
+"""Índices compostos para listar mensagens por conversa e por sessão
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-10-18 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0010"
+down_revision: Union[str, Sequence[str], None] = "0009"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _indices(tabela: str) -> set:
+    return {i["name"] for i in sa.inspect(op.get_bind()).get_indexes(tabela)}
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    indices = _indices("mensagens")
+    if "ix_mensagens_sessao_telefone_criado" not in indices:
+        op.create_index(
+            "ix_mensagens_sessao_telefone_criado", "mensagens",
+            ["sessao_id", "telefone_cliente", "criado_em"]
+        )
+    if "ix_mensagens_sessao_criado" not in indices:
+        op.create_index("ix_mensagens_sessao_criado", "mensagens", ["sessao_id", "criado_em"])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_mensagens_sessao_criado", table_name="mensagens")
+    op.drop_index("ix_mensagens_sessao_telefone_criado", table_name="mensagens")
@@ -0,0 +1,47 @@
+"""Épocas do histórico das conversas (#limpar sem apagar na hora)
+
+Revision ID: 0011
+Revises: 0010
+Create Date: 2026-10-18 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0011"
+down_revision: Union[str, Sequence[str], None] = "0010"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if not sa.inspect(op.get_bind()).has_table("epocas_conversas"):
+        op.create_table(
+            "epocas_conversas",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column(
+                "sessao_id", sa.Integer(),
+                sa.ForeignKey("sessoes.id", ondelete="CASCADE"), nullable=False
+            ),
+            sa.Column("telefone_cliente", sa.String(20), nullable=False),
+            sa.Column("epoca", sa.Integer(), nullable=False, server_default="0"),
+            sa.Column("inicio_mensagem_id", sa.Integer(), nullable=False, server_default="0"),
+            sa.Column("reiniciado_em", sa.DateTime(), nullable=True),
+            sa.Column("expurgo_pendente", sa.Boolean(), nullable=False, server_default=sa.false()),
+            sa.Column("criado_em", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        )
+        op.create_index("ix_epocas_conversas_id", "epocas_conversas", ["id"])
+        op.create_index(
+            "uq_epocas_conversas_sessao_telefone", "epocas_conversas",
+            ["sessao_id", "telefone_cliente"], unique=True
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("epocas_conversas")
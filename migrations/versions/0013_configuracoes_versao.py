@@ -0,0 +1,34 @@
+"""Contador de versão das configurações (cache em memória entre processos)
+
+Revision ID: 0013
+Revises: 0012
+Create Date: 2026-10-18 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0013"
+down_revision: Union[str, Sequence[str], None] = "0012"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if not sa.inspect(op.get_bind()).has_table("configuracoes_versao"):
+        op.create_table(
+            "configuracoes_versao",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("versao", sa.Integer(), nullable=False, server_default="0"),
+            sa.Column("atualizado_em", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("configuracoes_versao")
@@ -203,24 +203,35 @@ class RAGMetricaService:
         ]
 
     @staticmethod
-    def deletar_metricas_antigas(db: Session, dias: int = 90) -> int:
+    def deletar_metricas_antigas(db: Session, dias: int = 90, lote: int = 1000) -> int:
         """
-        Deleta métricas mais antigas que X dias.
+        Deleta métricas mais antigas que X dias, em lotes (uma transação curta por lote).
+        Executado periodicamente pela retenção de dados (`retencao_dados`).
         
         Args:
             db: Sessão do banco
             dias: Idade máxima das métricas em dias
+            lote: Métricas deletadas por transação
             
         Returns:
             Número de métricas deletadas
         """
         data_limite = datetime.now() - timedelta(days=dias)
         
-        count = db.query(RAGMetrica).filter(
-            RAGMetrica.criado_em < data_limite
-        ).delete()
+        count = 0
+        while True:
+            ids = [
+                id_metrica for (id_metrica,) in db.query(RAGMetrica.id)
+                .filter(RAGMetrica.criado_em < data_limite)
+                .limit(lote)
+                .all()
+            ]
+            if not ids:
+                break
+            db.query(RAGMetrica).filter(RAGMetrica.id.in_(ids)).delete(synchronize_session=False)
+            db.commit()
+            count += len(ids)
         
-        db.commit()
-        logger.info(f"Deletadas {count} métricas com mais de {dias} dias")
+        if count:
+            logger.info(f"Deletadas {count} métricas com mais de {dias} dias")
         return count
-
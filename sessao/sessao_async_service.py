@@ -0,0 +1,234 @@
+"""
+Backend assíncrono das sessões WhatsApp.
+Em vez de uma thread bloqueada em `cliente.connect()` e callbacks em threads próprias
+por sessão, todas as sessões rodam como tarefas de um único event loop (o loop do
+cliente asyncio do Neonize), executado em uma thread dedicada.
+"""
+from typing import Optional, Dict, Any, Coroutine
+from concurrent.futures import ThreadPoolExecutor, Future
+from datetime import datetime
+import asyncio
+import threading
+
+
+class LoopSessoes:
+    """
+    Event loop compartilhado pelas sessões assíncronas.
+
+    O Neonize agenda os callbacks no seu loop global (`event_global_loop`); este
+    gerenciador o executa em uma única thread e permite que o restante da aplicação
+    (workers, rotas) agende corrotinas nele.
+    """
+
+    def __init__(self, max_threads: int = 64):
+        # Chamadas ao Go são executadas pelo executor padrão do loop
+        self.max_threads = max_threads
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def configurar(self, max_threads: Optional[int] = None):
+        """Ajusta o tamanho do executor. Só tem efeito antes de iniciar."""
+        if max_threads is not None:
+            self.max_threads = max(1, int(max_threads))
+
+    def iniciar(self):
+        """Inicia a thread do loop (idempotente)."""
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+
+            from neonize.aioze.events import event_global_loop
+            self.loop = event_global_loop
+            self.loop.set_default_executor(
+                ThreadPoolExecutor(max_workers=self.max_threads, thread_name_prefix="neonize-async")
+            )
+            self._thread = threading.Thread(target=self._executar, name="loop-sessoes", daemon=True)
+            self._thread.start()
+            print(f"🔁 [SESSOES] Loop assíncrono iniciado (executor: {self.max_threads} threads)")
+
+    def _executar(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def em_execucao(self) -> bool:
+        return bool(self._thread and self._thread.is_alive())
+
+    def agendar(self, corrotina: Coroutine) -> Future:
+        """Agenda uma corrotina no loop a partir de qualquer thread."""
+        self.iniciar()
+        return asyncio.run_coroutine_threadsafe(corrotina, self.loop)
+
+    def executar(self, corrotina: Coroutine, timeout: Optional[float] = None) -> Any:
+        """
+        Executa uma corrotina no loop e aguarda o resultado.
+        Não pode ser chamado de dentro do próprio loop (use `await`).
+        """
+        if threading.current_thread() is self._thread:
+            corrotina.close()
+            raise RuntimeError("executar() chamado dentro do loop das sessões; use await")
+        return self.agendar(corrotina).result(timeout)
+
+    def parar(self):
+        """Para o loop (no encerramento da aplicação)."""
+        if self.em_execucao():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join(timeout=5)
+            print("🛑 [SESSOES] Loop assíncrono parado")
+
+    def obter_metricas(self) -> Dict[str, Any]:
+        """Retorna o estado do loop e o número de tarefas agendadas nele."""
+        tarefas = 0
+        if self.em_execucao():
+            try:
+                tarefas = len(asyncio.all_tasks(self.loop))
+            except RuntimeError:
+                pass
+        return {
+            "ativo": self.em_execucao(),
+            "tarefas": tarefas,
+            "max_threads_executor": self.max_threads
+        }
+
+
+class ClienteAssincrono:
+    """
+    Adaptador síncrono de um `NewAClient`.
+
+    Expõe os mesmos métodos do cliente síncrono (`send_message`, `download_any`,
+    `send_video`...), executando cada corrotina no loop das sessões e aguardando o
+    resultado. Assim os serviços que usam `gerenciador_sessoes.obter_cliente()` não
+    precisam saber qual backend está em uso.
+    """
+
+    assincrono = True
+
+    def __init__(self, cliente, loop_sessoes: LoopSessoes, timeout: float = 60.0):
+        self.cliente = cliente
+        self.loop_sessoes = loop_sessoes
+        self.timeout = timeout
+
+    def __getattr__(self, nome: str):
+        atributo = getattr(self.cliente, nome)
+        if not asyncio.iscoroutinefunction(atributo):
+            return atributo
+
+        def chamar(*args, **kwargs):
+            return self.loop_sessoes.executar(atributo(*args, **kwargs), self.timeout)
+
+        return chamar
+
+    def encerrar(self):
+        """Desconecta o cliente e encerra a tarefa de conexão no loop."""
+        async def _encerrar():
+            try:
+                await self.cliente.disconnect()
+            finally:
+                await self.cliente.stop()
+
+        self.loop_sessoes.executar(_encerrar(), timeout=10)
+
+
+class SessaoAssincronaService:
+    """Criação de clientes WhatsApp no backend assíncrono."""
+
+    @staticmethod
+    def criar_cliente(sessao_id: int, db_path: str, reconexao: bool = False) -> ClienteAssincrono:
+        """
+        Cria um `NewAClient` com os callbacks da sessão e inicia a conexão no loop
+        compartilhado. O cliente retornado já está registrado no gerenciador.
+
+        Args:
+            sessao_id: ID da sessão
+            db_path: Banco do Neonize da sessão
+            reconexao: True ao reconectar com banco salvo (QR Code não é esperado)
+        """
+        from neonize.aioze.client import NewAClient
+        from neonize.aioze.events import MessageEv, ConnectedEv, PairStatusEv
+        from sessao.sessao_service import SessaoService, gerenciador_sessoes
+
+        loop_sessoes.iniciar()
+        cliente = NewAClient(db_path)
+        telefone_pareado = None
+        # Mensagens recebidas, na ordem de chegada, à espera de entrar na fila de processamento
+        entrada: asyncio.Queue = asyncio.Queue()
+
+        @cliente.qr
+        async def on_qr(cli: NewAClient, qr_data: bytes):
+            if reconexao:
+                print("⚠️  QR Code gerado durante reconexão (não esperado)")
+                return
+            try:
+                await asyncio.to_thread(SessaoService.salvar_qr_code, sessao_id, qr_data)
+            except Exception as e:
+                print(f"❌ Erro ao processar QR Code: {e}")
+
+        @cliente.event(PairStatusEv)
+        async def on_pair_status(cli: NewAClient, event: PairStatusEv):
+            nonlocal telefone_pareado
+            if hasattr(event, 'ID') and hasattr(event.ID, 'User'):
+                telefone_pareado = event.ID.User
+                print(f"📱 Telefone pareado: {telefone_pareado}")
+
+        @cliente.event(ConnectedEv)
+        async def on_connected(cli: NewAClient, event: ConnectedEv):
+            print(f"🎉 Sessão {sessao_id} conectada (backend assíncrono)")
+            telefone = telefone_pareado
+            if not telefone and cli.me and hasattr(cli.me, 'User'):
+                telefone = cli.me.User
+            if not telefone:
+                try:
+                    telefone = (await cli.get_me()).JID.User
+                except Exception as e:
+                    print(f"⚠️  get_me() falhou: {e}")
+            await asyncio.to_thread(SessaoService.marcar_conectada, sessao_id, telefone)
+
+        @cliente.event(MessageEv)
+        async def on_message(cli: NewAClient, event: MessageEv):
+            try:
+                if hasattr(event.Info, 'IsFromMe') and event.Info.IsFromMe:
+                    return
+                print(f"📨 Mensagem NOVA recebida de {event.Info.MessageSource.Sender}")
+                entrada.put_nowait(event)
+            except Exception as e:
+                print(f"❌ Erro no handler de mensagem: {e}")
+
+        async def entregar_mensagens():
+            # Uma mensagem por vez, para manter a ordem. O enfileiramento pode esperar vaga
+            # (até o timeout da fila): roda no executor compartilhado do loop, e uma fila
+            # cheia só atrasa esta sessão
+            loop = asyncio.get_running_loop()
+            while True:
+                event = await entrada.get()
+                try:
+                    await loop.run_in_executor(None, SessaoService.enfileirar_mensagem_recebida, sessao_id, event)
+                except Exception as e:
+                    print(f"❌ Erro ao enfileirar mensagem da sessão {sessao_id}: {e}")
+
+        async def conectar():
+            consumidor = asyncio.ensure_future(entregar_mensagens())
+            try:
+                tarefa = await cliente.connect()
+            except BaseException:
+                consumidor.cancel()
+                raise
+
+            def ao_terminar(t: asyncio.Task):
+                consumidor.cancel()
+                if t.cancelled() or t.exception() is None:
+                    return
+                print(f"❌ Erro na conexão da sessão {sessao_id}: {t.exception()}")
+                loop_sessoes.loop.run_in_executor(None, SessaoService.marcar_erro, sessao_id)
+
+            tarefa.add_done_callback(ao_terminar)
+            return tarefa
+
+        adaptador = ClienteAssincrono(cliente, loop_sessoes)
+        gerenciador_sessoes.adicionar_cliente(sessao_id, adaptador)
+        gerenciador_sessoes.tarefas[sessao_id] = loop_sessoes.executar(conectar(), timeout=30)
+        print(f"🚀 Sessão {sessao_id} conectando no loop assíncrono ({datetime.now():%H:%M:%S})")
+        return adaptador
+
+
+# Instância global do loop das sessões assíncronas
+loop_sessoes = LoopSessoes()
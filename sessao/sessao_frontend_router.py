@@ -193,6 +193,10 @@ def criar_sessao_post(
     top_p: str = Form(None),
     auto_responder: str = Form(None),
     salvar_historico: str = Form(None),
+    janela_agrupamento_segundos: int = Form(0),
+    max_turnos_simultaneos: int = Form(0),
+    politica_recuperacao: str = Form("todas"),
+    retencao_dias: int = Form(0),
     db: Session = Depends(get_db)
 ):
     """Cria uma nova sessão via formulário."""
@@ -216,7 +220,11 @@ def criar_sessao_post(
             max_tokens=max_tokens if max_tokens else None,
             top_p=top_p if top_p else None,
             auto_responder=auto_responder_bool,
-            salvar_historico=salvar_historico_bool
+            salvar_historico=salvar_historico_bool,
+            janela_agrupamento_segundos=janela_agrupamento_segundos,
+            max_turnos_simultaneos=max_turnos_simultaneos,
+            politica_recuperacao=politica_recuperacao,
+            retencao_dias=retencao_dias
         )
         
         SessaoService.criar(db, sessao_data)
@@ -242,6 +250,10 @@ def atualizar_sessao_post(
     top_p: str = Form(None),
     auto_responder: str = Form(None),
     salvar_historico: str = Form(None),
+    janela_agrupamento_segundos: int = Form(None),
+    max_turnos_simultaneos: int = Form(None),
+    politica_recuperacao: str = Form(None),
+    retencao_dias: int = Form(None),
     ativa: str = Form(None),
     db: Session = Depends(get_db)
 ):
@@ -278,6 +290,14 @@ def atualizar_sessao_post(
             update_data["auto_responder"] = auto_responder == "true"
         if salvar_historico is not None:
             update_data["salvar_historico"] = salvar_historico == "true"
+        if janela_agrupamento_segundos is not None:
+            update_data["janela_agrupamento_segundos"] = janela_agrupamento_segundos
+        if max_turnos_simultaneos is not None:
+            update_data["max_turnos_simultaneos"] = max_turnos_simultaneos
+        if politica_recuperacao is not None:
+            update_data["politica_recuperacao"] = politica_recuperacao
+        if retencao_dias is not None:
+            update_data["retencao_dias"] = retencao_dias
         if ativa is not None:
             update_data["ativa"] = ativa == "true"
         
@@ -22,6 +22,14 @@ class Sessao(Base):
     ativa = Column(Boolean, default=True)
     auto_responder = Column(Boolean, default=True)
     salvar_historico = Column(Boolean, default=True)
+    janela_agrupamento_segundos = Column(Integer, default=0)  # Agrupa mensagens seguidas do contato (0 = desativado)
+    max_turnos_simultaneos = Column(Integer, default=0)  # Respostas do agente em paralelo (0 = sem limite)
+    politica_recuperacao = Column(String(20), default="todas")  # Mensagens enviadas com a sessão offline: todas, ultima, nenhuma
+    retencao_dias = Column(Integer, default=0)  # Dias no banco antes de ir para o arquivo (0 = padrão global)
+    
+    # Marca d'água: horário (Info.Timestamp) da mensagem mais recente já recebida.
+    # Na reconexão, mensagens anteriores a ela são histórico sincronizado e são ignoradas.
+    ultima_mensagem_em = Column(DateTime, nullable=True)
     
     # Agente ativo (qual agente está respondendo no momento)
     agente_ativo_id = Column(Integer, ForeignKey("agentes.id"), nullable=True, index=True)
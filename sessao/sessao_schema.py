@@ -11,6 +11,22 @@ class SessaoBase(BaseModel):
     nome: str = Field(..., description="Nome identificador da sessão")
     auto_responder: bool = Field(default=True, description="Auto responder mensagens")
     salvar_historico: bool = Field(default=True, description="Salvar histórico de mensagens")
+    janela_agrupamento_segundos: int = Field(
+        default=0, ge=0, le=60,
+        description="Segundos aguardando novas mensagens do contato antes de responder (0 = desativado)"
+    )
+    max_turnos_simultaneos: int = Field(
+        default=0, ge=0, le=100,
+        description="Máximo de respostas do agente em andamento ao mesmo tempo (0 = sem limite)"
+    )
+    politica_recuperacao: str = Field(
+        default="todas", pattern="^(todas|ultima|nenhuma)$",
+        description="Mensagens enviadas enquanto a sessão estava offline: responder todas, só a última de cada contato, ou nenhuma"
+    )
+    retencao_dias: int = Field(
+        default=0, ge=0, le=3650,
+        description="Dias que as mensagens ficam no banco antes de irem para o arquivo (0 = padrão global)"
+    )
 
 
 class SessaoCriar(SessaoBase):
@@ -23,6 +39,10 @@ class SessaoAtualizar(BaseModel):
     nome: Optional[str] = None
     auto_responder: Optional[bool] = None
     salvar_historico: Optional[bool] = None
+    janela_agrupamento_segundos: Optional[int] = Field(default=None, ge=0, le=60)
+    max_turnos_simultaneos: Optional[int] = Field(default=None, ge=0, le=100)
+    politica_recuperacao: Optional[str] = Field(default=None, pattern="^(todas|ultima|nenhuma)$")
+    retencao_dias: Optional[int] = Field(default=None, ge=0, le=3650)
     ativa: Optional[bool] = None
     agente_ativo_id: Optional[int] = None
 
@@ -38,6 +58,7 @@ class SessaoResposta(SessaoBase):
     criado_em: datetime
     atualizado_em: Optional[datetime] = None
     ultima_conexao: Optional[datetime] = None
+    ultima_mensagem_em: Optional[datetime] = None
 
     class Config:
         from_attributes = True
@@ -2,27 +2,91 @@
 Serviço de lógica de negócio para sessões WhatsApp.
 """
 from sqlalchemy.orm import Session
-from typing import Optional, List, Dict
+from sqlalchemy import or_
+from typing import Optional, List, Dict, Any
 from datetime import datetime
 import asyncio
 import threading
+import sys
+import time
 import segno
 import io
 import base64
 from neonize.client import NewClient
 from neonize.events import MessageEv, ConnectedEv, QREv, PairStatusEv
-from neonize.utils import build_jid
 from sessao.sessao_model import Sessao
 from sessao.sessao_schema import SessaoCriar, SessaoAtualizar, SessaoStatusResposta
 
 
+# Folga entre o relógio local e o do WhatsApp ao comparar horários de mensagens (segundos).
+# Mensagens dentro da folga passam pelo filtro e a deduplicação descarta as repetidas.
+TOLERANCIA_RELOGIO = 60
+
+# Intervalo mínimo (segundos) entre gravações no banco da marca d'água das sessões; entre elas
+# a marca avança só em memória. Perder o último intervalo (queda do processo) só faz o history
+# sync reenviar mensagens que a deduplicação pelo banco descarta
+INTERVALO_GRAVACAO_MARCAS = 30
+
+# Backends de conexão: "thread" (uma thread bloqueada em connect() por sessão) ou
+# "async" (todas as sessões no loop compartilhado, ver sessao_async_service)
+BACKENDS_WHATSAPP = ("thread", "async")
+
+
+def _ler_status_processo() -> Dict[str, int]:
+    """
+    Lê VmRSS (KB) e o total de threads do SO (inclui as do runtime Go) de /proc.
+    Fora do Linux, só o pico de memória (`memoria_pico_kb`), quando disponível.
+    """
+    status = {}
+    try:
+        with open("/proc/self/status") as arquivo:
+            for linha in arquivo:
+                if linha.startswith("VmRSS:"):
+                    status["memoria_rss_kb"] = int(linha.split()[1])
+                elif linha.startswith("Threads:"):
+                    status["threads_sistema"] = int(linha.split()[1])
+    except OSError:
+        try:
+            import resource  # Não existe no Windows
+        except ImportError:
+            return status
+        pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss vem em bytes no macOS e em KB nos demais
+        status["memoria_pico_kb"] = pico // 1024 if sys.platform == "darwin" else pico
+    return status
+
+
 class GerenciadorSessoes:
     """Gerenciador global de sessões WhatsApp."""
     
     def __init__(self):
+        self.backend = "thread"
         self.clientes: Dict[int, NewClient] = {}
         self.threads: Dict[int, threading.Thread] = {}
+        # Tarefas de conexão das sessões no backend assíncrono
+        self.tarefas: Dict[int, asyncio.Task] = {}
         self.qr_codes: Dict[int, str] = {}
+        # Filtro de history sync por sessão (timestamps em segundos)
+        self.conectado_em: Dict[int, float] = {}
+        self.marcas_dagua: Dict[int, float] = {}
+        self.politicas_recuperacao: Dict[int, str] = {}
+        # Marca d'água a gravar (horário da mensagem mais recente recebida), por sessão.
+        # Separada de marcas_dagua, o filtro da conexão atual, que não avança durante a
+        # conexão: mensagens enviadas com a sessão offline chegam depois das novas
+        self.marcas_pendentes: Dict[int, float] = {}
+        self._lock_marcas = threading.Lock()
+        self._marcas_gravadas_em = time.time()
+    
+    def configurar(self, backend: Optional[str] = None, max_threads_async: Optional[int] = None):
+        """Define o backend das próximas conexões e o executor do loop assíncrono."""
+        if backend is not None:
+            if backend not in BACKENDS_WHATSAPP:
+                print(f"⚠️  [SESSOES] Backend desconhecido '{backend}', usando 'thread'")
+                backend = "thread"
+            self.backend = backend
+        if max_threads_async is not None:
+            from sessao.sessao_async_service import loop_sessoes
+            loop_sessoes.configurar(max_threads=max_threads_async)
     
     def obter_cliente(self, sessao_id: int) -> Optional[NewClient]:
         """Obtém o cliente WhatsApp de uma sessão."""
@@ -38,8 +102,130 @@ class GerenciadorSessoes:
             del self.clientes[sessao_id]
         if sessao_id in self.threads:
             del self.threads[sessao_id]
+        self.tarefas.pop(sessao_id, None)
         if sessao_id in self.qr_codes:
             del self.qr_codes[sessao_id]
+        self.conectado_em.pop(sessao_id, None)
+        self.marcas_dagua.pop(sessao_id, None)
+        self.politicas_recuperacao.pop(sessao_id, None)
+    
+    def registrar_conexao(
+        self,
+        sessao_id: int,
+        ultima_mensagem_em: Optional[datetime],
+        politica_recuperacao: Optional[str]
+    ) -> float:
+        """
+        Registra o início de uma conexão e carrega a marca d'água da sessão.
+        Na primeira conexão (sem marca), todo o histórico anterior é ignorado.
+        
+        Returns:
+            Marca d'água em vigor (timestamp em segundos)
+        """
+        agora = time.time()
+        self.conectado_em[sessao_id] = agora
+        marca = ultima_mensagem_em.timestamp() if ultima_mensagem_em else agora
+        with self._lock_marcas:
+            # Avanço ainda não gravado (reconexão no mesmo processo)
+            marca = max(marca, self.marcas_pendentes.get(sessao_id, marca))
+        self.marcas_dagua[sessao_id] = marca
+        self.politicas_recuperacao[sessao_id] = politica_recuperacao or "todas"
+        return marca
+    
+    def avancar_marca_dagua(self, sessao_id: int, timestamp: float) -> bool:
+        """
+        Avança em memória a marca d'água a gravar (nunca retrocede).
+
+        Returns:
+            True se já passou INTERVALO_GRAVACAO_MARCAS desde a última gravação
+            (quem chama grava as marcas pendentes, ver SessaoService.gravar_marcas_dagua)
+        """
+        agora = time.time()
+        with self._lock_marcas:
+            if timestamp > self.marcas_pendentes.get(sessao_id, 0):
+                self.marcas_pendentes[sessao_id] = timestamp
+            if agora - self._marcas_gravadas_em < INTERVALO_GRAVACAO_MARCAS:
+                return False
+            self._marcas_gravadas_em = agora
+            return True
+    
+    def retirar_marcas_pendentes(self, sessao_id: Optional[int] = None) -> Dict[int, float]:
+        """Retira as marcas pendentes de gravação (de todas as sessões, ou de uma)."""
+        with self._lock_marcas:
+            if sessao_id is None:
+                marcas, self.marcas_pendentes = self.marcas_pendentes, {}
+                return marcas
+            marca = self.marcas_pendentes.pop(sessao_id, None)
+            return {sessao_id: marca} if marca is not None else {}
+    
+    def classificar_mensagem(self, sessao_id: int, timestamp: float) -> str:
+        """
+        Classifica uma mensagem recebida pelo seu horário no WhatsApp (Info.Timestamp).
+        
+        Returns:
+            "antiga" - anterior à marca d'água: histórico sincronizado, ignorar
+            "atrasada" - enviada enquanto a sessão estava offline (ver política de recuperação)
+            "nova" - enviada com a sessão conectada
+        """
+        marca = self.marcas_dagua.get(sessao_id)
+        if marca is not None and timestamp < marca - TOLERANCIA_RELOGIO:
+            return "antiga"
+        
+        conectado_em = self.conectado_em.get(sessao_id)
+        if conectado_em is not None and timestamp < conectado_em - TOLERANCIA_RELOGIO:
+            return "atrasada"
+        return "nova"
+    
+    def aceitar_mensagem(self, sessao_id: int, timestamp: float) -> bool:
+        """Aplica o filtro de history sync e a política de recuperação da sessão."""
+        situacao = self.classificar_mensagem(sessao_id, timestamp)
+        if situacao == "antiga":
+            print(f"⏭️  Mensagem ignorada: history sync (anterior à marca d'água da sessão {sessao_id})")
+            return False
+        if situacao == "atrasada" and self.politicas_recuperacao.get(sessao_id) == "nenhuma":
+            print(f"⏭️  Mensagem ignorada: enviada com a sessão {sessao_id} offline (política: nenhuma)")
+            return False
+        return True
+    
+    def encerrar(self):
+        """Encerra os clientes do backend assíncrono e o loop compartilhado."""
+        from sessao.sessao_async_service import loop_sessoes
+        for sessao_id in list(self.tarefas):
+            cliente = self.clientes.get(sessao_id)
+            try:
+                if cliente is not None:
+                    cliente.encerrar()
+            except Exception as e:
+                print(f"⚠️  Erro ao encerrar sessão {sessao_id}: {e}")
+        loop_sessoes.parar()
+    
+    def obter_metricas(self) -> Dict[str, Any]:
+        """
+        Retorna memória e threads do processo, totais e por sessão conectada,
+        para comparar os backends de conexão.
+        """
+        status = _ler_status_processo()
+        sessoes = len(self.clientes)
+        threads_processo = threading.active_count()
+        metricas = {
+            "backend": self.backend,
+            "sessoes": sessoes,
+            "sessoes_thread": len(self.threads),
+            "sessoes_async": len(self.tarefas),
+            "threads_conexao": sum(1 for t in self.threads.values() if t.is_alive()),
+            "threads_processo": threads_processo,
+            "threads_sistema": status.get("threads_sistema"),
+            "memoria_rss_kb": status.get("memoria_rss_kb"),
+            "memoria_pico_kb": status.get("memoria_pico_kb"),
+            "threads_por_sessao": round(threads_processo / sessoes, 2) if sessoes else None,
+            "memoria_por_sessao_kb": (
+                round(status["memoria_rss_kb"] / sessoes) if sessoes and status.get("memoria_rss_kb") else None
+            )
+        }
+        if self.tarefas:
+            from sessao.sessao_async_service import loop_sessoes
+            metricas["loop_assincrono"] = loop_sessoes.obter_metricas()
+        return metricas
 
 
 # Instância global do gerenciador
@@ -113,6 +299,9 @@ class SessaoService:
 
         db.commit()
         db.refresh(db_sessao)
+        
+        if "politica_recuperacao" in update_data and sessao_id in gerenciador_sessoes.politicas_recuperacao:
+            gerenciador_sessoes.politicas_recuperacao[sessao_id] = db_sessao.politica_recuperacao
         return db_sessao
 
     @staticmethod
@@ -126,10 +315,207 @@ class SessaoService:
         if db_sessao.status == "conectado":
             SessaoService.desconectar(db, sessao_id)
 
+        from mensagem.mensagem_model import Mensagem, ResumoConversa, EpocaConversa
+        from mensagem.mensagem_midia_service import armazem_midia
+        # Uma referência por mensagem: as mensagens saem em cascata com a sessão
+        hashes = [
+            hash_midia for (hash_midia,) in db.query(Mensagem.conteudo_midia_hash)
+            .filter(Mensagem.sessao_id == sessao_id, Mensagem.conteudo_midia_hash.isnot(None))
+            .all()
+        ]
+        db.query(ResumoConversa).filter(ResumoConversa.sessao_id == sessao_id).delete()
+        db.query(EpocaConversa).filter(EpocaConversa.sessao_id == sessao_id).delete()
         db.delete(db_sessao)
         db.commit()
+        armazem_midia.liberar(hashes)
+        
+        from mensagem.mensagem_contexto_service import cache_contexto
+        cache_contexto.invalidar_sessao(sessao_id)
         return True
 
+    @staticmethod
+    def registrar_conexao(db_sessao: Sessao):
+        """
+        Registra no gerenciador o início da conexão da sessão, com a marca d'água
+        persistida. Na primeira conexão a marca passa a ser o horário atual.
+        O commit fica a cargo de quem chama.
+        """
+        marca = gerenciador_sessoes.registrar_conexao(
+            db_sessao.id,
+            db_sessao.ultima_mensagem_em,
+            db_sessao.politica_recuperacao
+        )
+        if db_sessao.ultima_mensagem_em is None:
+            db_sessao.ultima_mensagem_em = datetime.fromtimestamp(marca)
+        print(f"⏰ Conexão registrada (marca d'água: {datetime.fromtimestamp(marca):%d/%m %H:%M:%S})")
+
+    @staticmethod
+    def gravar_marcas_dagua(sessao_id: Optional[int] = None):
+        """
+        Grava no banco as marcas d'água pendentes (em memória, ver
+        GerenciadorSessoes.avancar_marca_dagua), de todas as sessões ou de uma.
+        Usa sua própria sessão do banco; a marca gravada nunca retrocede.
+        """
+        from database import SessionLocal
+
+        marcas = gerenciador_sessoes.retirar_marcas_pendentes(sessao_id)
+        if not marcas:
+            return
+        db = SessionLocal()
+        try:
+            for id_sessao, marca in marcas.items():
+                enviado_em = datetime.fromtimestamp(marca)
+                db.query(Sessao)\
+                    .filter(
+                        Sessao.id == id_sessao,
+                        or_(Sessao.ultima_mensagem_em.is_(None), Sessao.ultima_mensagem_em < enviado_em)
+                    )\
+                    .update({Sessao.ultima_mensagem_em: enviado_em}, synchronize_session=False)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"⚠️  Erro ao gravar as marcas d'água: {e}")
+            # Voltam a ficar pendentes para a próxima gravação
+            for id_sessao, marca in marcas.items():
+                gerenciador_sessoes.avancar_marca_dagua(id_sessao, marca)
+        finally:
+            db.close()
+
+    @staticmethod
+    def salvar_qr_code(sessao_id: int, qr_data: bytes) -> str:
+        """
+        Converte o QR Code recebido do Neonize em PNG base64 e o grava no gerenciador
+        e no banco. Chamado pelos callbacks (usa sua própria sessão do banco).
+        """
+        qr_string = qr_data.decode('utf-8')
+        print(f"🔍 QR String recebida: {qr_string[:50]}...")
+        
+        # Gerar QR Code como PNG
+        qr = segno.make(qr_string)
+        buffer = io.BytesIO()
+        qr.save(buffer, kind='png', scale=8)
+        buffer.seek(0)
+        
+        # Converter para base64
+        png_data = buffer.read()
+        base64_png = base64.b64encode(png_data).decode('utf-8')
+        print(f"🖼️  PNG gerado: {len(base64_png)} chars")
+        
+        # Salvar no gerenciador
+        gerenciador_sessoes.qr_codes[sessao_id] = base64_png
+        print(f"💾 Salvo no gerenciador: {sessao_id}")
+        
+        # Atualizar banco em nova sessão (thread-safe)
+        from database import SessionLocal
+        db_thread = SessionLocal()
+        try:
+            sessao_db = db_thread.query(Sessao).filter(Sessao.id == sessao_id).first()
+            if sessao_db:
+                sessao_db.qr_code = base64_png
+                sessao_db.qr_code_gerado_em = datetime.now()  # Timestamp
+                sessao_db.status = "conectando_qr"
+                db_thread.commit()
+                print(f"✅ Banco atualizado para sessão {sessao_id}")
+            else:
+                print(f"⚠️  Sessão {sessao_id} não encontrada no banco")
+        finally:
+            db_thread.close()
+        
+        print(f"📱 QR Code gerado para sessão {sessao_id} (PNG base64, {len(base64_png)} chars)")
+        return base64_png
+
+    @staticmethod
+    def marcar_conectada(sessao_id: int, telefone: Optional[str], limpar_qr_code: bool = True):
+        """
+        Atualiza a sessão após o evento Connected: marca d'água, telefone e status.
+        Chamado pelos callbacks (usa sua própria sessão do banco).
+        """
+        from database import SessionLocal
+        db_thread = SessionLocal()
+        try:
+            sessao_db = db_thread.query(Sessao).filter(Sessao.id == sessao_id).first()
+            if sessao_db:
+                # Horário de conexão e marca d'água (filtro de history sync)
+                SessaoService.registrar_conexao(sessao_db)
+                sessao_db.telefone = telefone
+                sessao_db.status = "conectado"
+                if limpar_qr_code:
+                    sessao_db.qr_code = None
+                    sessao_db.qr_code_gerado_em = None
+                sessao_db.ultima_conexao = datetime.now()
+                db_thread.commit()
+                print(f"✅ Sessão {sessao_db.nome} conectada com sucesso! Telefone: {telefone}")
+            else:
+                print(f"⚠️  Sessão {sessao_id} não encontrada no banco")
+        finally:
+            db_thread.close()
+        
+        # Limpar QR Code do gerenciador
+        if limpar_qr_code and sessao_id in gerenciador_sessoes.qr_codes:
+            del gerenciador_sessoes.qr_codes[sessao_id]
+            print(f"🧹 QR Code removido do gerenciador")
+
+    @staticmethod
+    def marcar_erro(sessao_id: int):
+        """Marca a sessão com status "erro" (falha na conexão). Usa sua própria sessão do banco."""
+        from database import SessionLocal
+        db_thread = SessionLocal()
+        try:
+            sessao_db = db_thread.query(Sessao).filter(Sessao.id == sessao_id).first()
+            if sessao_db:
+                sessao_db.status = "erro"
+                db_thread.commit()
+        finally:
+            db_thread.close()
+
+    @staticmethod
+    def enfileirar_mensagem_recebida(sessao_id: int, event: MessageEv) -> bool:
+        """
+        Envia uma mensagem recebida para o pool de processamento.
+        Mensagens da mesma conversa (sessão + telefone) são processadas em ordem,
+        uma de cada vez; conversas diferentes são processadas em paralelo.
+        Chamado pelos callbacks do Neonize; não bloqueia além do timeout da fila.
+
+        Se o agente ainda estiver respondendo a este contato, o turno em andamento
+        é cancelado: a nova mensagem será respondida junto com as anteriores.
+
+        Mensagens do history sync (anteriores à marca d'água da sessão) e reentregas
+        de uma mensagem já vista (mesmo ID do WhatsApp) são descartadas aqui, antes
+        de qualquer acesso ao banco ou chamada ao LLM.
+        """
+        from mensagem.mensagem_fila_service import fila_processamento
+        from mensagem.mensagem_dedup_service import deduplicador_mensagens
+        from mensagem.mensagem_service import MensagemService
+
+        if not gerenciador_sessoes.aceitar_mensagem(sessao_id, MensagemService.extrair_timestamp(event)):
+            return False
+
+        mensagem_id = event.Info.ID
+        if not deduplicador_mensagens.registrar(sessao_id, mensagem_id):
+            print(f"♻️  [FILA] Mensagem duplicada descartada: {mensagem_id}")
+            return False
+
+        telefone_cliente = MensagemService.extrair_telefone_cliente(event)
+        chave = (sessao_id, telefone_cliente)
+
+        async def tarefa(db_worker: Session):
+            await MensagemService.processar_mensagem_recebida(db_worker, sessao_id, event)
+
+        enfileirada = fila_processamento.enviar(
+            tarefa,
+            descricao=f"sessao {sessao_id} / {telefone_cliente} / msg {mensagem_id}",
+            chave=chave
+        )
+        if not enfileirada:
+            # Não processada: uma reentrega futura deve ser aceita
+            deduplicador_mensagens.esquecer(sessao_id, mensagem_id)
+
+        if enfileirada and MensagemService.torna_turno_obsoleto(event):
+            if fila_processamento.cancelar(chave):
+                print(f"🛑 [FILA] Cancelando resposta em andamento para {telefone_cliente}")
+
+        return enfileirada
+
     @staticmethod
     def conectar(db: Session, sessao_id: int, usar_paircode: bool = False) -> SessaoStatusResposta:
         """Conecta uma sessão WhatsApp usando QR Code."""
@@ -185,6 +571,23 @@ class SessaoService:
             db_path = f"./sessoes/sessao_{sessao_id}.db"
             print(f"💾 Usando banco de dados: {db_path}")
             
+            if gerenciador_sessoes.backend == "async":
+                # Backend assíncrono: callbacks e conexão no loop compartilhado das sessões
+                from sessao.sessao_async_service import SessaoAssincronaService
+                SessaoService.registrar_conexao(db_sessao)
+                SessaoAssincronaService.criar_cliente(sessao_id, db_path)
+                
+                db_sessao.status = "iniciando"
+                db.commit()
+                return SessaoStatusResposta(
+                    id=db_sessao.id,
+                    nome=db_sessao.nome,
+                    status="iniciando",
+                    telefone=None,
+                    qr_code=None,
+                    mensagem="Iniciando conexão via QR Code..."
+                )
+            
             # Criar cliente Neonize (conforme examples/basic.py)
             cliente = NewClient(db_path)
             print(f"✅ Cliente criado")
@@ -195,41 +598,7 @@ class SessaoService:
             def custom_qr_handler(cli: NewClient, qr_data: bytes):
                 """Captura QR Code e converte para PNG base64."""
                 try:
-                    qr_string = qr_data.decode('utf-8')
-                    print(f"🔍 QR String recebida: {qr_string[:50]}...")
-                    
-                    # Gerar QR Code como PNG
-                    qr = segno.make(qr_string)
-                    buffer = io.BytesIO()
-                    qr.save(buffer, kind='png', scale=8)
-                    buffer.seek(0)
-                    
-                    # Converter para base64
-                    png_data = buffer.read()
-                    base64_png = base64.b64encode(png_data).decode('utf-8')
-                    print(f"🖼️  PNG gerado: {len(base64_png)} chars")
-                    
-                    # Salvar no gerenciador
-                    gerenciador_sessoes.qr_codes[sessao_id] = base64_png
-                    print(f"💾 Salvo no gerenciador: {sessao_id}")
-                    
-                    # Atualizar banco em nova sessão (thread-safe)
-                    from database import SessionLocal
-                    db_thread = SessionLocal()
-                    try:
-                        sessao_db = db_thread.query(Sessao).filter(Sessao.id == sessao_id).first()
-                        if sessao_db:
-                            sessao_db.qr_code = base64_png
-                            sessao_db.qr_code_gerado_em = datetime.now()  # Timestamp
-                            sessao_db.status = "conectando_qr"
-                            db_thread.commit()
-                            print(f"✅ Banco atualizado para sessão {sessao_id}")
-                        else:
-                            print(f"⚠️  Sessão {sessao_id} não encontrada no banco")
-                    finally:
-                        db_thread.close()
-                    
-                    print(f"📱 QR Code gerado para sessão {sessao_id} (PNG base64, {len(base64_png)} chars)")
+                    SessaoService.salvar_qr_code(sessao_id, qr_data)
                 except Exception as e:
                     print(f"❌ Erro ao processar QR Code: {e}")
                     import traceback
@@ -258,11 +627,6 @@ class SessaoService:
                 print(f"🎉 EVENTO CONNECTED DISPARADO!")
                 print(f"📊 Status: {event.status if hasattr(event, 'status') else 'N/A'}")
                 
-                # IMPORTANTE: Atualizar timestamp de conexão AQUI
-                import time
-                gerenciador_sessoes.clientes[f"{sessao_id}_connected_at"] = time.time()
-                print(f"⏰ Timestamp de conexão atualizado")
-                
                 # Tentar obter telefone de várias fontes
                 telefone = telefone_pareado
                 
@@ -289,28 +653,7 @@ class SessaoService:
                 
                 print(f"📱 Telefone final: {telefone}")
                 
-                # Atualizar banco em nova sessão (thread-safe)
-                from database import SessionLocal
-                db_thread = SessionLocal()
-                try:
-                    sessao_db = db_thread.query(Sessao).filter(Sessao.id == sessao_id).first()
-                    if sessao_db:
-                        sessao_db.telefone = telefone
-                        sessao_db.status = "conectado"
-                        sessao_db.qr_code = None
-                        sessao_db.qr_code_gerado_em = None
-                        sessao_db.ultima_conexao = datetime.now()
-                        db_thread.commit()
-                        print(f"✅ Sessão {sessao_db.nome} conectada com sucesso! Telefone: {telefone}")
-                    else:
-                        print(f"⚠️  Sessão {sessao_id} não encontrada no banco")
-                finally:
-                    db_thread.close()
-                
-                # Limpar QR Code do gerenciador
-                if sessao_id in gerenciador_sessoes.qr_codes:
-                    del gerenciador_sessoes.qr_codes[sessao_id]
-                    print(f"🧹 QR Code removido do gerenciador")
+                SessaoService.marcar_conectada(sessao_id, telefone)
 
             @cliente.event(MessageEv)
             def on_message(client: NewClient, event: MessageEv):
@@ -320,50 +663,11 @@ class SessaoService:
                     if hasattr(event.Info, 'IsFromMe') and event.Info.IsFromMe:
                         return
                     
-                    # Ignorar mensagens dos primeiros 30 segundos (history sync)
-                    import time
-                    connected_at = gerenciador_sessoes.clientes.get(f"{sessao_id}_connected_at", 0)
-                    if time.time() - connected_at < 5:
-                        print(f"⏭️  Ignorando mensagem (history sync - primeiros 5s)")
-                        return
-                    
                     sender_jid = event.Info.MessageSource.Sender
                     print(f"📨 Mensagem NOVA recebida de {sender_jid}")
                     
-                    # Processar mensagem em thread separada (síncrona)
-                    def processar_thread():
-                        from database import SessionLocal
-                        from mensagem.mensagem_service import MensagemService
-                        
-                        # Criar nova sessão do banco (thread-safe)
-                        db_thread = SessionLocal()
-                        try:
-                            # Processar mensagem de forma síncrona
-                            import asyncio
-                            
-                            # Criar event loop para esta thread
-                            loop = asyncio.new_event_loop()
-                            asyncio.set_event_loop(loop)
-                            
-                            try:
-                                loop.run_until_complete(
-                                    MensagemService.processar_mensagem_recebida(
-                                        db_thread, sessao_id, event
-                                    )
-                                )
-                            finally:
-                                loop.close()
-                                
-                        except Exception as e:
-                            print(f"❌ Erro ao processar mensagem: {e}")
-                            import traceback
-                            traceback.print_exc()
-                        finally:
-                            db_thread.close()
-                    
-                    # Executar em thread separada
-                    thread = threading.Thread(target=processar_thread, daemon=True)
-                    thread.start()
+                    # Processar mensagem no pool de workers
+                    SessaoService.enfileirar_mensagem_recebida(sessao_id, event)
                     
                 except Exception as e:
                     print(f"❌ Erro no handler de mensagem: {e}")
@@ -373,9 +677,8 @@ class SessaoService:
             # Adicionar cliente ao gerenciador
             gerenciador_sessoes.adicionar_cliente(sessao_id, cliente)
             
-            # Timestamp de quando conectou (para ignorar history sync)
-            import time
-            gerenciador_sessoes.clientes[f"{sessao_id}_connected_at"] = time.time()
+            # Horário de conexão e marca d'água (filtro de history sync)
+            SessaoService.registrar_conexao(db_sessao)
 
             # Conectar em thread separada
             def conectar_thread():
@@ -388,17 +691,7 @@ class SessaoService:
                     print(f"❌ Erro ao conectar sessão {sessao_id}: {e}")
                     import traceback
                     traceback.print_exc()
-                    
-                    # Atualizar banco em nova sessão
-                    from database import SessionLocal
-                    db_thread = SessionLocal()
-                    try:
-                        sessao_db = db_thread.query(Sessao).filter(Sessao.id == sessao_id).first()
-                        if sessao_db:
-                            sessao_db.status = "erro"
-                            db_thread.commit()
-                    finally:
-                        db_thread.close()
+                    SessaoService.marcar_erro(sessao_id)
 
             print(f"🚀 Criando thread de conexão para sessão {sessao_id}")
             thread = threading.Thread(target=conectar_thread, daemon=True)
@@ -452,6 +745,13 @@ class SessaoService:
                 return
             
             print(f"📦 Criando cliente com banco salvo: {db_path}")
+            if gerenciador_sessoes.backend == "async":
+                from sessao.sessao_async_service import SessaoAssincronaService
+                SessaoService.registrar_conexao(db_sessao)
+                db.commit()
+                SessaoAssincronaService.criar_cliente(sessao_id, db_path, reconexao=True)
+                return
+            
             # Criar cliente Neonize (conforme examples/basic.py)
             cliente = NewClient(db_path)
             
@@ -475,11 +775,6 @@ class SessaoService:
                 nonlocal telefone_pareado
                 print(f"🎉 Sessão {sessao_id} reconectada!")
                 
-                # IMPORTANTE: Atualizar timestamp de conexão AQUI
-                import time
-                gerenciador_sessoes.clientes[f"{sessao_id}_connected_at"] = time.time()
-                print(f"⏰ Timestamp de conexão atualizado")
-                
                 telefone = telefone_pareado
                 if not telefone:
                     try:
@@ -497,17 +792,7 @@ class SessaoService:
                         pass
                 
                 # Atualizar banco
-                from database import SessionLocal
-                db_thread = SessionLocal()
-                try:
-                    sessao_db = db_thread.query(Sessao).filter(Sessao.id == sessao_id).first()
-                    if sessao_db:
-                        sessao_db.telefone = telefone
-                        sessao_db.status = "conectado"
-                        sessao_db.ultima_conexao = datetime.now()
-                        db_thread.commit()
-                finally:
-                    db_thread.close()
+                SessaoService.marcar_conectada(sessao_id, telefone, limpar_qr_code=False)
             
             @cliente.event(MessageEv)
             def on_message(client: NewClient, event: MessageEv):
@@ -520,53 +805,17 @@ class SessaoService:
                         print(f"⏭️  Mensagem ignorada: IsFromMe=True")
                         return
                     
-                    # Verificar filtro de tempo
-                    import time
-                    connected_at = gerenciador_sessoes.clientes.get(f"{sessao_id}_connected_at", 0)
-                    tempo_desde_conexao = time.time() - connected_at
-                    print(f"⏱️  Tempo desde conexão: {tempo_desde_conexao:.1f}s (limite: 5s)")
-                    
-                    if tempo_desde_conexao < 5:
-                        print(f"⏭️  Mensagem ignorada: history sync ({tempo_desde_conexao:.1f}s < 5s)")
-                        return
-                    
                     sender_jid = event.Info.MessageSource.Sender
                     print(f"📨 Mensagem NOVA recebida de {sender_jid}")
                     
-                    def processar_thread():
-                        from database import SessionLocal
-                        from mensagem.mensagem_service import MensagemService
-                        
-                        db_thread = SessionLocal()
-                        try:
-                            import asyncio
-                            loop = asyncio.new_event_loop()
-                            asyncio.set_event_loop(loop)
-                            try:
-                                loop.run_until_complete(
-                                    MensagemService.processar_mensagem_recebida(
-                                        db_thread, sessao_id, event
-                                    )
-                                )
-                            finally:
-                                loop.close()
-                        except Exception as e:
-                            print(f"❌ Erro ao processar mensagem: {e}")
-                            import traceback
-                            traceback.print_exc()
-                        finally:
-                            db_thread.close()
-                    
-                    thread = threading.Thread(target=processar_thread, daemon=True)
-                    thread.start()
+                    SessaoService.enfileirar_mensagem_recebida(sessao_id, event)
                 except Exception as e:
                     print(f"❌ Erro no handler de mensagem: {e}")
             
             # Adicionar cliente ao gerenciador
             gerenciador_sessoes.adicionar_cliente(sessao_id, cliente)
-            
-            import time
-            gerenciador_sessoes.clientes[f"{sessao_id}_connected_at"] = time.time()
+            SessaoService.registrar_conexao(db_sessao)
+            db.commit()
             
             # Conectar em thread separada
             def conectar_thread():
@@ -574,15 +823,7 @@ class SessaoService:
                     cliente.connect()
                 except Exception as e:
                     print(f"❌ Erro ao reconectar sessão {sessao_id}: {e}")
-                    from database import SessionLocal
-                    db_thread = SessionLocal()
-                    try:
-                        sessao_db = db_thread.query(Sessao).filter(Sessao.id == sessao_id).first()
-                        if sessao_db:
-                            sessao_db.status = "erro"
-                            db_thread.commit()
-                    finally:
-                        db_thread.close()
+                    SessaoService.marcar_erro(sessao_id)
             
             thread = threading.Thread(target=conectar_thread, daemon=True)
             thread.start()
@@ -604,18 +845,24 @@ class SessaoService:
         cliente = gerenciador_sessoes.obter_cliente(sessao_id)
         if cliente:
             try:
-                # Desconectar cliente
-                # Note: Neonize não tem método disconnect explícito
-                # O cliente será desconectado quando a thread terminar
-                pass
+                if getattr(cliente, "assincrono", False):
+                    # Backend assíncrono: encerra a tarefa de conexão no loop compartilhado
+                    cliente.encerrar()
+                # Backend thread: Neonize não tem método disconnect explícito;
+                # o cliente será desconectado quando a thread terminar
             except Exception as e:
                 print(f"Erro ao desconectar: {e}")
 
         gerenciador_sessoes.remover_cliente(sessao_id)
 
-        # Atualizar status
+        # Atualizar status (e gravar a marca d'água ainda só em memória)
         db_sessao.status = "desconectado"
         db_sessao.qr_code = None
+        marca = gerenciador_sessoes.retirar_marcas_pendentes(sessao_id).get(sessao_id)
+        if marca is not None:
+            enviado_em = datetime.fromtimestamp(marca)
+            if db_sessao.ultima_mensagem_em is None or db_sessao.ultima_mensagem_em < enviado_em:
+                db_sessao.ultima_mensagem_em = enviado_em
         db.commit()
 
         return SessaoStatusResposta(
@@ -653,7 +900,9 @@ class SessaoService:
         telefone_destino: str,
         texto: str
     ) -> bool:
-        """Envia uma mensagem através de uma sessão."""
+        """Envia uma mensagem através de uma sessão (pela fila de envio, aguardando a entrega)."""
+        from mensagem.mensagem_envio_service import fila_envio
+        
         db_sessao = SessaoService.obter_por_id(db, sessao_id)
         if not db_sessao:
             raise ValueError("Sessão não encontrada")
@@ -666,11 +915,13 @@ class SessaoService:
             raise ValueError("Cliente WhatsApp não encontrado")
 
         try:
-            # Construir JID
-            jid = build_jid(telefone_destino)
-            
             # Enviar mensagem
-            cliente.send_message(jid, text=texto)
+            fila_envio.enviar(
+                sessao_id,
+                telefone_destino,
+                texto,
+                descricao=f"api / {telefone_destino}"
+            ).result(timeout=120)
             
             return True
         except Exception as e: